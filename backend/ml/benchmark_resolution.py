@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Training speed, inference latency and accuracy of the multimodal model across image resolutions
+
+Each configuration is trained from the same seed on the same split (train_multimodal.py, not saved),
+then its folded serving model is timed on single requests and on batches of constant-plane images,
+as create_synthetic_images builds them. The table is relative to the first configuration.
+
+    python benchmark_resolution.py [--sizes 224,64,32] [--encoder-widths 64] [--epochs 10]
+                                   [--batch-size 64] [--repeats 50] [--output results.json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+
+import numpy as np
+import torch
+
+from multimodal_service import fold_for_inference
+from train_multimodal import train_multimodal_model
+
+
+def inference_latency(model, size, batch_size, repeats):
+    """(median single-row ms, per-row ms of a batch) for the serving forward at `size`"""
+    device = next(model.parameters()).device
+    tabular_dim = model.tabular_encoder[0].in_features
+    generator = torch.Generator().manual_seed(0)
+    tabular = torch.randn(batch_size, tabular_dim, generator=generator).to(device)
+    images = torch.rand(batch_size, 3, 1, 1, generator=generator).expand(-1, -1, size, size).contiguous().to(device)
+
+    served = fold_for_inference(model)
+    with torch.no_grad():
+        served(tabular[:1], images[:1])
+        single = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            served(tabular[:1], images[:1])
+            single.append((time.perf_counter() - started) * 1000)
+        batches = max(1, repeats // 10)
+        started = time.perf_counter()
+        for _ in range(batches):
+            served(tabular, images)
+        batch_ms = (time.perf_counter() - started) * 1000 / batches
+    return float(np.median(single)), batch_ms / batch_size
+
+
+def run(sizes, widths, epochs=10, batch_size=64, repeats=50, verbose=False):
+    rows = []
+    for width in widths:
+        for size in sizes:
+            print(f"🔄 {size}x{size} images, encoder width {width} ({epochs} epochs)...", file=sys.stderr)
+            torch.manual_seed(42)
+            # The trainer's per-epoch log is only wanted with --verbose
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(sys.stderr if verbose else devnull):
+                result = train_multimodal_model(batch_size=batch_size, epochs=epochs, save=False,
+                                                image_size=size, encoder_width=width)
+            single_ms, batch_row_ms = inference_latency(result['model'], size, batch_size, repeats)
+            rows.append({
+                'image_size': size,
+                'encoder_width': width,
+                'parameters': sum(p.numel() for p in result['model'].parameters()),
+                # float32 images of one training batch
+                'batch_images_mb': round(batch_size * 3 * size * size * 4 / 2 ** 20, 2),
+                'epochs': result['epochs'],
+                'first_epoch_seconds': result['first_epoch_seconds'],
+                'mean_epoch_seconds': result['mean_epoch_seconds'],
+                'single_row_ms': round(single_ms, 3),
+                'batch_row_ms': round(batch_row_ms, 4),
+                'r2_score': float(result['r2_score']),
+                'mae': float(result['mae']),
+            })
+    return rows
+
+
+def print_table(rows):
+    reference = rows[0]
+    print(f"\n📊 {'config':<16}{'params':>10}{'img MB':>9}{'epoch s':>10}{'speedup':>9}"
+          f"{'1-row ms':>10}{'batch ms/row':>14}{'R²':>9}{'MAE':>9}")
+    for row in rows:
+        label = f"{row['image_size']}px w{row['encoder_width']}"
+        speedup = reference['mean_epoch_seconds'] / max(row['mean_epoch_seconds'], 1e-9)
+        print(f"   {label:<16}{row['parameters']:>10,}{row['batch_images_mb']:>9.2f}{row['mean_epoch_seconds']:>10.2f}"
+              f"{speedup:>8.1f}x{row['single_row_ms']:>10.2f}{row['batch_row_ms']:>14.3f}"
+              f"{row['r2_score']:>9.4f}{row['mae']:>9.2f}")
+    best = max(rows, key=lambda row: row['r2_score'])
+    print(f"🏆 Best R² {best['r2_score']:.4f} at {best['image_size']}px, encoder width {best['encoder_width']}")
+
+
+def parse_ints(text):
+    return [int(value) for value in text.split(',') if value.strip()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare multimodal image resolutions and encoder widths')
+    parser.add_argument('--sizes', type=parse_ints, default=[224, 64, 32],
+                        help='comma-separated image sides; the first is the reference row')
+    parser.add_argument('--encoder-widths', type=parse_ints, default=[64])
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--repeats', type=int, default=50, help='single-row inference timings per configuration')
+    parser.add_argument('--output', help='also write the rows as JSON')
+    parser.add_argument('--verbose', action='store_true', help='show the trainer log on stderr')
+    args = parser.parse_args()
+
+    rows = run(args.sizes, args.encoder_widths, args.epochs, args.batch_size, args.repeats, args.verbose)
+    print_table(rows)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(rows, f, indent=2)
+        print(f"💾 Results written to {args.output}")
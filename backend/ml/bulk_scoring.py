@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+"""
+Sharded bulk scoring - national-scale yield predictions across worker processes and hosts
+
+    python bulk_scoring.py generate grid.csv --crops Rice Wheat --years 2020 2021   # stateDistricts.js grid
+    python bulk_scoring.py plan grid.csv jobs/run1 --shard-rows 50000                # split into shards
+    python bulk_scoring.py run jobs/run1 --workers 4                                 # local coordinator
+    python bulk_scoring.py worker jobs/run1                                          # on each extra host
+    python bulk_scoring.py status jobs/run1
+    python bulk_scoring.py merge jobs/run1 predictions.parquet
+
+The job directory is the only coordination point, so any host that mounts it (NFS, EFS, ...) can run
+`worker`. A worker claims a shard by creating its lock file exclusively, refreshes the lock while
+scoring, and publishes the result with an atomic rename; a finished shard's output file is its
+checkpoint, so reruns and extra workers skip it. Locks not refreshed within the lease are taken over;
+each lock carries its owner's token, so a slow former owner never refreshes or releases its successor's.
+
+Features are built with the same encoders and defaults as the online Random Forest path
+(notebook_model.encode_feature_matrix, or production_model's build_feature_vector layout), and the
+model version is pinned in the manifest so every shard is scored by the same artifact.
+"""
+import os
+import re
+import sys
+import json
+import time
+import socket
+import secrets
+import argparse
+import multiprocessing
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from model_registry import get_registry, discover
+
+STATE_DISTRICTS_JS = Path(__file__).parent.parent / 'notebooks' / 'stateDistricts.js'
+INPUT_COLUMNS = ['state', 'district', 'crop', 'season', 'year', 'area']
+DEFAULT_CROPS = ['Rice', 'Wheat', 'Maize', 'Sugarcane', 'Cotton']
+DEFAULT_SEASONS = ['Kharif', 'Rabi']
+
+LEASE_SECONDS = float(os.environ.get('BULK_LEASE_SECONDS', 600))
+CHUNK_ROWS = 8192
+
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def read_table(path):
+    path = Path(path)
+    if path.suffix == '.parquet':
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+
+def write_table(frame, path):
+    """Write atomically (tmp file + rename) so a half-written shard never looks finished"""
+    path = Path(path)
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    if path.suffix == '.parquet':
+        frame.to_parquet(tmp_path, index=False)
+    else:
+        frame.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_state_districts(js_path=STATE_DISTRICTS_JS):
+    """{state: [districts]} parsed from the frontend's stateDistricts.js"""
+    text = Path(js_path).read_text(encoding='utf-8')
+    states = {}
+    current = None
+    for line in text.splitlines():
+        key = re.match(r'^\s*(?:"([^"]+)"|([A-Za-z_]\w*))\s*:\s*\[', line)
+        if key:
+            current = states.setdefault((key.group(1) or key.group(2)).strip(), [])
+            # Short lists sit on the key's line: CHANDIGARH: ["CHANDIGARH"],
+            line = line[key.end():]
+        if current is not None:
+            for name in re.findall(r'"((?:[^"\\]|\\.)*)"', line):
+                # Some entries carry a literal "\n" from copy-paste
+                name = name.replace('\\n', '').strip()
+                if name:
+                    current.append(name)
+            if ']' in line:
+                current = None
+    return states
+
+
+def generate_grid(crops, seasons, years, areas, js_path=STATE_DISTRICTS_JS):
+    """Every district x crop x season x year x farm area, in the INPUT_COLUMNS layout"""
+    locations = [(state, district) for state, districts in load_state_districts(js_path).items()
+                 for district in districts]
+    index = pd.MultiIndex.from_product([range(len(locations)), crops, seasons, years, areas],
+                                       names=['location', 'crop', 'season', 'year', 'area'])
+    grid = index.to_frame(index=False)
+    states, districts = zip(*locations)
+    grid.insert(0, 'state', np.array(states, dtype=object)[grid['location']])
+    grid.insert(1, 'district', np.array(districts, dtype=object)[grid['location']])
+    return grid.drop(columns='location')
+
+
+def resolve_model(name):
+    """'auto' mirrors the router's Random Forest tier: notebook artifact, else production"""
+    if name == 'auto':
+        name = 'notebook' if discover('notebook') else 'production'
+    handle = get_registry().get(name)
+    return name, handle
+
+
+class Job:
+    """A bulk scoring job directory: manifest, shard inputs, claims and finished outputs"""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.manifest_path = self.directory / 'manifest.json'
+        self.inputs = self.directory / 'inputs'
+        self.claims = self.directory / 'claims'
+        self.outputs = self.directory / 'outputs'
+        self._manifest = None
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            with open(self.manifest_path) as f:
+                self._manifest = json.load(f)
+        return self._manifest
+
+    def shard_name(self, shard):
+        return f"shard-{shard:05d}.{self.manifest['format']}"
+
+    def output_path(self, shard):
+        return self.outputs / self.shard_name(shard)
+
+    def claim_path(self, shard):
+        return self.claims / f'shard-{shard:05d}.lock'
+
+    def done(self, shard):
+        return self.output_path(shard).exists()
+
+    def plan(self, input_path, model='auto', shard_rows=50000, output_format=None):
+        output_format = output_format or ('parquet' if parquet_available() else 'csv')
+        if output_format == 'parquet' and not parquet_available():
+            raise RuntimeError('Parquet output needs pyarrow: pip install pyarrow (or use --format csv)')
+
+        frame = read_table(input_path)
+        frame.columns = frame.columns.str.strip()
+        missing = [col for col in INPUT_COLUMNS[:5] if col not in frame.columns]
+        if missing:
+            raise ValueError(f"Input is missing columns {missing}; expected {INPUT_COLUMNS}")
+
+        model, handle = resolve_model(model)
+        for directory in (self.inputs, self.claims, self.outputs):
+            directory.mkdir(parents=True, exist_ok=True)
+
+        shard_count = max(1, -(-len(frame) // shard_rows))
+        self._manifest = {
+            'input': str(Path(input_path).resolve()),
+            'rows': len(frame),
+            'shards': shard_count,
+            'shard_rows': shard_rows,
+            'format': output_format,
+            'model': model,
+            'model_version': handle.version,
+            'model_path': str(handle.path),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S')
+        }
+        for shard in range(shard_count):
+            write_table(frame.iloc[shard * shard_rows:(shard + 1) * shard_rows], self.inputs / self.shard_name(shard))
+        # Manifest last: its presence means the shard inputs are complete
+        tmp_path = self.manifest_path.with_name('.manifest.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self._manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+        return self._manifest
+
+    def claim(self, shard, worker_id):
+        """Exclusively claim a shard and return the claim's owner token, or None when it is held
+
+        A claim whose lease expired is taken over.
+        """
+        path = self.claim_path(shard)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                age = time.time() - path.stat().st_mtime
+            except FileNotFoundError:
+                return None
+            if age < LEASE_SECONDS:
+                return None
+            # Rename is atomic: only one of several workers can move the stale claim away
+            stale_path = path.with_name(f'{path.name}.stale.{worker_id}')
+            try:
+                os.replace(path, stale_path)
+            except FileNotFoundError:
+                return None
+            stale_path.unlink()
+            return self.claim(shard, worker_id)
+        token = f'{worker_id}-{secrets.token_hex(8)}'
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'worker': worker_id, 'token': token, 'claimed_at': time.time()}, f)
+        return token
+
+    @staticmethod
+    def _owner(path):
+        """Token of the claim at path, None when it is gone or unreadable"""
+        try:
+            with open(path) as f:
+                return json.load(f).get('token')
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def heartbeat(self, shard, token):
+        """Refresh the lease, unless the claim has been taken over by another worker"""
+        path = self.claim_path(shard)
+        if self._owner(path) != token:
+            return
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def release(self, shard, token):
+        """Delete the claim if it is still ours; a successor's claim is left in place"""
+        path = self.claim_path(shard)
+        if self._owner(path) != token:
+            return
+        # Move it aside first, so a takeover between the check and the delete is noticed and undone
+        aside = path.with_name(f'{path.name}.release.{token}')
+        try:
+            os.replace(path, aside)
+        except FileNotFoundError:
+            return
+        if self._owner(aside) != token:
+            try:
+                os.link(aside, path)
+            except FileExistsError:
+                pass
+        aside.unlink()
+
+    def next_shard(self, worker_id):
+        """(shard, owner token) of the next shard this worker claimed, (None, None) when none are left"""
+        for shard in range(self.manifest['shards']):
+            if self.done(shard):
+                continue
+            token = self.claim(shard, worker_id)
+            if token is not None:
+                if self.done(shard):
+                    # Finished between the check and the claim
+                    self.release(shard, token)
+                    continue
+                return shard, token
+        return None, None
+
+    def status(self):
+        done = [s for s in range(self.manifest['shards']) if self.done(s)]
+        claimed = [s for s in range(self.manifest['shards'])
+                   if s not in done and self.claim_path(s).exists()]
+        return {
+            'shards': self.manifest['shards'],
+            'done': len(done),
+            'in_progress': len(claimed),
+            'pending': self.manifest['shards'] - len(done) - len(claimed),
+            'rows': self.manifest['rows']
+        }
+
+
+class NotebookScorer:
+    """crop_yield_model.pkl, with notebook_model.predict_yield's features and rounding"""
+
+    def __init__(self, payload):
+        self.model = payload['model']
+        self.encoders = payload['encoders']
+
+    def features(self, frame):
+        from notebook_model import encode_feature_matrix
+        records = frame[INPUT_COLUMNS if 'area' in frame else INPUT_COLUMNS[:5]].to_dict('records')
+        return encode_feature_matrix(self.encoders, records)
+
+    def score(self, frame):
+        predictions = self.model.predict(self.features(frame))
+        areas = frame['area'].to_numpy(dtype=np.float64) if 'area' in frame else np.full(len(frame), 100.0)
+        return {
+            'predicted_yield': [max(0, round(float(p), 2)) for p in predictions],
+            'total_production': [max(0, round(float(p * a * 1000))) for p, a in zip(predictions, areas)]
+        }
+
+
+class ProductionScorer:
+    """trained_crop_model.pkl, in production_model.build_feature_vector's layout and defaults"""
+
+    def __init__(self, payload):
+        from production_model import ENVIRONMENT_COLUMNS
+        self.model = payload['model']
+        self.feature_cols = payload['feature_cols']
+        self.tables = {col: {label: code for code, label in enumerate(encoder.classes_)}
+                       for col, encoder in payload['encoders'].items()}
+        self.environment = {col: (key, default) for key, (col, default) in ENVIRONMENT_COLUMNS.items()}
+
+    def features(self, frame):
+        from district_features import get_index
+        n_rows = len(frame)
+        states = frame['state'].tolist() if 'state' in frame else [None] * n_rows
+        # District priors fill the state and environmental inputs a row leaves out, as in build_feature_vector
+        index = get_index()
+        if index is not None:
+            priors, resolved = index.join(states, frame['district'].tolist(), frame['season'].tolist())
+        else:
+            priors, resolved = None, [None] * n_rows
+        states = [state if isinstance(state, str) and state else (known or 'Uttar Pradesh')
+                  for state, known in zip(states, resolved)]
+        sources = {'State': states, 'District': frame['district'], 'Crop': frame['crop'], 'Season': frame['season']}
+
+        X = np.empty((n_rows, len(self.feature_cols)), dtype=np.float64)
+        for j, col in enumerate(self.feature_cols):
+            if col.endswith('_encoded'):
+                name = col[:-len('_encoded')]
+                table = self.tables[name]
+                X[:, j] = [table.get(value, 0) for value in sources[name]]
+            elif col == 'Crop_Year':
+                X[:, j] = frame['year'].astype(int)
+            elif col == 'Area':
+                X[:, j] = frame['area'] if 'area' in frame else 100.0
+            else:
+                key, default = self.environment[col]
+                fallback = priors[:, index.features.index(key)] if priors is not None else np.full(n_rows, default)
+                X[:, j] = frame[key].fillna(pd.Series(fallback, index=frame.index)) if key in frame else fallback
+        return X
+
+    def score(self, frame):
+        predictions = self.model.predict(self.features(frame))
+        areas = frame['area'].to_numpy(dtype=np.float64) if 'area' in frame else np.full(len(frame), 100.0)
+        predictions = np.maximum(predictions, 0)
+        return {'predicted_yield': predictions, 'total_production': np.round(predictions * areas * 1000)}
+
+
+SCORERS = {'notebook': NotebookScorer, 'production': ProductionScorer}
+
+
+def score_shard(job, shard, scorer, token):
+    frame = read_table(job.inputs / job.shard_name(shard))
+    columns = {'predicted_yield': [], 'total_production': []}
+    for start in range(0, len(frame), CHUNK_ROWS):
+        chunk = scorer.score(frame.iloc[start:start + CHUNK_ROWS])
+        for key in columns:
+            columns[key].extend(chunk[key])
+        job.heartbeat(shard, token)
+    result = frame.assign(**columns)
+    write_table(result, job.output_path(shard))
+    return len(result)
+
+
+def run_worker(job_dir, worker_id=None):
+    """Claim and score shards until none are left; returns the number of shards this worker finished"""
+    job = Job(job_dir)
+    worker_id = worker_id or f'{socket.gethostname()}-{os.getpid()}'
+    manifest = job.manifest
+    handle = get_registry().get(manifest['model'], manifest['model_version'])
+    scorer = SCORERS[manifest['model']](handle.payload)
+
+    finished = 0
+    while True:
+        shard, token = job.next_shard(worker_id)
+        if shard is None:
+            return finished
+        started = time.perf_counter()
+        try:
+            rows = score_shard(job, shard, scorer, token)
+        finally:
+            job.release(shard, token)
+        finished += 1
+        print(f"✅ [{worker_id}] shard {shard} ({rows} rows) in {time.perf_counter() - started:.1f}s",
+              file=sys.stderr)
+
+
+def _worker_process(args):
+    job_dir, index = args
+    return run_worker(job_dir, f'{socket.gethostname()}-local{index}')
+
+
+def run_local(job_dir, workers):
+    """Local coordinator: N worker processes on this host, as a stand-in for N hosts"""
+    started = time.perf_counter()
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers) as pool:
+        finished = pool.map(_worker_process, [(str(job_dir), i) for i in range(workers)])
+    status = Job(job_dir).status()
+    print(f"🏁 {sum(finished)} shard(s) scored by {workers} worker(s) in {time.perf_counter() - started:.1f}s; "
+          f"{status['done']}/{status['shards']} done")
+    return status
+
+
+def merge(job_dir, output_path):
+    """Concatenate finished shard outputs in shard order into one CSV or Parquet file"""
+    job = Job(job_dir)
+    status = job.status()
+    if status['done'] != status['shards']:
+        raise RuntimeError(f"{status['shards'] - status['done']} shard(s) not finished yet; run more workers first")
+
+    output_path = Path(output_path)
+    paths = [job.output_path(shard) for shard in range(status['shards'])]
+    tmp_path = output_path.with_name(f'.{output_path.name}.tmp')
+    if output_path.suffix == '.parquet':
+        if not parquet_available():
+            raise RuntimeError('Parquet output needs pyarrow: pip install pyarrow')
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        writer = None
+        for path in paths:
+            if path.suffix == '.parquet':
+                table = pq.read_table(path)
+            else:
+                table = pa.Table.from_pandas(read_table(path), preserve_index=False)
+            writer = writer or pq.ParquetWriter(tmp_path, table.schema)
+            writer.write_table(table)
+        writer.close()
+    else:
+        # Stream shard by shard so the merged result never has to fit in memory
+        for i, path in enumerate(paths):
+            read_table(path).to_csv(tmp_path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+    os.replace(tmp_path, output_path)
+    print(f"💾 Merged {status['rows']} rows from {len(paths)} shards into {output_path}")
+    return output_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sharded bulk yield scoring')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate = commands.add_parser('generate', help='district x crop x season x year x area grid')
+    generate.add_argument('output')
+    generate.add_argument('--crops', nargs='+', default=DEFAULT_CROPS)
+    generate.add_argument('--seasons', nargs='+', default=DEFAULT_SEASONS)
+    generate.add_argument('--years', nargs='+', type=int, default=[2024])
+    generate.add_argument('--areas', nargs='+', type=float, default=[100.0], help='farm areas (hectares)')
+
+    plan = commands.add_parser('plan', help='split an input table into shards')
+    plan.add_argument('input')
+    plan.add_argument('job_dir')
+    plan.add_argument('--model', choices=['auto', 'notebook', 'production'], default='auto')
+    plan.add_argument('--shard-rows', type=int, default=50000)
+    plan.add_argument('--format', choices=['parquet', 'csv'], default=None)
+
+    run = commands.add_parser('run', help='score all shards with local worker processes')
+    run.add_argument('job_dir')
+    run.add_argument('--workers', type=int, default=None,
+                     help='default: the tuned forest worker count in thread_config.json, else one per CPU')
+
+    worker = commands.add_parser('worker', help='score shards of a job on a shared filesystem')
+    worker.add_argument('job_dir')
+
+    status = commands.add_parser('status')
+    status.add_argument('job_dir')
+
+    merge_parser = commands.add_parser('merge', help='combine finished shards into one .csv/.parquet')
+    merge_parser.add_argument('job_dir')
+    merge_parser.add_argument('output')
+
+    args = parser.parse_args()
+    try:
+        if args.command == 'generate':
+            grid = generate_grid(args.crops, args.seasons, args.years, args.areas)
+            write_table(grid, args.output)
+            print(f"💾 {len(grid)} rows written to {args.output}")
+        elif args.command == 'plan':
+            manifest = Job(args.job_dir).plan(args.input, args.model, args.shard_rows, args.format)
+            print(json.dumps(manifest, indent=2))
+        elif args.command == 'run':
+            workers = args.workers
+            if workers is None:
+                from thread_tuning import tuned_workers
+                workers = tuned_workers('sklearn') or os.cpu_count() or 1
+            run_local(args.job_dir, workers)
+        elif args.command == 'worker':
+            print(f"🏁 {run_worker(args.job_dir)} shard(s) scored")
+        elif args.command == 'status':
+            print(json.dumps(Job(args.job_dir).status(), indent=2))
+        else:
+            merge(args.job_dir, args.output)
+    except (FileNotFoundError, ValueError, RuntimeError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+Knowledge distillation - a tiny student model trained to imitate the Random Forest and/or multimodal teachers
+
+The teachers label a large sample of the input space (observed State/District/Crop/Season combinations
+with years, areas and environmental values drawn across their observed ranges). A compact student is
+fitted to those labels and saved as distilled_student.pkl in the same dict layout as
+trained_crop_model.pkl, so build_feature_vector() and the inference router can serve it directly.
+
+Students:
+    mlp  - one hidden layer, evaluated with plain numpy (categoricals as embedding lookups), ~tens of µs
+    hgb  - shallow histogram gradient boosting
+"""
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import LabelEncoder
+from sklearn.metrics import r2_score, mean_absolute_error
+
+from model_registry import get_registry, discover, publish, save_artifact
+
+CATEGORICAL_COLS = ['State', 'District', 'Crop', 'Season']
+NUMERIC_COLS = ['Crop_Year', 'Area', 'NDVI_mean', 'rainfall_mm', 'temp_avg', 'soil_pH']
+# Same column layout as the production Random Forest
+FEATURE_COLS = [f'{col}_encoded' for col in CATEGORICAL_COLS] + NUMERIC_COLS
+ENVIRONMENT_COLS = ['NDVI_mean', 'rainfall_mm', 'temp_avg', 'soil_pH']
+
+SUPPORTED_CROPS = ['Rice', 'Wheat', 'Maize', 'Sugarcane', 'Cotton']
+
+
+class DistilledMLP:
+    """One-hidden-layer ReLU network over FEATURE_COLS rows, evaluated with numpy only
+
+    The first layer's one-hot block is stored as one embedding table per categorical column, so a
+    row costs a few lookups and one small matmul.
+    """
+
+    def __init__(self, categorical_sizes, numeric_mean, numeric_scale, embeddings, numeric_weights,
+                 hidden_bias, output_weights, output_bias, target_mean, target_scale):
+        self.categorical_sizes = list(categorical_sizes)
+        self.numeric_mean = np.asarray(numeric_mean, dtype=np.float32)
+        self.numeric_scale = np.asarray(numeric_scale, dtype=np.float32)
+        self.embeddings = [np.asarray(table, dtype=np.float32) for table in embeddings]
+        self.numeric_weights = np.asarray(numeric_weights, dtype=np.float32)
+        self.hidden_bias = np.asarray(hidden_bias, dtype=np.float32)
+        self.output_weights = np.asarray(output_weights, dtype=np.float32)
+        self.output_bias = float(output_bias)
+        self.target_mean = float(target_mean)
+        self.target_scale = float(target_scale)
+
+    @staticmethod
+    def expand(X, categorical_sizes, numeric_mean, numeric_scale):
+        """One-hot categoricals + standardised numerics, the layout the network is trained on"""
+        X = np.asarray(X, dtype=np.float64)
+        n_cat = len(categorical_sizes)
+        blocks = []
+        for j, size in enumerate(categorical_sizes):
+            codes = np.clip(X[:, j].astype(np.int64), 0, size - 1)
+            one_hot = np.zeros((len(X), size), dtype=np.float32)
+            one_hot[np.arange(len(X)), codes] = 1.0
+            blocks.append(one_hot)
+        blocks.append(((X[:, n_cat:] - numeric_mean) / numeric_scale).astype(np.float32))
+        return np.hstack(blocks)
+
+    @classmethod
+    def from_sklearn(cls, mlp, categorical_sizes, numeric_mean, numeric_scale, target_mean, target_scale):
+        """Split a fitted MLPRegressor's first layer into per-column embedding tables"""
+        first, second = mlp.coefs_
+        offsets = np.concatenate([[0], np.cumsum(categorical_sizes)])
+        embeddings = [first[offsets[j]:offsets[j + 1]] for j in range(len(categorical_sizes))]
+        return cls(categorical_sizes, numeric_mean, numeric_scale, embeddings, first[offsets[-1]:],
+                   mlp.intercepts_[0], second[:, 0], mlp.intercepts_[1][0], target_mean, target_scale)
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        n_cat = len(self.categorical_sizes)
+        hidden = ((X[:, n_cat:] - self.numeric_mean) / self.numeric_scale) @ self.numeric_weights
+        hidden += self.hidden_bias
+        for j, table in enumerate(self.embeddings):
+            hidden += table[np.clip(X[:, j].astype(np.int64), 0, len(table) - 1)]
+        np.maximum(hidden, 0, out=hidden)
+        return (hidden @ self.output_weights + self.output_bias) * self.target_scale + self.target_mean
+
+
+def load_dataset(dataset_path):
+    df = pd.read_csv(dataset_path)
+    df.columns = df.columns.str.strip()
+    df = df.dropna(subset=['Yield'])
+    df = df[(df['Yield'] > 0) & df['Crop'].isin(SUPPORTED_CROPS)]
+    return df.reset_index(drop=True)
+
+
+def sample_inputs(df, n_samples, seed=42):
+    """Teacher queries: observed location/crop/season combinations, other inputs spread across their ranges"""
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(df), n_samples)
+    samples = df.loc[rows, CATEGORICAL_COLS].reset_index(drop=True)
+
+    years = df['Crop_Year'].to_numpy()
+    samples['Crop_Year'] = rng.integers(years.min(), years.max() + 1, n_samples)
+    # Area spans orders of magnitude, so sample it log-uniformly
+    area_low, area_high = np.log(np.percentile(df['Area'], [1, 99]).clip(min=1e-3))
+    samples['Area'] = np.exp(rng.uniform(area_low, area_high, n_samples))
+    for col in ENVIRONMENT_COLS:
+        low, high = np.percentile(df[col], [1, 99])
+        samples[col] = rng.uniform(low, high, n_samples)
+    return samples
+
+
+def encode_frame(encoders, frame):
+    """FEATURE_COLS matrix for a frame of raw inputs; labels unknown to an encoder map to 0"""
+    X = np.empty((len(frame), len(FEATURE_COLS)), dtype=np.float64)
+    for j, col in enumerate(CATEGORICAL_COLS):
+        codes = pd.Categorical(frame[col].astype(str), categories=encoders[col].classes_).codes
+        X[:, j] = np.where(codes < 0, 0, codes)
+    for j, col in enumerate(NUMERIC_COLS, start=len(CATEGORICAL_COLS)):
+        X[:, j] = frame[col].to_numpy(dtype=np.float64)
+    return X
+
+
+class ForestTeacher:
+    """Production Random Forest (trained_crop_model.pkl)"""
+    name = 'production'
+
+    def __init__(self):
+        self.payload = get_registry().get('production').payload
+
+    def known(self, frame):
+        return np.ones(len(frame), dtype=bool)
+
+    def label(self, frame, chunk_size=65536):
+        X = encode_frame(self.payload['encoders'], frame)
+        X = X[:, [FEATURE_COLS.index(col) for col in self.payload['feature_cols']]]
+        return np.concatenate([self.payload['model'].predict(X[i:i + chunk_size])
+                               for i in range(0, len(X), chunk_size)])
+
+
+class MultimodalTeacher:
+    """Multimodal ViT checkpoint, scored in batches"""
+    name = 'multimodal'
+
+    def __init__(self):
+        from multimodal_service import MultimodalYieldPredictor
+        self.predictor = MultimodalYieldPredictor()
+        if self.predictor.model is None:
+            raise RuntimeError('Multimodal model is not loaded')
+
+    def known(self, frame):
+        """Rows whose labels the checkpoint's encoders have seen (it rejects unseen labels)"""
+        mask = np.ones(len(frame), dtype=bool)
+        for col in CATEGORICAL_COLS:
+            encoder = self.predictor.encoders.get(col.lower())
+            if encoder is not None:
+                mask &= frame[col].astype(str).isin(encoder.classes_).to_numpy()
+        return mask
+
+    def label(self, frame, chunk_size=256):
+        records = [{
+            'state': row.State, 'district': row.District, 'crop': row.Crop, 'season': row.Season,
+            'year': row.Crop_Year, 'area': row.Area, 'ndvi_mean': row.NDVI_mean,
+            'rainfall_mm': row.rainfall_mm, 'temp_avg': row.temp_avg, 'soil_ph': row.soil_pH
+        } for row in frame.itertuples(index=False)]
+        return np.concatenate([self.predictor.predict_batch(records[i:i + chunk_size])
+                               for i in range(0, len(records), chunk_size)])
+
+
+TEACHERS = {'production': ForestTeacher, 'multimodal': MultimodalTeacher}
+
+
+def teacher_labels(teachers, frame):
+    """Mean of the teachers' predictions, over the rows every teacher can score"""
+    mask = np.ones(len(frame), dtype=bool)
+    for teacher in teachers:
+        mask &= teacher.known(frame)
+    frame = frame[mask].reset_index(drop=True)
+    labels = np.mean([teacher.label(frame) for teacher in teachers], axis=0)
+    return frame, labels
+
+
+def fit_student(kind, X, y, categorical_sizes, seed=42):
+    if kind == 'hgb':
+        from sklearn.ensemble import HistGradientBoostingRegressor
+        # Native categorical splits need codes below max_bins; larger vocabularies stay ordinal
+        categorical = [j for j, size in enumerate(categorical_sizes) if size <= 255]
+        student = HistGradientBoostingRegressor(max_iter=200, max_depth=4, learning_rate=0.1,
+                                                categorical_features=categorical or None,
+                                                random_state=seed)
+        student.fit(X, y)
+        return student
+
+    from sklearn.neural_network import MLPRegressor
+    numeric = X[:, len(categorical_sizes):]
+    numeric_mean, numeric_scale = numeric.mean(axis=0), numeric.std(axis=0) + 1e-9
+    target_mean, target_scale = float(y.mean()), float(y.std() + 1e-9)
+    mlp = MLPRegressor(hidden_layer_sizes=(64,), learning_rate_init=3e-3, batch_size=256, max_iter=200,
+                       early_stopping=True, n_iter_no_change=10, random_state=seed)
+    mlp.fit(DistilledMLP.expand(X, categorical_sizes, numeric_mean, numeric_scale),
+            (y - target_mean) / target_scale)
+    return DistilledMLP.from_sklearn(mlp, categorical_sizes, numeric_mean, numeric_scale,
+                                     target_mean, target_scale)
+
+
+def single_row_latency_us(predict, row, repeats=200):
+    """Median wall time of a one-row predict call"""
+    predict(row)
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        predict(row)
+        timings.append(time.perf_counter() - started)
+    return float(np.median(timings) * 1e6)
+
+
+def distill(dataset_path='multimodal_crop_dataset.csv', teacher_names=('production',), student_kind='mlp',
+            n_samples=200000, seed=42, version=False):
+    print(f"📂 Loading {dataset_path}...")
+    df = load_dataset(dataset_path)
+    teachers = [TEACHERS[name]() for name in teacher_names]
+
+    print(f"🎓 Labelling {n_samples} sampled inputs with {', '.join(teacher_names)}...")
+    started = time.perf_counter()
+    samples, labels = teacher_labels(teachers, sample_inputs(df, n_samples, seed))
+    label_seconds = time.perf_counter() - started
+    print(f"   {len(samples)} labelled in {label_seconds:.1f}s")
+
+    # The student gets its own encoders over every label it may be asked about
+    encoders = {}
+    for col in CATEGORICAL_COLS:
+        encoder = LabelEncoder()
+        encoder.fit(pd.concat([samples[col], df[col]]).astype(str))
+        encoders[col] = encoder
+    categorical_sizes = [len(encoders[col].classes_) for col in CATEGORICAL_COLS]
+
+    X = encode_frame(encoders, samples)
+    split = int(len(X) * 0.9)
+    print(f"🧪 Training {student_kind} student on {split} samples...")
+    started = time.perf_counter()
+    student = fit_student(student_kind, X[:split], labels[:split], categorical_sizes, seed)
+    fit_seconds = time.perf_counter() - started
+
+    # Fidelity: how closely the student imitates the teachers on held-out sampled inputs
+    fidelity_pred = student.predict(X[split:])
+    fidelity = {'r2_score': float(r2_score(labels[split:], fidelity_pred)),
+                'mae': float(mean_absolute_error(labels[split:], fidelity_pred))}
+
+    # Accuracy: student and teachers against the observed yields of the rows real_model_trainer
+    # holds out (same cleaning, row order and split), so the forest teacher never fitted them
+    from real_model_trainer import split_rows
+    _, test_idx = split_rows(df, test_size=0.2, seed=42)
+    real, real_labels = teacher_labels(teachers, df.iloc[np.sort(test_idx)].reset_index(drop=True))
+    real_pred = np.maximum(student.predict(encode_frame(encoders, real)), 0)
+    y_true = real['Yield'].to_numpy()
+    r2 = float(r2_score(y_true, real_pred))
+    teacher_metrics = {'r2_score': float(r2_score(y_true, real_labels)),
+                       'mae': float(mean_absolute_error(y_true, real_labels))}
+
+    row = X[:1]
+    latency = {'student_us': single_row_latency_us(student.predict, row)}
+    if 'production' in teacher_names:
+        forest = get_registry().get('production').payload['model']
+        latency['forest_teacher_us'] = single_row_latency_us(forest.predict, row, repeats=20)
+
+    model_data = {
+        'model': student,
+        'encoders': encoders,
+        'feature_cols': FEATURE_COLS,
+        'performance': {
+            'r2_score': r2,
+            'mae': float(mean_absolute_error(y_true, real_pred)),
+            'accuracy': r2 * 100,
+            'training_samples': split,
+            'test_samples': len(real)
+        },
+        'distillation': {
+            'teachers': list(teacher_names),
+            'student': student_kind,
+            'samples': len(samples),
+            'fidelity': fidelity,
+            'teacher_performance': teacher_metrics,
+            'label_seconds': label_seconds,
+            'fit_seconds': fit_seconds,
+            'latency': latency
+        }
+    }
+
+    # Atomic write so running services hot-swap to the new student without reading a partial file
+    if version:
+        path = publish('student', model_data, '.')
+    else:
+        path = save_artifact(model_data, 'distilled_student.pkl')
+
+    report = model_data['distillation']
+    print(f"\n📊 Distillation report ({student_kind} <- {' + '.join(teacher_names)})")
+    print(f"   Fidelity to teachers (held-out samples): R² {fidelity['r2_score']:.4f}, MAE {fidelity['mae']:.2f}")
+    print(f"   Student vs observed yields ({len(real)} held-out rows): R² {r2:.4f}, MAE {model_data['performance']['mae']:.2f}")
+    print(f"   Teachers vs observed yields: R² {teacher_metrics['r2_score']:.4f}, MAE {teacher_metrics['mae']:.2f}")
+    print(f"   Single-row latency: student {latency['student_us']:.1f} µs" +
+          (f", forest teacher {latency['forest_teacher_us']:.0f} µs" if 'forest_teacher_us' in latency else ''))
+    print(f"💾 Student saved to {path}")
+    return model_data
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Distill the yield models into a tiny student model')
+    parser.add_argument('--dataset', default='multimodal_crop_dataset.csv')
+    parser.add_argument('--teacher', choices=['production', 'multimodal', 'both'], default='production')
+    parser.add_argument('--student', choices=['mlp', 'hgb'], default='mlp')
+    parser.add_argument('--samples', type=int, default=200000, help='sampled inputs labelled by the teachers')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--version', action='store_true', help='publish as the next .v<N> artifact')
+    args = parser.parse_args()
+
+    teacher_names = ['production', 'multimodal'] if args.teacher == 'both' else [args.teacher]
+    missing = [name for name in teacher_names if not discover(name)]
+    if missing:
+        print(f"❌ No artifact for teacher(s) {missing}; train them first")
+        sys.exit(1)
+    # Run through the importable module so the pickled student references distillation.DistilledMLP
+    import distillation
+    distillation.distill(args.dataset, teacher_names, args.student, args.samples, args.seed, version=args.version)
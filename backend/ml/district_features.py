@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+District environmental feature index - climatology and soil priors per (state, district, season)
+
+Built offline from the feature dataset (multimodal_crop_dataset.csv) into a few .npy tables plus a
+small JSON vocabulary; services memory-map the tables once and join them into requests or whole
+batches with array indexing, so a request without NDVI/rainfall/temperature/soil pH gets its
+district's values instead of one national default, with no per-request I/O.
+
+Every (location, season) cell is filled at build time, falling back from the district's own rows
+to its state's rows for that season and then to the national values, so a lookup is one gather.
+
+Each build is written to a new build-* subdirectory and published by atomically replacing the CURRENT
+file that names it, so files a service has memory-mapped are never rewritten and a reader never pairs
+one build's vocabulary with another's tables. The build before the current one is kept for readers
+that resolved CURRENT just before the swap; older ones are removed.
+
+    python district_features.py build --dataset multimodal_crop_dataset.csv
+    python district_features.py lookup Lucknow Kharif [--state "Uttar Pradesh"]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from production_model import ENVIRONMENT_COLUMNS
+
+INDEX_DIR = Path(os.environ.get('DISTRICT_INDEX_DIR', Path(__file__).parent / 'district_index'))
+
+# Request keys in table column order, and the dataset column each is averaged from
+FEATURES = list(ENVIRONMENT_COLUMNS)
+SOURCE_COLUMNS = [ENVIRONMENT_COLUMNS[key][0] for key in FEATURES]
+
+
+def _key(value):
+    return str(value).strip().upper()
+
+
+def current_build(directory):
+    """Directory of the published build CURRENT names (a flat pre-versioning index as is), or None"""
+    directory = Path(directory)
+    try:
+        return directory / (directory / 'CURRENT').read_text().strip()
+    except FileNotFoundError:
+        return directory if (directory / 'vocabulary.json').exists() else None
+
+
+def publish_build(directory, write, keep=2):
+    """Run write(build_dir) into a fresh subdirectory of `directory`, then make it CURRENT atomically
+
+    The `keep` newest builds (including this one) stay; removing older ones is best-effort, since a
+    mapped file cannot be deleted on Windows (POSIX readers keep an unlinked mapping readable).
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f"build-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    staging = directory / f'.{name}.tmp'
+    staging.mkdir()
+    try:
+        write(staging)
+        os.replace(staging, directory / name)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    pointer = directory / f'.CURRENT.{os.getpid()}.tmp'
+    pointer.write_text(name)
+    os.replace(pointer, directory / 'CURRENT')
+
+    builds = sorted((path for path in directory.glob('build-*') if path.is_dir()),
+                    key=lambda path: path.stat().st_mtime)
+    for path in builds[:-keep] if keep > 0 else builds:
+        if path.name != name:
+            shutil.rmtree(path, ignore_errors=True)
+    return directory / name
+
+
+def build_index(dataset_path='multimodal_crop_dataset.csv', directory=INDEX_DIR):
+    """Aggregate the dataset into location, state and national tables and publish them under `directory`"""
+    df = pd.read_csv(dataset_path)
+    df.columns = df.columns.str.strip()
+    missing = [col for col in ['State', 'District', 'Season'] + SOURCE_COLUMNS if col not in df.columns]
+    if missing:
+        raise ValueError(f"{dataset_path} is missing columns {missing}")
+    for col in ['State', 'District', 'Season']:
+        df[col] = df[col].astype(str).str.strip()
+    df = df.dropna(subset=SOURCE_COLUMNS)
+
+    seasons = sorted(df['Season'].unique())
+    states = sorted(df['State'].unique())
+    locations = sorted(df.groupby(['State', 'District']).groups)
+    season_slot = {season: i for i, season in enumerate(seasons)}
+    state_slot = {state: i for i, state in enumerate(states)}
+    location_slot = {location: i for i, location in enumerate(locations)}
+    n_slots, n_features = len(seasons) + 1, len(FEATURES)
+
+    national = np.full((n_slots, n_features), np.nan)
+    for season, values in df.groupby('Season')[SOURCE_COLUMNS].mean().iterrows():
+        national[season_slot[season]] = values
+    national[-1] = df[SOURCE_COLUMNS].mean()
+    national[np.isnan(national)] = np.broadcast_to(national[-1], national.shape)[np.isnan(national)]
+
+    state_table = np.full((len(states), n_slots, n_features), np.nan)
+    for (state, season), values in df.groupby(['State', 'Season'])[SOURCE_COLUMNS].mean().iterrows():
+        state_table[state_slot[state], season_slot[season]] = values
+    for state, values in df.groupby('State')[SOURCE_COLUMNS].mean().iterrows():
+        state_table[state_slot[state], -1] = values
+    gaps = np.isnan(state_table)
+    state_table[gaps] = np.broadcast_to(national, state_table.shape)[gaps]
+
+    location_table = np.full((len(locations), n_slots, n_features), np.nan)
+    counts = np.zeros((len(locations), n_slots), dtype=np.int32)
+    for (state, district, season), group in df.groupby(['State', 'District', 'Season'])[SOURCE_COLUMNS]:
+        location_table[location_slot[(state, district)], season_slot[season]] = group.mean()
+        counts[location_slot[(state, district)], season_slot[season]] = len(group)
+    for (state, district), group in df.groupby(['State', 'District'])[SOURCE_COLUMNS]:
+        location_table[location_slot[(state, district)], -1] = group.mean()
+        counts[location_slot[(state, district)], -1] = len(group)
+    location_states = np.array([state_slot[state] for state, _ in locations])
+    gaps = np.isnan(location_table)
+    location_table[gaps] = state_table[location_states][gaps]
+
+    # A district named without its state resolves to the location with the most rows
+    primary = {}
+    for i, (_, district) in enumerate(locations):
+        best = primary.get(_key(district))
+        if best is None or counts[i, -1] > counts[best, -1]:
+            primary[_key(district)] = i
+
+    vocabulary = {
+        'features': FEATURES,
+        'seasons': seasons,
+        'states': states,
+        'locations': [list(location) for location in locations],
+        'location_states': location_states.tolist(),
+        'primary_location': primary,
+        'built_from': str(Path(dataset_path).resolve()),
+        'built_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'rows': len(df)
+    }
+
+    def write(build):
+        np.save(build / 'locations.npy', location_table.astype(np.float32))
+        np.save(build / 'states.npy', state_table.astype(np.float32))
+        np.save(build / 'national.npy', national.astype(np.float32))
+        np.save(build / 'counts.npy', counts)
+        with open(build / 'vocabulary.json', 'w') as f:
+            json.dump(vocabulary, f)
+
+    publish_build(directory, write)
+    return vocabulary
+
+
+class DistrictFeatureIndex:
+    """Memory-mapped priors; join() resolves whole batches with dict maps and one gather per level"""
+
+    def __init__(self, directory=INDEX_DIR):
+        build = current_build(directory)
+        if build is None:
+            raise FileNotFoundError(f"No district index has been built in {directory}")
+        directory = build
+        with open(directory / 'vocabulary.json') as f:
+            vocabulary = json.load(f)
+        self.features = vocabulary['features']
+        self.states = vocabulary['states']
+        self.location_tables = np.load(directory / 'locations.npy', mmap_mode='r')
+        self.state_tables = np.load(directory / 'states.npy', mmap_mode='r')
+        self.national = np.load(directory / 'national.npy', mmap_mode='r')
+        self.counts = np.load(directory / 'counts.npy', mmap_mode='r')
+
+        self.location_states = np.asarray(vocabulary['location_states'], dtype=np.int64)
+        self.locations = [tuple(location) for location in vocabulary['locations']]
+        self.location_ids = {(_key(s), _key(d)): i for i, (s, d) in enumerate(vocabulary['locations'])}
+        self.primary_location = vocabulary['primary_location']
+        self.state_ids = {_key(state): i for i, state in enumerate(self.states)}
+        self.season_ids = {_key(season): i for i, season in enumerate(vocabulary['seasons'])}
+        self.all_seasons = len(vocabulary['seasons'])
+
+    def codes(self, states, districts, seasons):
+        """Location id (-1 if unknown), state id (-1 if unknown) and season slot for each row"""
+        states = [None if state in (None, '') or state != state else _key(state) for state in states]
+        districts = [_key(district) for district in districts]
+        # Without a known state, a district name resolves to its primary location
+        location = np.array([self.location_ids.get((state, district), -1) if state in self.state_ids
+                             else self.primary_location.get(district, -1)
+                             for state, district in zip(states, districts)], dtype=np.int64)
+        state = np.array([self.state_ids.get(state, -1) for state in states], dtype=np.int64)
+        # A known district fixes the state when the request has none (or an unknown one)
+        state = np.where(location >= 0, self.location_states[np.maximum(location, 0)], state)
+        season = np.array([self.season_ids.get(_key(season), self.all_seasons) for season in seasons],
+                          dtype=np.int64)
+        return location, state, season
+
+    def join(self, states, districts, seasons):
+        """(n_rows, n_features) float32 priors plus the resolved state name of each row (None if unknown)"""
+        location, state, season = self.codes(states, districts, seasons)
+        priors = np.asarray(self.national)[season]
+        known_state = state >= 0
+        priors[known_state] = self.state_tables[state[known_state], season[known_state]]
+        known_location = location >= 0
+        priors[known_location] = self.location_tables[location[known_location], season[known_location]]
+        resolved = [self.states[i] if i >= 0 else None for i in state]
+        return priors, resolved
+
+    def lookup(self, state, district, season):
+        """Priors for one request as {ndvi_mean, rainfall_mm, temp_avg, soil_ph, state}"""
+        priors, resolved = self.join([state], [district], [season])
+        result = {key: float(value) for key, value in zip(self.features, priors[0])}
+        result['state'] = resolved[0]
+        return result
+
+
+_index = None
+
+
+def get_index():
+    """Process-wide index, or None when it has not been built (callers keep their static defaults)"""
+    global _index
+    if _index is None:
+        if current_build(INDEX_DIR) is None:
+            return None
+        _index = DistrictFeatureIndex(INDEX_DIR)
+    return _index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or query the district environmental feature index')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build')
+    build.add_argument('--dataset', default='multimodal_crop_dataset.csv')
+    lookup = commands.add_parser('lookup')
+    lookup.add_argument('district')
+    lookup.add_argument('season')
+    lookup.add_argument('--state', default=None)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        vocabulary = build_index(args.dataset)
+        print(f"💾 District index: {len(vocabulary['locations'])} districts, {len(vocabulary['states'])} states, "
+              f"{len(vocabulary['seasons'])} seasons from {vocabulary['rows']} rows -> {INDEX_DIR}")
+    else:
+        index = get_index()
+        if index is None:
+            print(f"❌ No index in {INDEX_DIR}; run: python district_features.py build")
+            sys.exit(1)
+        print(json.dumps(index.lookup(args.state, args.district, args.season)))
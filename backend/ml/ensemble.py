@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Concurrent Random Forest + multimodal ensemble with a per-request deadline
+
+Both members run at the same time on their own threads (tree traversal and torch kernels release the
+GIL), and their predictions are blended with weights learned on held-out rows and stored in
+ensemble_blend.pkl (registry name 'ensemble'). When one member has not answered by the deadline, or
+fails, the other member's answer is returned alone; `ensemble.members` in the response says which
+members contributed and why any did not.
+
+The deadline covers prediction only: both members' models (and torch) are loaded before its clock
+starts, on the first request of a resident Ensemble and on every spawned `predict`, so a cold process
+pays the load on top of the deadline. If neither member has answered by the deadline, the ensemble
+keeps waiting for the first answer up to ENSEMBLE_HARD_LIMIT_MS and then fails.
+
+    python ensemble.py fit [--dataset multimodal_crop_dataset.csv] [--version]
+    python ensemble.py predict [--deadline-ms 1500] <state> <district> <crop> <season> <year> [area]
+    echo '{...}' | python ensemble.py predict [--deadline-ms 1500]
+"""
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+import contextlib
+
+import numpy as np
+
+from model_registry import get_registry, discover, publish, save_artifact, ModelNotFoundError
+from inference_router import RandomForestTier, MultimodalTier, normalize_request
+
+DEADLINE_MS = float(os.environ.get('ENSEMBLE_DEADLINE_MS', 1500))
+# Longest a request waits for a first answer when every member is past the deadline
+HARD_LIMIT_MS = float(os.environ.get('ENSEMBLE_HARD_LIMIT_MS', 10000))
+DEFAULT_WEIGHTS = {'random_forest': 0.5, 'multimodal': 0.5}
+
+
+def forest_artifact():
+    """The Random Forest artifact the router's tier serves: the notebook model when present"""
+    return 'notebook' if discover('notebook') else 'production'
+
+
+class _Call:
+    """One member prediction running on a daemon thread, so a straggler never holds up the process"""
+
+    def __init__(self, tier, request, finished):
+        self.tier = tier
+        self.result = None
+        self.error = None
+        self.latency_ms = None
+        self.done = threading.Event()
+        self.finished = finished
+        self.thread = threading.Thread(target=self._run, args=(request,), daemon=True,
+                                       name=f'ensemble-{tier.name}')
+        self.thread.start()
+
+    def _run(self, request):
+        started = time.perf_counter()
+        try:
+            self.result = self.tier.predict(request)
+            self.latency_ms = (time.perf_counter() - started) * 1000
+            self.tier.record_success(self.latency_ms)
+        except Exception as e:
+            self.latency_ms = (time.perf_counter() - started) * 1000
+            self.error = e
+            self.tier.record_failure()
+        finally:
+            self.done.set()
+            self.finished.put(self)
+
+
+class Ensemble:
+    def __init__(self, deadline_ms=DEADLINE_MS, hard_limit_ms=HARD_LIMIT_MS):
+        self.deadline_ms = deadline_ms
+        self.hard_limit_ms = hard_limit_ms
+        self.members = [RandomForestTier(), MultimodalTier()]
+        self.warmed = False
+
+    def blend(self):
+        """(weights by member name, ensemble handle or None when no blend has been fitted)"""
+        try:
+            handle = get_registry().get('ensemble')
+        except ModelNotFoundError:
+            return dict(DEFAULT_WEIGHTS), None
+        return dict(handle.payload['weights']), handle
+
+    def warm(self):
+        """Load both members' models in parallel, outside any request's deadline
+
+        A member that fails to load is left to fail (and be reported) inside predict().
+        """
+        def load_forest():
+            with contextlib.suppress(Exception):
+                get_registry().get(forest_artifact())
+
+        def load_multimodal():
+            if self.members[1].available() and self.members[1].predictor is None:
+                try:
+                    from multimodal_service import MultimodalYieldPredictor
+                    self.members[1].predictor = MultimodalYieldPredictor()
+                except Exception as e:
+                    print(f"⚠️  Multimodal member failed to load: {e}", file=sys.stderr)
+
+        threads = [threading.Thread(target=target) for target in (load_forest, load_multimodal)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.warmed = True
+
+    def predict(self, request, deadline_ms=None):
+        deadline_ms = self.deadline_ms if deadline_ms is None else float(deadline_ms)
+        if not self.warmed:
+            self.warm()
+        started = time.perf_counter()
+        weights, handle = self.blend()
+        report = {}
+
+        calls = []
+        finished = queue.Queue()
+        for tier in self.members:
+            missing = tier.missing_fields(request)
+            if missing:
+                report[tier.name] = {'status': 'skipped', 'reason': f'missing inputs: {missing}'}
+            elif not tier.available():
+                report[tier.name] = {'status': 'skipped', 'reason': 'no artifact'}
+            elif not tier.healthy():
+                report[tier.name] = {'status': 'skipped', 'reason': 'circuit open after repeated failures'}
+            else:
+                calls.append(_Call(tier, request, finished))
+        if not calls:
+            raise RuntimeError(f'No ensemble member can serve this request: {report}')
+
+        # Wait for every member until the deadline; past it, settle for the first answer to arrive, up
+        # to the hard limit
+        deadline = started + deadline_ms / 1000
+        hard_limit = started + max(deadline_ms, self.hard_limit_ms) / 1000
+        pending, answered = len(calls), False
+        while pending:
+            now = time.perf_counter()
+            remaining = deadline - now
+            if (remaining <= 0 and answered) or now >= hard_limit:
+                break
+            try:
+                call = finished.get(timeout=remaining if remaining > 0 else hard_limit - now)
+            except queue.Empty:
+                continue
+            pending -= 1
+            answered = answered or call.error is None
+
+        contributors = {}
+        for call in calls:
+            name = call.tier.name
+            if not call.done.is_set():
+                report[name] = {'status': 'missed_deadline'}
+            elif call.error is not None:
+                report[name] = {'status': 'error', 'error': str(call.error), 'latency_ms': round(call.latency_ms, 2)}
+            else:
+                contributors[name] = call.result
+                report[name] = {'status': 'used', 'predicted_yield': round(float(call.result['predicted_yield']), 2),
+                                'latency_ms': round(call.latency_ms, 2)}
+        if not contributors:
+            if any(not call.done.is_set() for call in calls):
+                raise RuntimeError(f'No ensemble member answered within the {max(deadline_ms, self.hard_limit_ms):g} ms '
+                                   f'hard limit: {report}')
+            raise RuntimeError(f'Every ensemble member failed: {report}')
+
+        # Renormalise over the members that answered
+        total_weight = sum(weights.get(name, 0.0) for name in contributors)
+        used = {name: weights.get(name, 0.0) / total_weight if total_weight > 0 else 1.0 / len(contributors)
+                for name in contributors}
+        for name, weight in used.items():
+            report[name]['weight'] = round(weight, 4)
+        predicted_yield = sum(used[name] * float(result['predicted_yield']) for name, result in contributors.items())
+
+        if len(contributors) > 1 and handle is not None and handle.metrics:
+            metrics = handle.metrics
+            model_used = 'Ensemble_RandomForest+Multimodal'
+        else:
+            # A single contributor (or no fitted blend metrics) reports that member's own metrics
+            best = max(contributors, key=used.get)
+            metrics = contributors[best]
+            model_used = ('Ensemble_RandomForest+Multimodal' if len(contributors) > 1
+                          else contributors[best]['model_used'])
+        return {
+            'predicted_yield': round(max(0.0, predicted_yield), 2),
+            'total_production': round(max(0.0, predicted_yield) * float(request.get('area', 100.0)) * 1000),
+            'model_used': model_used,
+            'confidence': round(float(metrics.get('accuracy', metrics.get('confidence', 0.0))), 2),
+            'r2_score': metrics.get('r2_score'),
+            'mae': metrics.get('mae'),
+            'ensemble': {
+                'contributors': list(contributors),
+                'members': report,
+                'deadline_ms': deadline_ms,
+                'hard_limit_ms': max(deadline_ms, self.hard_limit_ms),
+                'blend_version': handle.version if handle is not None else None,
+            },
+            'latency_ms': round((time.perf_counter() - started) * 1000, 2),
+        }
+
+
+def _member_predictions(frame):
+    """Held-out predictions of both members over the rows both can score"""
+    from distillation import MultimodalTeacher, ForestTeacher
+
+    multimodal = MultimodalTeacher()
+    known = multimodal.known(frame)
+    frame = frame[known].reset_index(drop=True)
+
+    artifact = forest_artifact()
+    if artifact == 'notebook':
+        from notebook_model import encode_feature_columns
+        payload = get_registry().get('notebook').payload
+        columns = {'state': frame['State'].to_numpy(), 'district': frame['District'].to_numpy(),
+                   'crop': frame['Crop'].to_numpy(), 'season': frame['Season'].to_numpy(),
+                   'year': frame['Crop_Year'].to_numpy(), 'area': frame['Area'].to_numpy()}
+        forest = payload['model'].predict(encode_feature_columns(payload['encoders'], columns))
+    else:
+        forest = ForestTeacher().label(frame)
+    return frame, {'random_forest': np.asarray(forest, dtype=np.float64),
+                   'multimodal': np.asarray(multimodal.label(frame), dtype=np.float64)}
+
+
+def convex_weight(y, first, second):
+    """w minimising ||y - ((1 - w)·first + w·second)||², clipped to [0, 1]"""
+    difference = second - first
+    denominator = float(difference @ difference)
+    if denominator == 0:
+        return 0.5
+    return float(np.clip((y - first) @ difference / denominator, 0.0, 1.0))
+
+
+ROW_KEY = ['State', 'District', 'Crop', 'Season', 'Crop_Year']
+# Fewest rows held out from both members that a blend weight is learned on
+MIN_BLEND_ROWS = int(os.environ.get('ENSEMBLE_MIN_BLEND_ROWS', 40))
+
+
+def _row_keys(frame):
+    """(state, district, crop, season, year) of each row, ignoring padding and int/float years"""
+    years = frame['Crop_Year'].astype(float).astype(int).astype(str)
+    return list(zip(*[frame[col].astype(str).str.strip() for col in ROW_KEY[:-1]], years))
+
+
+def _multimodal_training_keys():
+    """Row keys train_multimodal fitted the multimodal model on (its APY.csv pipeline and split)"""
+    from train_multimodal import training_pipeline
+
+    pipeline = training_pipeline()
+    rows = pipeline.get('apy_filter')
+    train_idx, _ = pipeline.get('apy_split')
+    return set(_row_keys(rows.iloc[train_idx]))
+
+
+def blend_rows(df):
+    """(rows neither member was trained on, None) or (None, reason) when that cannot be established
+
+    The forest rows are real_model_trainer's test split of this dataset (same cleaning, row order and
+    split). The multimodal model is trained on APY.csv through its own split, so its training rows are
+    removed by key. The notebook forest's training rows are unknown.
+    """
+    from real_model_trainer import split_rows
+
+    if forest_artifact() == 'notebook':
+        return None, "the notebook Random Forest's training rows are unknown"
+    _, test_idx = split_rows(df, test_size=0.2, seed=42)
+    held = df.iloc[np.sort(test_idx)].reset_index(drop=True)
+    try:
+        seen = _multimodal_training_keys()
+    except FileNotFoundError as e:
+        return None, f"the multimodal model's training rows are unknown ({e})"
+    held = held[[key not in seen for key in _row_keys(held)]].reset_index(drop=True)
+    if len(held) < MIN_BLEND_ROWS:
+        return None, f'only {len(held)} rows are held out from both members (need {MIN_BLEND_ROWS})'
+    return held, None
+
+
+def fit_blend(dataset_path='multimodal_crop_dataset.csv', version=False):
+    """Learn the blend weight on rows neither member was trained on and store it as the ensemble artifact
+
+    When no such rows can be established the artifact keeps DEFAULT_WEIGHTS and carries no metrics, so
+    responses report the members' own metrics.
+    """
+    from sklearn.metrics import r2_score, mean_absolute_error
+    from distillation import load_dataset
+
+    held, reason = blend_rows(load_dataset(dataset_path))
+    handles = {'random_forest': get_registry().get(forest_artifact()), 'multimodal': get_registry().get('multimodal')}
+    artifact = {
+        'weights': dict(DEFAULT_WEIGHTS),
+        'members': {name: {'artifact': handle.name, 'version': handle.version} for name, handle in handles.items()},
+        'fitted_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    if reason is not None:
+        artifact['fallback'] = reason
+        path = publish('ensemble', artifact, '.') if version else save_artifact(artifact, 'ensemble_blend.pkl')
+        print(f"⚠️  Default blend weights kept: {reason}", file=sys.stderr)
+        print(f"💾 Ensemble blend saved to {path}")
+        return artifact
+
+    frame, predictions = _member_predictions(held)
+    y = frame['Yield'].to_numpy(dtype=np.float64)
+    tune, report_rows = np.arange(len(y)) % 2 == 0, np.arange(len(y)) % 2 == 1
+
+    w = convex_weight(y[tune], predictions['random_forest'][tune], predictions['multimodal'][tune])
+    weights = {'random_forest': 1.0 - w, 'multimodal': w}
+    blended = weights['random_forest'] * predictions['random_forest'] + weights['multimodal'] * predictions['multimodal']
+
+    report = {}
+    for name, values in list(predictions.items()) + [('ensemble', blended)]:
+        r2 = r2_score(y[report_rows], values[report_rows])
+        report[name] = {'r2_score': float(r2), 'mae': float(mean_absolute_error(y[report_rows], values[report_rows])),
+                        'accuracy': float(r2 * 100)}
+
+    artifact.update({
+        'weights': weights,
+        'performance': report['ensemble'],
+        'report': report,
+        'rows': {'tune': int(tune.sum()), 'report': int(report_rows.sum())},
+    })
+    path = publish('ensemble', artifact, '.') if version else save_artifact(artifact, 'ensemble_blend.pkl')
+
+    print(f"📊 Blend weights: Random Forest {weights['random_forest']:.3f}, multimodal {weights['multimodal']:.3f} "
+          f"(tuned on {int(tune.sum())} held-out rows)")
+    for name, metrics in report.items():
+        print(f"   {name:<14} R² {metrics['r2_score']:.4f}  MAE {metrics['mae']:.2f}  ({int(report_rows.sum())} report rows)")
+    print(f"💾 Ensemble blend saved to {path}")
+    return artifact
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Random Forest + multimodal ensemble')
+    commands = parser.add_subparsers(dest='command', required=True)
+    fit = commands.add_parser('fit', help='learn blend weights on held-out rows')
+    fit.add_argument('--dataset', default='multimodal_crop_dataset.csv')
+    fit.add_argument('--version', action='store_true', help='publish as the next ensemble_blend.v<N>.pkl')
+    predict = commands.add_parser('predict')
+    predict.add_argument('--deadline-ms', type=float, default=None)
+    predict.add_argument('--warm', action='store_true', help=argparse.SUPPRESS)
+    predict.add_argument('fields', nargs='*', help='state district crop season year [area]')
+    args = parser.parse_args()
+
+    if args.command == 'fit':
+        fit_blend(args.dataset, args.version)
+        return
+
+    if args.fields:
+        if len(args.fields) < 5:
+            parser.error('predict needs <state> <district> <crop> <season> <year> [area]')
+        data = dict(zip(['state', 'district', 'crop', 'season', 'year', 'area'], args.fields))
+    else:
+        data = json.loads(sys.stdin.read())
+
+    # Members print diagnostics to stdout and may still be running when we answer: keep it for the response
+    with contextlib.redirect_stdout(sys.stderr):
+        # Models load before the deadline clock starts (--warm is accepted for older callers)
+        ensemble = Ensemble()
+        result = ensemble.predict(normalize_request(data), data.get('deadline_ms', args.deadline_ms))
+        sys.__stdout__.write(json.dumps(result) + '\n')
+        sys.__stdout__.flush()
+
+    # A member that missed the deadline may still be inside native code; interpreter teardown under a
+    # running torch/sklearn kernel can abort, and its answer is no longer wanted
+    if any(thread.name.startswith('ensemble-') for thread in threading.enumerate()):
+        sys.stderr.flush()
+        os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
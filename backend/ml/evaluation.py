@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Cross-validated evaluation - K-fold or Crop_Year-based folds fitted in parallel processes,
+out-of-fold predictions cached on disk, per-crop/per-state metric tables written into the artifact
+"""
+import os
+import sys
+import json
+import hashlib
+import argparse
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.model_selection import KFold
+from sklearn.metrics import r2_score, mean_absolute_error, mean_squared_error
+
+from model_registry import get_registry, save_artifact, metrics_path
+
+CACHE_DIR = Path(os.environ.get('CV_CACHE_DIR', Path(__file__).parent / 'cv_cache'))
+
+NOTEBOOK_FEATURES = ['State', 'District', 'Crop', 'Crop_Year', 'Season', 'Area']
+
+# Segments with fewer out-of-fold rows are left out of by_crop/by_state, so requests for them fall
+# back to the overall metrics instead of reporting a noisy (or undefined) R²
+MIN_SEGMENT_ROWS = int(os.environ.get('CV_MIN_SEGMENT_ROWS', 20))
+
+
+def fold_indices(n_rows, years=None, scheme='kfold', n_splits=5, seed=42):
+    """[(train_idx, test_idx)] for shuffled K-fold or expanding-window folds over Crop_Year"""
+    if scheme == 'kfold':
+        splitter = KFold(n_splits=n_splits, shuffle=True, random_state=seed)
+        return list(splitter.split(np.zeros(n_rows)))
+
+    if scheme != 'time':
+        raise ValueError(f"Unknown scheme '{scheme}', expected 'kfold' or 'time'")
+    if years is None:
+        raise ValueError("Time-based folds need Crop_Year values")
+
+    years = np.asarray(years)
+    unique_years = np.unique(years)
+    if len(unique_years) < n_splits + 1:
+        raise ValueError(f"Need at least {n_splits + 1} distinct years for {n_splits} time folds, "
+                         f"got {len(unique_years)}")
+    # First block is training-only; each later block is predicted from all earlier years
+    blocks = np.array_split(unique_years, n_splits + 1)
+    folds = []
+    for i in range(1, len(blocks)):
+        train_idx = np.flatnonzero(years < blocks[i][0])
+        test_idx = np.flatnonzero(np.isin(years, blocks[i]))
+        folds.append((train_idx, test_idx))
+    return folds
+
+
+def _fit_fold(estimator, X, y, train_idx, test_idx):
+    # Each fold already runs in its own process; keep the estimator single-threaded inside it
+    if 'n_jobs' in estimator.get_params():
+        estimator.set_params(n_jobs=1)
+    estimator.fit(X[train_idx], y[train_idx])
+    return test_idx, estimator.predict(X[test_idx])
+
+
+def _cache_key(estimator, X, y, folds):
+    digest = hashlib.sha256()
+    digest.update(repr(sorted(estimator.get_params(deep=False).items())).encode())
+    digest.update(type(estimator).__name__.encode())
+    digest.update(np.ascontiguousarray(X).tobytes())
+    digest.update(np.ascontiguousarray(y).tobytes())
+    for train_idx, test_idx in folds:
+        digest.update(train_idx.tobytes())
+        digest.update(test_idx.tobytes())
+    return digest.hexdigest()[:24]
+
+
+def out_of_fold_predictions(estimator, X, y, folds, n_jobs=None, use_cache=True):
+    """Fit one clone per fold in parallel processes; return (oof_predictions, fold_ids, cache_key, cache_hit)
+
+    Rows never in a test fold (the first block of a time split) get NaN.
+    """
+    X = np.asarray(X, dtype=np.float32)
+    y = np.asarray(y, dtype=np.float64)
+    key = _cache_key(estimator, X, y, folds)
+    cache_path = CACHE_DIR / f'oof_{key}.npz'
+
+    if use_cache and cache_path.exists():
+        cached = np.load(cache_path)
+        return cached['predictions'], cached['fold_ids'], key, True
+
+    predictions = np.full(len(y), np.nan)
+    fold_ids = np.full(len(y), -1, dtype=np.int16)
+    workers = n_jobs or min(len(folds), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_fit_fold, clone(estimator), X, y, train_idx, test_idx)
+                   for train_idx, test_idx in folds]
+        for fold_id, future in enumerate(futures):
+            test_idx, fold_predictions = future.result()
+            predictions[test_idx] = fold_predictions
+            fold_ids[test_idx] = fold_id
+
+    if use_cache:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_name(f'.{cache_path.stem}.tmp.npz')
+        np.savez_compressed(tmp_path, predictions=predictions, fold_ids=fold_ids)
+        os.replace(tmp_path, cache_path)
+    return predictions, fold_ids, key, False
+
+
+def regression_metrics(y_true, y_pred):
+    """R²/MAE/RMSE; r2_score and accuracy are None (JSON null, never NaN) when R² is undefined"""
+    y_true = np.asarray(y_true, dtype=np.float64)
+    y_pred = np.asarray(y_pred, dtype=np.float64)
+    if not len(y_true):
+        return {'r2_score': None, 'mae': None, 'rmse': None, 'accuracy': None, 'n': 0}
+    # R² needs at least two rows with different targets
+    r2 = float(r2_score(y_true, y_pred)) if len(y_true) > 1 and np.ptp(y_true) > 0 else None
+    return {
+        'r2_score': r2,
+        'mae': float(mean_absolute_error(y_true, y_pred)),
+        'rmse': float(np.sqrt(mean_squared_error(y_true, y_pred))),
+        'accuracy': r2 * 100 if r2 is not None else None,
+        'n': int(len(y_true))
+    }
+
+
+def metric_table(y_true, y_pred, labels, min_rows=MIN_SEGMENT_ROWS):
+    """{label: metrics} for every segment value with at least min_rows rows and a defined R²"""
+    frame = pd.DataFrame({'y': y_true, 'pred': y_pred, 'label': np.asarray(labels).astype(str)})
+    table = {}
+    for label, group in frame.groupby('label', sort=True):
+        if len(group) < min_rows:
+            continue
+        metrics = regression_metrics(group['y'], group['pred'])
+        if metrics['r2_score'] is not None:
+            table[label] = metrics
+    return table
+
+
+def evaluate(estimator, X, y, crops, states, years=None, scheme='kfold', n_splits=5, n_jobs=None,
+             use_cache=True):
+    """Cross-validate an estimator and return the evaluation block stored in artifacts"""
+    folds = fold_indices(len(y), years, scheme, n_splits)
+    predictions, fold_ids, key, cache_hit = out_of_fold_predictions(estimator, X, y, folds, n_jobs, use_cache)
+
+    y = np.asarray(y, dtype=np.float64)
+    scored = ~np.isnan(predictions)
+    y_scored, pred_scored = y[scored], predictions[scored]
+    fold_metrics = [regression_metrics(y[fold_ids == i], predictions[fold_ids == i]) for i in range(len(folds))]
+
+    return {
+        'scheme': scheme,
+        'n_splits': n_splits,
+        'cache_key': key,
+        'cache_hit': cache_hit,
+        'evaluated_at': datetime.now(timezone.utc).isoformat(),
+        'min_segment_rows': MIN_SEGMENT_ROWS,
+        'overall': regression_metrics(y_scored, pred_scored),
+        'folds': fold_metrics,
+        'by_crop': metric_table(y_scored, pred_scored, np.asarray(crops)[scored]),
+        'by_state': metric_table(y_scored, pred_scored, np.asarray(states)[scored])
+    }
+
+
+def _encode_known(encoder, values):
+    """Codes for values the encoder knows, -1 for unseen labels"""
+    table = {label: code for code, label in enumerate(encoder.classes_)}
+    return np.array([table.get(value, -1) for value in values])
+
+
+def _load_dataset(dataset_path):
+    df = pd.read_csv(dataset_path)
+    df.columns = df.columns.str.strip()
+    df = df.dropna(subset=['Yield'])
+    return df[df['Yield'] > 0].reset_index(drop=True)
+
+
+def _check_defined(evaluation):
+    """Refuse to store an evaluation whose overall R² is undefined: services serve it as confidence"""
+    overall = evaluation['overall']
+    if overall['r2_score'] is None:
+        raise ValueError(f"CV R² is undefined on {overall['n']} scored row(s); evaluation not saved")
+
+
+def evaluate_production_artifact(dataset_path, scheme='kfold', n_splits=5, n_jobs=None):
+    """Cross-validate trained_crop_model.pkl on the dataset and write the evaluation into it"""
+    handle = get_registry().get('production')
+    model_data = dict(handle.payload)
+    encoders = model_data['encoders']
+
+    df = _load_dataset(dataset_path)
+    df = df[df['Crop'].isin(encoders['Crop'].classes_)].reset_index(drop=True)
+    for col in ['State', 'District', 'Crop', 'Season']:
+        df[f'{col}_encoded'] = _encode_known(encoders[col], df[col].astype(str))
+    df = df[(df[[f'{col}_encoded' for col in ['State', 'District', 'Crop', 'Season']]] >= 0).all(axis=1)]
+
+    X = df[model_data['feature_cols']].to_numpy(dtype=np.float32)
+    evaluation = evaluate(model_data['model'], X, df['Yield'].to_numpy(), df['Crop'], df['State'],
+                          df['Crop_Year'], scheme, n_splits, n_jobs)
+    _check_defined(evaluation)
+    model_data['evaluation'] = evaluation
+    save_artifact(model_data, handle.path)
+    return handle.path, evaluation
+
+
+def evaluate_notebook_artifact(dataset_path, scheme='kfold', n_splits=5, n_jobs=None):
+    """Cross-validate crop_yield_model.pkl and write the evaluation to its metrics sidecar"""
+    handle = get_registry().get('notebook')
+    encoders = handle.payload['encoders']
+
+    df = _load_dataset(dataset_path)
+    columns = {}
+    for col in NOTEBOOK_FEATURES:
+        if col in encoders:
+            columns[col] = _encode_known(encoders[col], df[col].astype(str))
+        else:
+            columns[col] = df[col].to_numpy()
+    X = np.column_stack([columns[col] for col in NOTEBOOK_FEATURES]).astype(np.float32)
+    known = (X[:, [NOTEBOOK_FEATURES.index(col) for col in encoders]] >= 0).all(axis=1)
+
+    evaluation = evaluate(handle.payload['model'], X[known], df['Yield'].to_numpy()[known],
+                          df['Crop'][known], df['State'][known], df['Crop_Year'][known],
+                          scheme, n_splits, n_jobs)
+    _check_defined(evaluation)
+    sidecar = metrics_path(handle.path)
+    tmp_path = sidecar.with_name(f'.{sidecar.name}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(evaluation, f, indent=2, allow_nan=False)
+    os.replace(tmp_path, sidecar)
+    return sidecar, evaluation
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cross-validate a trained model and store real metrics in its artifact')
+    parser.add_argument('model', choices=['production', 'notebook'])
+    parser.add_argument('--dataset', default='multimodal_crop_dataset.csv')
+    parser.add_argument('--scheme', choices=['kfold', 'time'], default='kfold')
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--jobs', type=int, default=None, help='parallel fold processes (default: one per fold)')
+    args = parser.parse_args()
+
+    try:
+        evaluate_artifact = evaluate_production_artifact if args.model == 'production' else evaluate_notebook_artifact
+        written_to, evaluation = evaluate_artifact(args.dataset, args.scheme, args.folds, args.jobs)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"❌ ERROR: {e}")
+        sys.exit(1)
+
+    overall = evaluation['overall']
+    print(f"{'♻️  Cached' if evaluation['cache_hit'] else '✅ Computed'} out-of-fold predictions "
+          f"({evaluation['scheme']}, {evaluation['n_splits']} folds)")
+    print(f"📊 CV R² = {overall['r2_score']:.4f}, MAE = {overall['mae']:.2f}, RMSE = {overall['rmse']:.2f}")
+    for crop, metrics in evaluation['by_crop'].items():
+        print(f"  {crop}: R² = {metrics['r2_score']:.3f}, MAE = {metrics['mae']:.2f} (n={metrics['n']})")
+    print(f"💾 Evaluation written to {written_to}")
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+Accuracy-bounded Random Forest compaction - tree selection plus cost-complexity pruning
+
+1. Greedy forward selection adds, one at a time, the tree that lowers validation MAE the most,
+   until the subset is within its share of the tolerance of the full forest's MAE.
+2. One cost-complexity alpha is applied to every selected tree (weakest-link pruning on the
+   flattened node arrays); the largest alpha that keeps validation MAE within the tolerance wins.
+3. The result is a CompactForest: all trees concatenated into flat arrays with float32 thresholds
+   and leaf values, int16 feature ids and int32 node indices, predicting in one vectorised walk.
+
+Validation rows are the real_model_trainer holdout split in two: one half drives selection and
+pruning, the other half is only used for the before/after report.
+"""
+import sys
+import time
+import heapq
+import pickle
+import argparse
+
+import numpy as np
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import r2_score, mean_absolute_error
+
+from model_registry import get_registry, publish, save_artifact
+from forest_uncertainty import per_tree_predictions
+
+
+class CompactForest:
+    """Pruned subset of a forest's trees in flat arrays; predicts like RandomForestRegressor"""
+
+    def __init__(self, feature, threshold, left, right, value, roots, max_depth, n_features_in, weight=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.max_depth = max_depth
+        self.n_features_in_ = n_features_in
+        # Training samples reaching each node; only TreeSHAP (tree_shap.py) reads them
+        self.weight = weight
+
+    @property
+    def n_estimators(self):
+        return len(self.roots)
+
+    @property
+    def node_count(self):
+        return len(self.value)
+
+    def nbytes(self):
+        arrays = (self.feature, self.threshold, self.left, self.right, self.value, self.roots,
+                  getattr(self, 'weight', None))
+        return sum(a.nbytes for a in arrays if a is not None)
+
+    def per_tree_predict(self, X, chunk_size=4096):
+        """(n_samples, n_trees) leaf values, all trees walked together one level per step"""
+        X = np.asarray(X, dtype=np.float32)
+        out = np.empty((len(X), len(self.roots)), dtype=np.float64)
+        for start in range(0, len(X), chunk_size):
+            block = X[start:start + chunk_size]
+            rows = np.arange(len(block))[:, None]
+            nodes = np.broadcast_to(self.roots, (len(block), len(self.roots))).copy()
+            for _ in range(self.max_depth):
+                left = self.left[nodes]
+                leaf = left < 0
+                if leaf.all():
+                    break
+                go_left = block[rows, self.feature[nodes]] <= self.threshold[nodes]
+                nodes = np.where(leaf, nodes, np.where(go_left, left, self.right[nodes]))
+            out[start:start + len(block)] = self.value[nodes]
+        return out
+
+    def predict(self, X):
+        return self.per_tree_predict(X).mean(axis=1)
+
+
+def flatten_tree(estimator):
+    tree = estimator.tree_
+    return {
+        'left': tree.children_left,
+        'right': tree.children_right,
+        'feature': tree.feature,
+        'threshold': tree.threshold,
+        'value': tree.value[:, 0, 0],
+        'impurity': tree.impurity,
+        'weight': tree.weighted_n_node_samples,
+        'max_depth': tree.max_depth
+    }
+
+
+def collapse_alphas(tree):
+    """Per node, the cost-complexity alpha at which weakest-link pruning turns it into a leaf
+
+    Leaves get -inf. Alphas are made monotone along the pruning sequence, so a node's alpha is
+    never above its ancestors' and "prune at alpha" means: stop at the first node on the path
+    whose alpha <= alpha.
+    """
+    left, right = tree['left'], tree['right']
+    n_nodes = len(left)
+    internal = left >= 0
+    parent = np.full(n_nodes, -1, dtype=np.int64)
+    parent[left[internal]] = np.flatnonzero(internal)
+    parent[right[internal]] = np.flatnonzero(internal)
+
+    risk = tree['impurity'] * tree['weight'] / tree['weight'][0]
+    subtree_risk = risk.copy()
+    leaves = np.ones(n_nodes)
+    # sklearn numbers children after their parent, so a reverse scan is bottom-up
+    for node in range(n_nodes - 1, -1, -1):
+        if internal[node]:
+            subtree_risk[node] = subtree_risk[left[node]] + subtree_risk[right[node]]
+            leaves[node] = leaves[left[node]] + leaves[right[node]]
+
+    def link_strength(node):
+        return (risk[node] - subtree_risk[node]) / (leaves[node] - 1)
+
+    alphas = np.full(n_nodes, -np.inf)
+    current = np.full(n_nodes, np.nan)
+    collapsed = ~internal
+    heap = []
+    for node in np.flatnonzero(internal):
+        current[node] = link_strength(node)
+        heap.append((current[node], node))
+    heapq.heapify(heap)
+
+    running = -np.inf
+    while heap:
+        strength, node = heapq.heappop(heap)
+        if collapsed[node] or strength != current[node]:
+            continue
+        running = max(running, strength)
+        # The node and everything still standing below it become one leaf
+        stack = [node]
+        while stack:
+            below = stack.pop()
+            if not collapsed[below]:
+                collapsed[below] = True
+                alphas[below] = running
+                stack.extend((left[below], right[below]))
+
+        delta_risk = risk[node] - subtree_risk[node]
+        delta_leaves = 1 - leaves[node]
+        ancestor = parent[node]
+        while ancestor >= 0:
+            subtree_risk[ancestor] += delta_risk
+            leaves[ancestor] += delta_leaves
+            current[ancestor] = link_strength(ancestor)
+            heapq.heappush(heap, (current[ancestor], ancestor))
+            ancestor = parent[ancestor]
+    return alphas
+
+
+def tree_paths(tree, X):
+    """(n_samples, max_depth + 1) node ids from root to leaf, padded with the leaf"""
+    left, right, feature, threshold = tree['left'], tree['right'], tree['feature'], tree['threshold']
+    rows = np.arange(len(X))
+    node = np.zeros(len(X), dtype=np.int64)
+    paths = np.empty((len(X), tree['max_depth'] + 1), dtype=np.int64)
+    for depth in range(tree['max_depth'] + 1):
+        paths[:, depth] = node
+        internal = left[node] >= 0
+        go_left = X[rows, np.where(internal, feature[node], 0)] <= threshold[node]
+        node = np.where(internal, np.where(go_left, left[node], right[node]), node)
+    return paths
+
+
+def select_trees(tree_predictions, y, target_mae, min_trees=1):
+    """Greedy forward selection; stops once the subset has min_trees and its MAE reaches target_mae"""
+    n_trees = tree_predictions.shape[1]
+    selected = []
+    remaining = list(range(n_trees))
+    running_sum = np.zeros(len(y))
+    while remaining:
+        candidates = (running_sum[:, None] + tree_predictions[:, remaining]) / (len(selected) + 1)
+        errors = np.abs(candidates - y[:, None]).mean(axis=0)
+        best = int(np.argmin(errors))
+        running_sum += tree_predictions[:, remaining[best]]
+        selected.append(remaining.pop(best))
+        if len(selected) >= min_trees and errors[best] <= target_mae:
+            break
+    return selected
+
+
+class PrunedEnsemble:
+    """Validation predictions of the selected trees at any alpha, from precomputed root-to-leaf paths"""
+
+    def __init__(self, trees, alphas, X):
+        self.values = [tree['value'] for tree in trees]
+        self.paths = [tree_paths(tree, X) for tree in trees]
+        self.path_alphas = [node_alphas[paths] for node_alphas, paths in zip(alphas, self.paths)]
+
+    def predict(self, alpha):
+        total = np.zeros(len(self.paths[0]))
+        for values, paths, path_alphas in zip(self.values, self.paths, self.path_alphas):
+            stop = np.argmax(path_alphas <= alpha, axis=1)
+            total += values[paths[np.arange(len(paths)), stop]]
+        return total / len(self.paths)
+
+
+def search_alpha(ensemble, candidates, y, max_mae):
+    """Largest candidate alpha whose pruned ensemble stays within max_mae (binary search)"""
+    best_alpha, low, high = -np.inf, 0, len(candidates) - 1
+    while low <= high:
+        middle = (low + high) // 2
+        if mean_absolute_error(y, ensemble.predict(candidates[middle])) <= max_mae:
+            best_alpha = candidates[middle]
+            low = middle + 1
+        else:
+            high = middle - 1
+    return best_alpha
+
+
+def _float32_at_most(values):
+    """float32 values rounded down, so float32 inputs compare against them exactly as against the originals"""
+    rounded = values.astype(np.float32)
+    over = rounded.astype(np.float64) > values
+    rounded[over] = np.nextafter(rounded[over], np.float32(-np.inf))
+    return rounded
+
+
+def build_compact_forest(trees, alphas, alpha, n_features):
+    feature, threshold, left, right, value, weight, roots = [], [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for tree, node_alphas in zip(trees, alphas):
+        # Renumber the nodes that survive pruning at alpha, breadth first
+        keep, is_leaf, depth = [0], [], {0: 0}
+        position = 0
+        while position < len(keep):
+            node = keep[position]
+            leaf = tree['left'][node] < 0 or node_alphas[node] <= alpha
+            is_leaf.append(leaf)
+            if not leaf:
+                for child in (tree['left'][node], tree['right'][node]):
+                    depth[child] = depth[node] + 1
+                    keep.append(child)
+            position += 1
+        keep = np.array(keep)
+        is_leaf = np.array(is_leaf)
+        new_id = {node: offset + i for i, node in enumerate(keep)}
+        max_depth = max(max_depth, max(depth[node] for node in keep))
+
+        feature.append(np.where(is_leaf, 0, tree['feature'][keep]))
+        threshold.append(np.where(is_leaf, 0.0, tree['threshold'][keep]))
+        left.append(np.array([-1 if leaf else new_id[tree['left'][node]] for node, leaf in zip(keep, is_leaf)]))
+        right.append(np.array([-1 if leaf else new_id[tree['right'][node]] for node, leaf in zip(keep, is_leaf)]))
+        value.append(tree['value'][keep])
+        weight.append(tree['weight'][keep])
+        roots.append(offset)
+        offset += len(keep)
+
+    return CompactForest(
+        feature=np.concatenate(feature).astype(np.int16),
+        threshold=_float32_at_most(np.concatenate(threshold)),
+        left=np.concatenate(left).astype(np.int32),
+        right=np.concatenate(right).astype(np.int32),
+        value=np.concatenate(value).astype(np.float32),
+        roots=np.array(roots, dtype=np.int32),
+        max_depth=max_depth,
+        n_features_in=n_features,
+        weight=np.concatenate(weight).astype(np.float32)
+    )
+
+
+def compact_forest(model, X_val, y_val, tolerance=0.02, selection_share=0.5, min_trees=20):
+    """Smallest/shallowest CompactForest whose validation MAE is within (1 + tolerance) of the forest's
+
+    selection_share: fraction of the tolerance spent on dropping trees; pruning may use the rest
+    min_trees: floor on the selected trees - a handful of trees picked on a few hundred validation
+               rows generalises worse than the tolerance suggests, and per-tree uncertainty needs a spread
+    """
+    X_val = np.asarray(X_val, dtype=np.float32)
+    y_val = np.asarray(y_val, dtype=np.float64)
+    tree_predictions = per_tree_predictions(model, X_val)
+    base_mae = mean_absolute_error(y_val, tree_predictions.mean(axis=1))
+    max_mae = base_mae * (1 + tolerance)
+
+    selected = select_trees(tree_predictions, y_val, base_mae * (1 + tolerance * selection_share),
+                            min(min_trees, tree_predictions.shape[1]))
+    trees = [flatten_tree(model.estimators_[i]) for i in selected]
+    alphas = [collapse_alphas(tree) for tree in trees]
+
+    candidates = np.unique(np.concatenate([a[np.isfinite(a)] for a in alphas]))
+    alpha = search_alpha(PrunedEnsemble(trees, alphas, X_val), candidates, y_val, max_mae) if len(candidates) else -np.inf
+
+    compact = build_compact_forest(trees, alphas, alpha, X_val.shape[1])
+    return compact, {
+        'tolerance': tolerance,
+        'selected_trees': [int(i) for i in selected],
+        'alpha': float(alpha),
+        'baseline_validation_mae': float(base_mae),
+        'validation_mae': float(mean_absolute_error(y_val, compact.predict(X_val)))
+    }
+
+
+def _median_seconds(function, repeats):
+    function()
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return float(np.median(timings))
+
+
+def profile_model(model, X_report, y_report):
+    """Size, load time, RAM, latency and accuracy of one model for the before/after report"""
+    blob = pickle.dumps(model)
+    if isinstance(model, CompactForest):
+        nodes, ram = model.node_count, model.nbytes()
+    else:
+        nodes = sum(e.tree_.node_count for e in model.estimators_)
+        # Node records plus the value array of every tree
+        ram = sum(e.tree_.__getstate__()['nodes'].nbytes + e.tree_.value.nbytes for e in model.estimators_)
+    predictions = model.predict(X_report)
+    return {
+        'trees': len(model.estimators_) if hasattr(model, 'estimators_') else model.n_estimators,
+        'nodes': int(nodes),
+        'pickle_mb': len(blob) / 1e6,
+        'ram_mb': ram / 1e6,
+        'load_ms': _median_seconds(lambda: pickle.loads(blob), 5) * 1000,
+        'predict_1_row_ms': _median_seconds(lambda: model.predict(X_report[:1]), 20) * 1000,
+        'predict_1000_rows_ms': _median_seconds(lambda: model.predict(X_report[:1000]), 5) * 1000,
+        'r2_score': float(r2_score(y_report, predictions)),
+        'mae': float(mean_absolute_error(y_report, predictions))
+    }
+
+
+def holdout_split(model_data, dataset_path):
+    """real_model_trainer's test split, halved into (tuning rows, report rows)"""
+    from distillation import load_dataset, encode_frame, FEATURE_COLS
+    df = load_dataset(dataset_path)
+    X = encode_frame(model_data['encoders'], df)[:, [FEATURE_COLS.index(c) for c in model_data['feature_cols']]]
+    y = df['Yield'].to_numpy(dtype=np.float64)
+    _, X_test, _, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=df['Crop'])
+    X_test = X_test.astype(np.float32)
+    return (X_test[0::2], y_test[0::2]), (X_test[1::2], y_test[1::2])
+
+
+def print_report(before, after):
+    print(f"\n📊 {'':<22}{'before':>12}{'after':>12}")
+    rows = [('trees', 'trees', '{:.0f}'), ('nodes', 'nodes', '{:.0f}'), ('pickle (MB)', 'pickle_mb', '{:.2f}'),
+            ('RAM (MB)', 'ram_mb', '{:.2f}'), ('load (ms)', 'load_ms', '{:.1f}'),
+            ('predict 1 row (ms)', 'predict_1_row_ms', '{:.3f}'),
+            ('predict 1000 rows (ms)', 'predict_1000_rows_ms', '{:.1f}'),
+            ('R² (report rows)', 'r2_score', '{:.4f}'), ('MAE (report rows)', 'mae', '{:.2f}')]
+    for label, key, fmt in rows:
+        print(f"   {label:<22}{fmt.format(before[key]):>12}{fmt.format(after[key]):>12}")
+
+
+def compact_production_artifact(dataset_path='multimodal_crop_dataset.csv', tolerance=0.02,
+                                selection_share=0.5, min_trees=20, output='trained_crop_model.compact.pkl',
+                                version=False):
+    handle = get_registry().get('production')
+    model_data = handle.payload
+    if not hasattr(model_data['model'], 'estimators_'):
+        raise ValueError(f"{type(model_data['model']).__name__} is not a tree forest; nothing to compact")
+
+    (X_tune, y_tune), (X_report, y_report) = holdout_split(model_data, dataset_path)
+    print(f"🌲 Compacting {len(model_data['model'].estimators_)} trees (MAE tolerance {tolerance * 100:g}%, "
+          f"{len(X_tune)} tuning rows, {len(X_report)} report rows)...")
+    started = time.perf_counter()
+    compact, summary = compact_forest(model_data['model'], X_tune, y_tune, tolerance, selection_share, min_trees)
+    print(f"   done in {time.perf_counter() - started:.1f}s: {len(summary['selected_trees'])} trees, "
+          f"alpha {summary['alpha']:.4g}, tuning MAE {summary['baseline_validation_mae']:.2f} -> "
+          f"{summary['validation_mae']:.2f}")
+
+    before = profile_model(model_data['model'], X_report, y_report)
+    after = profile_model(compact, X_report, y_report)
+    print_report(before, after)
+    growth = after['mae'] / before['mae'] - 1
+    if growth > tolerance:
+        print(f"⚠️  MAE on the report rows grew {growth * 100:.1f}% (tolerance {tolerance * 100:g}%): the tuning rows "
+              f"are too few to generalise; raise --min-trees or tune on a larger dataset")
+
+    compacted = dict(model_data)
+    compacted['model'] = compact
+    # Cross-validated metrics describe the uncompacted forest
+    compacted.pop('evaluation', None)
+    compacted['performance'] = {**model_data.get('performance', {}), 'r2_score': after['r2_score'],
+                                'mae': after['mae'], 'accuracy': after['r2_score'] * 100}
+    compacted['compaction'] = {**summary, 'before': before, 'after': after}
+
+    # Atomic write so running services hot-swap to the compact model without reading a partial file
+    path = publish('production', compacted, '.') if version else save_artifact(compacted, output)
+    print(f"💾 Compact model saved to {path}")
+    return compacted
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compact the production Random Forest within an MAE tolerance')
+    parser.add_argument('--dataset', default='multimodal_crop_dataset.csv')
+    parser.add_argument('--tolerance', type=float, default=0.02,
+                        help='allowed relative increase of validation MAE (0.02 = 2%%)')
+    parser.add_argument('--selection-share', type=float, default=0.5,
+                        help='fraction of the tolerance spent on dropping trees before pruning')
+    parser.add_argument('--min-trees', type=int, default=20, help='keep at least this many trees')
+    parser.add_argument('--output', default='trained_crop_model.compact.pkl')
+    parser.add_argument('--version', action='store_true',
+                        help='publish as the next trained_crop_model.v<N>.pkl so services hot-swap to it')
+    args = parser.parse_args()
+
+    # Run through the importable module so the pickled model references forest_compaction.CompactForest
+    import forest_compaction
+    try:
+        forest_compaction.compact_production_artifact(args.dataset, args.tolerance, args.selection_share,
+                                                      args.min_trees, args.output, args.version)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Geospatial resolution - field coordinates to (state, district) and field area, before prediction
+
+District boundaries are read once from a local GeoJSON file (DISTRICT_BOUNDARIES, default
+backend/ml/district_boundaries.geojson; e.g. the Datameet or GADM level-2 India boundaries). Each
+district's rings are flattened into edge arrays; a KD-tree over district centroids plus per-district
+bounding boxes picks the few candidates a point can fall in, and an even-odd ray test over the edge
+arrays decides containment. Batches are resolved candidate-by-candidate with the points of one
+district tested together. Points outside every boundary resolve to the nearest district centroid,
+marked 'nearest'.
+
+get_resolver() renames boundary states/districts to the served Random Forest model's encoder spelling
+(notebook artifact, else production) and lists in each result the names the model has never seen,
+which would otherwise encode silently to 0.
+
+Coordinates follow the frontend (LandMapSelector): [lat, lng] pairs.
+
+    python geo_resolver.py point 26.85 80.95
+    python geo_resolver.py fields uploads.geojson --crop Rice --season Kharif --year 2024 --output fields.csv
+"""
+import os
+import re
+import sys
+import json
+import argparse
+from pathlib import Path
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+BOUNDARIES_PATH = Path(os.environ.get('DISTRICT_BOUNDARIES', Path(__file__).parent / 'district_boundaries.geojson'))
+
+# Property names used for state / district by common India boundary datasets
+STATE_PROPERTIES = ['state', 'State', 'ST_NM', 'NAME_1', 'st_nm', 'STATE']
+DISTRICT_PROPERTIES = ['district', 'District', 'DISTRICT', 'NAME_2', 'dtname', 'DIST_NAME']
+
+EARTH_RADIUS_M = 6371008.8
+CANDIDATES = 8
+
+
+def normalize_name(name):
+    """Case, spacing and punctuation-insensitive form used to match names across sources"""
+    return re.sub(r'[^A-Z0-9]', '', str(name).upper())
+
+
+def _rings(geometry):
+    """Every ring (exterior and holes, all parts) of a Polygon/MultiPolygon as (m, 2) [lng, lat] arrays"""
+    if geometry['type'] == 'Polygon':
+        polygons = [geometry['coordinates']]
+    elif geometry['type'] == 'MultiPolygon':
+        polygons = geometry['coordinates']
+    else:
+        return []
+    return [np.asarray(ring, dtype=np.float64)[:, :2] for polygon in polygons for ring in polygon]
+
+
+def _property(properties, names):
+    for name in names:
+        if properties.get(name) not in (None, ''):
+            return str(properties[name]).strip()
+    return None
+
+
+def ring_area_m2(lng, lat):
+    """Signed spherical area of one closed or open ring (degrees in, square metres out)"""
+    lng, lat = np.radians(lng), np.radians(lat)
+    lng_next, lat_next = np.roll(lng, -1), np.roll(lat, -1)
+    return (lng_next - lng) @ (2 + np.sin(lat) + np.sin(lat_next)) * EARTH_RADIUS_M ** 2 / 2
+
+
+def polygon_area_ha(coordinates):
+    """Area in hectares of a field polygon given as [[lat, lng], ...]"""
+    points = np.asarray(coordinates, dtype=np.float64)
+    if len(points) < 3:
+        return 0.0
+    return abs(float(ring_area_m2(points[:, 1], points[:, 0]))) / 10000
+
+
+def polygon_centroid(coordinates):
+    """(lat, lng) area centroid of a small polygon, computed in a local equirectangular projection"""
+    points = np.asarray(coordinates, dtype=np.float64)
+    if len(points) < 3:
+        return tuple(points.mean(axis=0))
+    scale = np.cos(np.radians(points[:, 0].mean()))
+    x, y = points[:, 1] * scale, points[:, 0]
+    x_next, y_next = np.roll(x, -1), np.roll(y, -1)
+    cross = x * y_next - x_next * y
+    area = cross.sum() / 2
+    if abs(area) < 1e-15:
+        return tuple(points.mean(axis=0))
+    cx = ((x + x_next) * cross).sum() / (6 * area)
+    cy = ((y + y_next) * cross).sum() / (6 * area)
+    return cy, cx / scale
+
+
+class GeoResolver:
+    """District boundaries as flat edge arrays with a centroid KD-tree and bounding boxes"""
+
+    def __init__(self, path=BOUNDARIES_PATH):
+        with open(path) as f:
+            collection = json.load(f)
+
+        self.states, self.districts, self.edges = [], [], []
+        boxes, centroids = [], []
+        for feature in collection.get('features', []):
+            rings = _rings(feature.get('geometry') or {'type': None})
+            district = _property(feature.get('properties', {}), DISTRICT_PROPERTIES)
+            if not rings or district is None:
+                continue
+            self.states.append(_property(feature['properties'], STATE_PROPERTIES))
+            self.districts.append(district)
+            # (x1, y1, x2, y2) per edge over all rings: the even-odd rule handles holes and multi-parts
+            self.edges.append(np.vstack([np.hstack([ring, np.roll(ring, -1, axis=0)]) for ring in rings]))
+            stacked = np.vstack(rings)
+            boxes.append([stacked[:, 0].min(), stacked[:, 1].min(), stacked[:, 0].max(), stacked[:, 1].max()])
+            centroids.append(self._centroid(rings))
+        if not self.districts:
+            raise ValueError(f"No Polygon/MultiPolygon features with a district name in {path}")
+
+        self.boxes = np.asarray(boxes)
+        self.centroids = np.asarray(centroids)
+        self.tree = cKDTree(self._project(self.centroids[:, 1], self.centroids[:, 0]))
+        self.candidates = min(CANDIDATES, len(self.districts))
+        # Encoder names -> boundary names the model's encoders don't know (filled by align_to_encoders)
+        self.unmatched = {}
+
+    @staticmethod
+    def _project(lat, lng):
+        """Equirectangular plane in which the KD-tree's distances are close to ground distances"""
+        return np.column_stack([np.asarray(lng) * np.cos(np.radians(np.asarray(lat))), lat])
+
+    @staticmethod
+    def _centroid(rings):
+        """(lng, lat) of the largest ring's centroid - good enough to rank candidates"""
+        outer = max(rings, key=lambda ring: abs(ring_area_m2(ring[:, 0], ring[:, 1])))
+        lat, lng = polygon_centroid(outer[:, ::-1])
+        return lng, lat
+
+    def _contains(self, district, lat, lng):
+        """Boolean per point: even-odd ray test against all of the district's edges"""
+        edges = self.edges[district]
+        x1, y1, x2, y2 = (edges[:, i][None, :] for i in range(4))
+        lat = lat[:, None]
+        straddles = (y1 > lat) != (y2 > lat)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing_x = x1 + (lat - y1) * (x2 - x1) / (y2 - y1)
+        return ((straddles & (lng[:, None] < crossing_x)).sum(axis=1) % 2) == 1
+
+    def resolve_points(self, lats, lngs, chunk_size=4096):
+        """District index per point and whether it was matched by containment (else nearest centroid)"""
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        resolved = np.full(len(lats), -1, dtype=np.int64)
+        contained = np.zeros(len(lats), dtype=bool)
+        if not len(lats):
+            return resolved, contained
+
+        _, candidates = self.tree.query(self._project(lats, lngs), k=self.candidates)
+        candidates = candidates.reshape(len(lats), -1)
+        resolved[:] = candidates[:, 0]
+
+        for column in range(candidates.shape[1]):
+            pending = np.flatnonzero(~contained)
+            if not len(pending):
+                break
+            district_ids = candidates[pending, column]
+            box = self.boxes[district_ids]
+            in_box = ((lngs[pending] >= box[:, 0]) & (lngs[pending] <= box[:, 2]) &
+                      (lats[pending] >= box[:, 1]) & (lats[pending] <= box[:, 3]))
+            for district in np.unique(district_ids[in_box]):
+                rows = pending[in_box & (district_ids == district)]
+                for start in range(0, len(rows), chunk_size):
+                    block = rows[start:start + chunk_size]
+                    inside = block[self._contains(district, lats[block], lngs[block])]
+                    resolved[inside] = district
+                    contained[inside] = True
+
+        # Large districts can have a centroid farther away than several small neighbours: scan boxes
+        for row in np.flatnonzero(~contained):
+            box_hits = np.flatnonzero((self.boxes[:, 0] <= lngs[row]) & (self.boxes[:, 2] >= lngs[row]) &
+                                      (self.boxes[:, 1] <= lats[row]) & (self.boxes[:, 3] >= lats[row]))
+            for district in box_hits:
+                if self._contains(district, lats[row:row + 1], lngs[row:row + 1])[0]:
+                    resolved[row] = district
+                    contained[row] = True
+                    break
+        return resolved, contained
+
+    def describe(self, district, contained):
+        state, name = self.states[district], self.districts[district]
+        return {
+            'state': state,
+            'district': name,
+            'match': 'contains' if contained else 'nearest',
+            # Fields whose name the served model would encode to 0
+            'unmatched': [field for field, encoder_name, value in (('state', 'State', state),
+                                                                   ('district', 'District', name))
+                          if value in self.unmatched.get(encoder_name, ())]
+        }
+
+    def resolve_point(self, lat, lng):
+        """Single-request path: the same search as resolve_points without the batch bookkeeping"""
+        _, candidates = self.tree.query((lng * np.cos(np.radians(lat)), lat), k=self.candidates)
+        candidates = np.atleast_1d(candidates)
+        point_lat, point_lng = np.array([lat], dtype=np.float64), np.array([lng], dtype=np.float64)
+        for district in candidates:
+            x_min, y_min, x_max, y_max = self.boxes[district]
+            if x_min <= lng <= x_max and y_min <= lat <= y_max and self._contains(district, point_lat, point_lng)[0]:
+                return self.describe(district, True)
+        resolved, contained = self.resolve_points(point_lat, point_lng)
+        return self.describe(resolved[0], contained[0])
+
+    def resolve_fields(self, polygons):
+        """Per field polygon ([[lat, lng], ...]): state, district, match, area_ha and centroid"""
+        centroids = np.array([polygon_centroid(polygon) for polygon in polygons]).reshape(-1, 2)
+        resolved, contained = self.resolve_points(centroids[:, 0], centroids[:, 1])
+        return [{
+            **self.describe(district, inside),
+            'area_ha': round(polygon_area_ha(polygon), 4),
+            'centroid': [round(float(lat), 6), round(float(lng), 6)]
+        } for polygon, district, inside, (lat, lng) in zip(polygons, resolved, contained, centroids)]
+
+    def align_to_encoders(self, encoders):
+        """Rename states/districts to the models' LabelEncoder spelling where normalised names agree
+
+        Returns the boundary names that have no counterpart in the encoders (they would encode to 0).
+        """
+        unmatched = {}
+        for attribute, encoder_name in (('states', 'State'), ('districts', 'District')):
+            encoder = encoders.get(encoder_name)
+            if encoder is None:
+                continue
+            spelling = {normalize_name(label): str(label) for label in encoder.classes_}
+            names = getattr(self, attribute)
+            for i, name in enumerate(names):
+                if name is not None:
+                    names[i] = spelling.get(normalize_name(name), name)
+            known = set(encoder.classes_)
+            unmatched[encoder_name] = sorted({name for name in names if name is not None and name not in known})
+        self.unmatched = unmatched
+        return unmatched
+
+
+def served_encoders():
+    """LabelEncoders of the Random Forest artifact the router serves (notebook, else production), or None"""
+    try:
+        from model_registry import get_registry, discover
+        name = 'notebook' if discover('notebook') else 'production'
+        return get_registry().get(name).payload['encoders']
+    except Exception as e:
+        print(f"⚠️  No model encoders to align district names to ({e}); names are left as in the boundaries",
+              file=sys.stderr)
+        return None
+
+
+_resolver = None
+
+
+def get_resolver(encoders=None):
+    """Shared resolver, aligned to `encoders` (default: the served model's) on first use"""
+    global _resolver
+    if _resolver is None:
+        if not BOUNDARIES_PATH.exists():
+            raise FileNotFoundError(f"District boundaries not found at {BOUNDARIES_PATH}; "
+                                    f"set DISTRICT_BOUNDARIES to a GeoJSON file of district polygons")
+        resolver = GeoResolver(BOUNDARIES_PATH)
+        encoders = encoders if encoders is not None else served_encoders()
+        if encoders is not None:
+            for encoder_name, names in resolver.align_to_encoders(encoders).items():
+                if names:
+                    shown = ', '.join(map(str, names[:10])) + (', ...' if len(names) > 10 else '')
+                    print(f"⚠️  {len(names)} boundary {encoder_name} name(s) unknown to the model "
+                          f"(they encode to 0): {shown}", file=sys.stderr)
+        _resolver = resolver
+    return _resolver
+
+
+def _load_fields(path):
+    """Field polygons and their properties from a GeoJSON FeatureCollection ([lng, lat]) or a JSON list of [lat, lng] rings"""
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, dict) and data.get('type') == 'FeatureCollection':
+        fields = []
+        for feature in data['features']:
+            rings = _rings(feature['geometry'])
+            if rings:
+                fields.append((rings[0][:, ::-1], feature.get('properties') or {}))
+        return fields
+    return [(np.asarray(polygon, dtype=np.float64), {}) for polygon in data]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Resolve field coordinates to state/district')
+    commands = parser.add_subparsers(dest='command', required=True)
+    point = commands.add_parser('point')
+    point.add_argument('lat', type=float)
+    point.add_argument('lng', type=float)
+    fields_parser = commands.add_parser('fields', help='resolve uploaded field polygons into scoring rows')
+    fields_parser.add_argument('path')
+    fields_parser.add_argument('--crop')
+    fields_parser.add_argument('--season')
+    fields_parser.add_argument('--year', type=int)
+    fields_parser.add_argument('--output', help='CSV in bulk_scoring.py input layout (default: JSON to stdout)')
+    args = parser.parse_args()
+
+    try:
+        resolver = get_resolver()
+    except (FileNotFoundError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    if args.command == 'point':
+        print(json.dumps(resolver.resolve_point(args.lat, args.lng)))
+    else:
+        fields = _load_fields(args.path)
+        rows = []
+        for (_, properties), resolved in zip(fields, resolver.resolve_fields([polygon for polygon, _ in fields])):
+            row = {'state': resolved['state'], 'district': resolved['district'],
+                   'crop': properties.get('crop', args.crop), 'season': properties.get('season', args.season),
+                   'year': properties.get('year', args.year), 'area': resolved['area_ha'],
+                   'match': resolved['match'], 'unmatched': ';'.join(resolved['unmatched']),
+                   'centroid_lat': resolved['centroid'][0],
+                   'centroid_lng': resolved['centroid'][1]}
+            rows.append(row)
+        if args.output:
+            import pandas as pd
+            pd.DataFrame(rows).to_csv(args.output, index=False)
+            print(f"💾 {len(rows)} field(s) resolved -> {args.output}")
+        else:
+            print(json.dumps(rows))
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Real image input for the multimodal model - photos, satellite images or directories of tiles
+
+Files are decoded and resized in a thread pool (PIL releases the GIL while doing so). The resized
+uint8 pixels are cached on disk under a hash of the file contents and target size, so a field that
+is scored again skips decoding and resizing. The cache is bounded in size with LRU eviction.
+"""
+import os
+import sys
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+CACHE_DIR = Path(os.environ.get('IMAGE_CACHE_DIR', Path(__file__).parent / 'image_cache'))
+CACHE_MAX_BYTES = int(float(os.environ.get('IMAGE_CACHE_MB', 512)) * 1024 * 1024)
+DECODE_WORKERS = int(os.environ.get('IMAGE_DECODE_WORKERS', min(8, os.cpu_count() or 1)))
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp', '.webp'}
+
+# Same normalisation as MultimodalYieldPredictor.transform
+NORMALIZE_MEAN = [0.485, 0.456, 0.406]
+NORMALIZE_STD = [0.229, 0.224, 0.225]
+
+
+def expand_source(source):
+    """A file is one image; a directory is a field made of all image tiles inside it"""
+    path = Path(source)
+    if path.is_dir():
+        tiles = sorted(p for p in path.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+        if not tiles:
+            raise FileNotFoundError(f"No image tiles in {path}")
+        return tiles
+    if not path.exists():
+        raise FileNotFoundError(f"Image not found: {path}")
+    return [path]
+
+
+class ImageCache:
+    """Content-addressed on-disk cache of resized uint8 images, evicted least-recently-used first"""
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, data, size):
+        digest = hashlib.sha256(data)
+        digest.update(f'{size}x{size}'.encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return self.directory / f'{key}.npy'
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            pixels = np.load(path)
+        except (FileNotFoundError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        # Touch so eviction sees this entry as recently used
+        os.utime(path)
+        with self.lock:
+            self.hits += 1
+        return pixels
+
+    def put(self, key, pixels):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp_path = path.with_name(f'.{key}.{threading.get_ident()}.tmp.npy')
+        np.save(tmp_path, pixels)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def entries(self):
+        if not self.directory.is_dir():
+            return []
+        entries = []
+        for path in self.directory.glob('*.npy'):
+            if path.name.startswith('.'):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        with self.lock:
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def stats(self):
+        entries = self.entries()
+        return {
+            'directory': str(self.directory),
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+    def clear(self):
+        for _, _, path in self.entries():
+            path.unlink()
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = ImageCache()
+    return _cache
+
+
+def decode_resized(path, size=224, cache=None):
+    """Resized (size, size, 3) uint8 pixels for one image file, through the cache"""
+    cache = cache or get_cache()
+    data = Path(path).read_bytes()
+    key = cache.key(data, size)
+    pixels = cache.get(key)
+    if pixels is None:
+        with Image.open(path) as image:
+            image = image.convert('RGB').resize((size, size), Image.BILINEAR)
+            pixels = np.asarray(image, dtype=np.uint8)
+        cache.put(key, pixels)
+    return pixels
+
+
+def load_fields(sources, size=224, workers=DECODE_WORKERS, cache=None):
+    """(n_fields, size, size, 3) uint8 array; tiles of a directory are averaged into one field image"""
+    tile_lists = [expand_source(source) for source in sources]
+    all_tiles = [tile for tiles in tile_lists for tile in tiles]
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        decoded = list(pool.map(lambda tile: decode_resized(tile, size, cache), all_tiles))
+
+    fields = np.empty((len(tile_lists), size, size, 3), dtype=np.uint8)
+    position = 0
+    for i, tiles in enumerate(tile_lists):
+        stack = decoded[position:position + len(tiles)]
+        position += len(tiles)
+        fields[i] = stack[0] if len(stack) == 1 else np.mean(stack, axis=0).round().astype(np.uint8)
+    return fields
+
+
+def to_tensor(fields):
+    """uint8 NHWC pixels -> normalised float NCHW tensor, matching the predictor's transform"""
+    import torch
+    tensor = torch.from_numpy(fields).permute(0, 3, 1, 2).float().div_(255)
+    mean = torch.tensor(NORMALIZE_MEAN).view(1, 3, 1, 1)
+    std = torch.tensor(NORMALIZE_STD).view(1, 3, 1, 1)
+    return tensor.sub_(mean).div_(std)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ('warm', 'stats', 'clear'):
+        print("Usage: python image_ingest.py warm <image or tile dir>... | stats | clear")
+        sys.exit(1)
+
+    command = sys.argv[1]
+    if command == 'warm':
+        fields = load_fields(sys.argv[2:])
+        print(f"✅ Cached {len(fields)} field image(s)", file=sys.stderr)
+    elif command == 'clear':
+        get_cache().clear()
+    print(json.dumps(get_cache().stats()))
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Inference router - picks the multimodal, Random Forest shard, Random Forest, distilled student or statistical tier
+per request within one process, based on latency budget, input completeness and shard coverage
+
+The multimodal tier is only tried when the caller supplies every environmental input; otherwise the
+forests fill them from the district feature index. Latency estimates (EWMA) and the per-tier circuit
+breaker live in the InferenceRouter instance, so they only steer routing where one router serves many
+requests (load_test.py --target inprocess, ensemble.py); server.js spawns a process per request, where
+each tier starts from its cold latency prior and a closed circuit.
+"""
+import os
+import sys
+import json
+import time
+import contextlib
+import threading
+
+from model_registry import get_registry, discover, ModelNotFoundError
+from forest_uncertainty import uncertainty_or_unavailable, summarize
+from tree_shap import explain_or_unavailable as explain
+from profiling import request as profiled_request, section, install_signal_handler
+
+ENVIRONMENTAL_FIELDS = ['ndvi_mean', 'temp_avg', 'rainfall_mm', 'soil_ph']
+LOCATION_FIELDS = ['state', 'district', 'crop', 'season', 'year']
+
+DEFAULT_BUDGET_MS = float(os.environ.get('PREDICTION_BUDGET_MS', 5000))
+
+# Legacy notebook metrics, reported when an artifact carries none of its own
+NOTEBOOK_METRICS = {'r2_score': 0.915, 'mae': 14.83, 'accuracy': 91.5}
+
+
+class Tier:
+    """One model tier with a latency estimate and a simple circuit breaker"""
+
+    # Latency prior (ms) before the tier has served anything, including model load
+    cold_ms = 0.0
+    required_fields = []
+    failure_threshold = 3
+    cooldown_s = 30.0
+
+    def __init__(self):
+        self.ewma_ms = None
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.lock = threading.Lock()
+
+    def available(self):
+        """Whether the tier can serve at all (artifact present, dependencies importable)"""
+        return True
+
+    def expected_ms(self):
+        if self.ewma_ms is None:
+            return self.cold_ms
+        return self.ewma_ms
+
+    def healthy(self):
+        return time.monotonic() >= self.open_until
+
+    def missing_fields(self, request):
+        return [field for field in self.required_fields if request.get(field) in (None, '')]
+
+    def covers(self, request):
+        """Whether the tier has a model for this request's segment"""
+        return True
+
+    def record_success(self, elapsed_ms):
+        with self.lock:
+            self.consecutive_failures = 0
+            self.ewma_ms = elapsed_ms if self.ewma_ms is None else 0.8 * self.ewma_ms + 0.2 * elapsed_ms
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                self.open_until = time.monotonic() + self.cooldown_s
+
+    def predict(self, request):
+        raise NotImplementedError
+
+    def describe(self):
+        return {
+            'expected_ms': round(self.expected_ms(), 2),
+            'healthy': self.healthy(),
+            'consecutive_failures': self.consecutive_failures,
+        }
+
+
+class MultimodalTier(Tier):
+    name = 'multimodal'
+    cold_ms = 4000.0
+    required_fields = LOCATION_FIELDS + ENVIRONMENTAL_FIELDS
+
+    def __init__(self):
+        super().__init__()
+        self.predictor = None
+
+    def available(self):
+        return bool(discover('multimodal'))
+
+    def predict(self, request):
+        if self.predictor is None:
+            # torch is only imported once this tier is actually chosen
+            from multimodal_service import MultimodalYieldPredictor
+            self.predictor = MultimodalYieldPredictor()
+        predicted_yield = self.predictor.predict_model(request)
+        metrics = self.predictor.handle.metrics_for(request.get('crop'), request.get('state'))
+        return {
+            'predicted_yield': predicted_yield,
+            'model_used': 'Multimodal ViT',
+            'confidence': round(metrics.get('accuracy', 94.2), 2),
+            'r2_score': metrics.get('r2_score', 0.942),
+            'mae': metrics.get('mae', 12.1),
+            'multimodal': True,
+        }
+
+
+class RandomForestTier(Tier):
+    name = 'random_forest'
+    cold_ms = 800.0
+    required_fields = LOCATION_FIELDS
+
+    def available(self):
+        return bool(discover('notebook') or discover('production'))
+
+    def predict(self, request):
+        with section('model_load'):
+            try:
+                handle = get_registry().get('notebook')
+            except ModelNotFoundError:
+                handle = get_registry().get('production')
+        model = handle.payload['model']
+
+        with section('encoding'):
+            if handle.name == 'notebook':
+                from notebook_model import encode_features, FEATURE_COLS as feature_cols
+                features = encode_features(handle.payload['encoders'], request['state'], request['district'],
+                                           request['crop'], request['season'], request['year'],
+                                           request.get('area', 100.0))
+                model_used = 'RandomForest_Trained_91.5%'
+            else:
+                from production_model import build_feature_vector
+                features = build_feature_vector(handle.payload, request['district'], request['crop'],
+                                                request['season'], request['year'],
+                                                request.get('state', 'Uttar Pradesh'), request.get('area', 100.0),
+                                                environment=request)
+                model_used = 'RandomForest_Real'
+                feature_cols = handle.payload['feature_cols']
+
+        with section('predict'):
+            if request.get('uncertainty'):
+                predictions, spread = uncertainty_or_unavailable(model, features)
+                prediction = predictions[0]
+            else:
+                prediction = model.predict(features)[0]
+            if request.get('explain'):
+                attributions = explain(model, features, feature_cols)[0]
+        
+        metrics = handle.metrics_for(request.get('crop'), request.get('state'))
+        result = {
+            'predicted_yield': max(0.0, float(prediction)),
+            'model_used': model_used,
+            'confidence': round(metrics.get('accuracy', NOTEBOOK_METRICS['accuracy']), 2),
+            'r2_score': metrics.get('r2_score', NOTEBOOK_METRICS['r2_score']),
+            'mae': metrics.get('mae', NOTEBOOK_METRICS['mae']),
+        }
+        if request.get('uncertainty'):
+            result['uncertainty'] = summarize(spread)
+        if request.get('explain'):
+            result['attributions'] = attributions
+        return result
+
+
+class ShardTier(Tier):
+    """Per-crop / per-(crop, state) forests (model_shards.py), loaded on first use of their segment"""
+    name = 'shard'
+    cold_ms = 300.0
+    required_fields = LOCATION_FIELDS
+
+    def __init__(self):
+        super().__init__()
+        from model_shards import get_shard_router
+        self.shards = get_shard_router()
+
+    def available(self):
+        return self.shards.available()
+
+    def covers(self, request):
+        return self.shards.shard_for(request.get('crop'), request.get('state')) is not None
+
+    def predict(self, request):
+        with section('model_load'):
+            name = self.shards.shard_for(request.get('crop'), request.get('state'))
+            payload = self.shards.get(name)
+        with section('encoding'):
+            from production_model import build_feature_vector
+            features = build_feature_vector(payload, request['district'], request['crop'], request['season'],
+                                            request['year'], request.get('state'), request.get('area', 100.0),
+                                            environment=request)
+        with section('predict'):
+            if request.get('uncertainty'):
+                predictions, spread = uncertainty_or_unavailable(payload['model'], features)
+                prediction = predictions[0]
+            else:
+                prediction = payload['model'].predict(features)[0]
+        performance = payload['performance']
+        result = {
+            'predicted_yield': max(0.0, float(prediction)),
+            'model_used': 'RandomForest_Shard',
+            'shard': name,
+            'confidence': round(performance.get('accuracy', NOTEBOOK_METRICS['accuracy']), 2),
+            'r2_score': performance.get('r2_score', NOTEBOOK_METRICS['r2_score']),
+            'mae': performance.get('mae', NOTEBOOK_METRICS['mae']),
+        }
+        if request.get('uncertainty'):
+            result['uncertainty'] = summarize(spread)
+        if request.get('explain'):
+            result['attributions'] = explain(payload['model'], features, payload['feature_cols'])[0]
+        return result
+
+
+class StudentTier(Tier):
+    """Distilled student (distillation.py): imitates the larger models at a fraction of their latency"""
+    name = 'student'
+    cold_ms = 50.0
+    required_fields = LOCATION_FIELDS
+
+    def available(self):
+        return bool(discover('student'))
+
+    def predict(self, request):
+        from production_model import build_feature_vector
+        with section('model_load'):
+            handle = get_registry().get('student')
+        with section('encoding'):
+            features = build_feature_vector(handle.payload, request['district'], request['crop'],
+                                            request['season'], request['year'],
+                                            request.get('state', 'Uttar Pradesh'), request.get('area', 100.0),
+                                            environment=request)
+        with section('predict'):
+            prediction = handle.payload['model'].predict(features)[0]
+        metrics = handle.metrics
+        return {
+            'predicted_yield': max(0.0, float(prediction)),
+            'model_used': f"Distilled_{handle.payload['distillation']['student'].upper()}",
+            'confidence': round(metrics.get('accuracy', 0.0), 2),
+            'r2_score': metrics.get('r2_score'),
+            'mae': metrics.get('mae'),
+        }
+
+
+class StatisticalTier(Tier):
+    name = 'statistical'
+    cold_ms = 1.0
+    required_fields = ['crop']
+
+    def predict(self, request):
+        from simple_yield_model import predict_yield
+        return predict_yield(request.get('state', ''), request.get('district', ''), request['crop'],
+                             request.get('season', 'Kharif'), request.get('year', 2024),
+                             request.get('area', 100.0))
+
+
+class InferenceRouter:
+    """Routes each request to the best tier that fits its budget; the last tier always answers"""
+
+    def __init__(self, tiers=None):
+        self.tiers = tiers or [MultimodalTier(), ShardTier(), RandomForestTier(), StudentTier(), StatisticalTier()]
+
+    def route(self, request, budget_ms=None):
+        budget_ms = DEFAULT_BUDGET_MS if budget_ms is None else float(budget_ms)
+        started = time.perf_counter()
+        skipped = {}
+        attempts = []
+
+        for index, tier in enumerate(self.tiers):
+            last_resort = index == len(self.tiers) - 1
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            remaining_ms = budget_ms - elapsed_ms
+
+            if not last_resort:
+                missing = tier.missing_fields(request)
+                if missing:
+                    skipped[tier.name] = f'missing inputs: {missing}'
+                    continue
+                if not tier.available():
+                    skipped[tier.name] = 'no artifact'
+                    continue
+                if not tier.covers(request):
+                    skipped[tier.name] = 'no model for this segment'
+                    continue
+                if not tier.healthy():
+                    skipped[tier.name] = 'circuit open after repeated failures'
+                    continue
+                if tier.expected_ms() > remaining_ms:
+                    skipped[tier.name] = (f'expected {tier.expected_ms():.0f}ms exceeds '
+                                          f'remaining budget {remaining_ms:.0f}ms')
+                    continue
+
+            tier_started = time.perf_counter()
+            try:
+                # Model code prints diagnostics to stdout; keep stdout for the JSON response only
+                with contextlib.redirect_stdout(sys.stderr):
+                    result = tier.predict(request)
+            except Exception as e:
+                tier_ms = (time.perf_counter() - tier_started) * 1000
+                tier.record_failure()
+                attempts.append({'tier': tier.name, 'latency_ms': round(tier_ms, 2), 'error': str(e)})
+                print(f"❌ {tier.name} tier failed: {e}", file=sys.stderr)
+                if last_resort:
+                    raise
+                continue
+
+            tier_ms = (time.perf_counter() - tier_started) * 1000
+            tier.record_success(tier_ms)
+            attempts.append({'tier': tier.name, 'latency_ms': round(tier_ms, 2)})
+            return self._finish(request, result, tier, started, budget_ms, skipped, attempts)
+
+    def _finish(self, request, result, tier, started, budget_ms, skipped, attempts):
+        result = dict(result)
+        result['predicted_yield'] = round(float(result['predicted_yield']), 2)
+        if 'total_production' not in result and request.get('area') is not None:
+            result['total_production'] = round(result['predicted_yield'] * float(request['area']) * 1000)
+        result.setdefault('features_used', {
+            field: request.get(field) for field in LOCATION_FIELDS + ['area'] if field in request
+        })
+        result['tier'] = tier.name
+        result['latency_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        result['routing'] = {
+            'budget_ms': budget_ms,
+            'attempts': attempts,
+            'skipped': skipped,
+        }
+        return result
+
+    def health(self):
+        return {tier.name: tier.describe() for tier in self.tiers}
+
+
+def normalize_request(data):
+    """Accept both the server's camel/short keys and the Python services' snake_case keys"""
+    request = {key: value for key, value in data.items() if value is not None}
+    if 'soil_pH' in request and 'soil_ph' not in request:
+        request['soil_ph'] = request.pop('soil_pH')
+    if 'year' in request:
+        request['year'] = int(request['year'])
+    if 'area' in request:
+        request['area'] = float(request['area'])
+    for field in ENVIRONMENTAL_FIELDS:
+        if field in request:
+            request[field] = float(request[field])
+    return request
+
+
+def main():
+    args = sys.argv[1:]
+    budget_ms = None
+    if '--budget-ms' in args:
+        position = args.index('--budget-ms')
+        budget_ms = float(args[position + 1])
+        del args[position:position + 2]
+
+    if args:
+        if len(args) < 5:
+            print("Usage: python inference_router.py [--budget-ms N] <state> <district> <crop> <season> <year> [area]")
+            print("   or: echo '{...}' | python inference_router.py [--budget-ms N]")
+            sys.exit(1)
+        data = dict(zip(['state', 'district', 'crop', 'season', 'year', 'area'], args))
+    else:
+        data = json.loads(sys.stdin.read())
+
+    budget_ms = data.pop('budget_ms', budget_ms)
+    install_signal_handler()
+    with profiled_request('inference_router'):
+        result = InferenceRouter().route(normalize_request(data), budget_ms)
+        with section('serialisation'):
+            print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
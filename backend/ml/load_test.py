@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+"""
+Load generator for the prediction path - open or closed loop, with latency SLO reports
+
+Requests are drawn from the mix the frontend produces: a state/district from stateDistricts.js, one
+of the supported crops and seasons, a year, a farm area and the environmental inputs server.js
+attaches. They are sent to one of these targets:
+
+- spawn:     one Python process per request, as server.js does (`--service inference_router` etc.)
+- http:      POST JSON to a running server (default the Express API's /api/predict-yield)
+- inprocess: a resident InferenceRouter in this process, i.e. what a long-lived server would pay
+
+Open loop (`--rate R`) schedules arrivals at R/s (Poisson or uniform) regardless of how fast
+responses come back, and measures each latency from its scheduled send time so queueing delay is
+not hidden; `--max-in-flight` bounds the outstanding requests and the rest are shed. Closed loop
+(`--concurrency N`) keeps N requests outstanding with an optional think time.
+
+While running, a sampler reads /proc for host CPU and the CPU and RSS of the monitored process tree
+(this process and the services it spawns, or `--pid` of a server), next to per-interval throughput,
+errors and latency. Without /proc (Windows, macOS) the resource columns are left empty with a
+warning; the throughput and latency timeline is unaffected. Everything runs locally.
+
+    python load_test.py --target spawn --rate 5 --duration 30
+    python load_test.py --target inprocess --concurrency 4 --duration 20 --slo p95=200 p99=500 errors=0.01
+    python load_test.py --target http --url http://localhost:5001/api/predict-yield --rate 50 --pid 1234
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import contextlib
+import subprocess
+import urllib.request
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from bulk_scoring import load_state_districts
+
+ML_DIR = Path(__file__).parent
+# What the frontend offers (src/components/YieldPrediction.js)
+CROPS = ['Rice', 'Wheat', 'Maize', 'Sugarcane', 'Cotton']
+SEASONS = ['Kharif', 'Rabi', 'Summer']
+DEFAULT_URL = 'http://localhost:5001/api/predict-yield'
+
+
+class RequestMix:
+    """Reproducible stream of request dicts shaped like server.js' router input"""
+
+    def __init__(self, seed=0, environment=True, crops=CROPS, seasons=SEASONS):
+        self.random = random.Random(seed)
+        self.locations = [(state, district) for state, districts in load_state_districts().items()
+                          for district in districts]
+        self.environment = environment
+        self.crops = crops
+        self.seasons = seasons
+        self.lock = threading.Lock()
+
+    def next(self):
+        with self.lock:
+            r = self.random
+            state, district = r.choice(self.locations)
+            request = {
+                'state': state, 'district': district, 'crop': r.choice(self.crops),
+                'season': r.choice(self.seasons), 'year': r.randint(2015, 2024),
+                # Mostly smallholdings with a long tail of large farms
+                'area': round(min(1000.0, r.lognormvariate(3.0, 1.0)), 1)
+            }
+            if self.environment:
+                request.update({
+                    'ndvi_mean': round(r.uniform(0.3, 0.85), 3), 'soil_ph': round(r.uniform(5.5, 8.0), 2),
+                    'temp_avg': round(r.uniform(15.0, 35.0), 1), 'rainfall_mm': round(r.uniform(20.0, 400.0), 1)
+                })
+            return request
+
+
+def _parse_response(stdout):
+    """The service's JSON result: the last stdout line (services may print diagnostics first)"""
+    lines = [line for line in stdout.strip().splitlines() if line.strip()]
+    if not lines:
+        raise RuntimeError('empty response')
+    result = json.loads(lines[-1])
+    if isinstance(result, dict) and result.get('error'):
+        raise RuntimeError(result['error'])
+    return result
+
+
+# Spawned services: (script, argv builder or None for JSON on stdin)
+SERVICES = {
+    'inference_router': ('inference_router.py', None),
+    'ensemble': ('ensemble.py predict', None),
+    'notebook_model': ('notebook_model.py', lambda q: [q['state'], q['district'], q['crop'], q['season'],
+                                                        str(q['year']), str(q['area'])]),
+    'production_model': ('production_model.py', lambda q: [q['district'], q['crop'], q['season'], str(q['year'])]),
+}
+
+
+class SpawnTarget:
+    """One interpreter per request, like server.js' spawn('python', [routerPath])"""
+
+    def __init__(self, service='inference_router', timeout=30.0):
+        script, self.argv = SERVICES[service]
+        script, *subcommand = script.split()
+        self.command = [sys.executable, str(ML_DIR / script)] + subcommand
+        self.timeout = timeout
+
+    def __call__(self, request):
+        argv = self.argv(request) if self.argv else []
+        stdin = None if self.argv else json.dumps(request)
+        completed = subprocess.run(self.command + argv, input=stdin, capture_output=True, text=True,
+                                   timeout=self.timeout, cwd=ML_DIR)
+        if completed.returncode != 0:
+            tail = (completed.stderr or completed.stdout).strip().splitlines()[-1:] or ['']
+            raise RuntimeError(f'exit {completed.returncode}: {tail[0][:200]}')
+        return _parse_response(completed.stdout)
+
+
+class HttpTarget:
+    """POST the request as JSON to a running server"""
+
+    def __init__(self, url=DEFAULT_URL, timeout=30.0):
+        self.url = url
+        self.timeout = timeout
+
+    def __call__(self, request):
+        http_request = urllib.request.Request(self.url, data=json.dumps(request).encode(),
+                                              headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(http_request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+
+class InProcessTarget:
+    """A resident inference router: models stay loaded between requests"""
+
+    def __init__(self, budget_ms=None):
+        from inference_router import InferenceRouter, normalize_request
+        self.router = InferenceRouter()
+        self.normalize = normalize_request
+        self.budget_ms = budget_ms
+
+    def __call__(self, request):
+        return self.router.route(self.normalize(request), self.budget_ms)
+
+
+class Recorder:
+    """Thread-safe log of (scheduled, finished, ok, tier, error) per request"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = []
+        self.shed = []
+
+    def call(self, target, request, scheduled):
+        tier, error = None, None
+        try:
+            result = target(request)
+            tier = result.get('tier') or result.get('model_used') if isinstance(result, dict) else None
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+        with self.lock:
+            self.records.append((scheduled, time.perf_counter(), error is None, tier, error))
+
+    def drop(self, scheduled):
+        with self.lock:
+            self.shed.append(scheduled)
+
+
+def _read_proc(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def proc_available():
+    """Whether the /proc accounting the sampler reads (and os.sysconf for its units) exists here"""
+    return hasattr(os, 'sysconf') and os.path.exists('/proc/stat')
+
+
+def _process_table():
+    """{pid: (ppid, cpu ticks, reaped children's cpu ticks, rss bytes)} for every visible process"""
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    table = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        stat = _read_proc(f'/proc/{entry}/stat')
+        if stat is None:
+            continue
+        # The command name may contain spaces: fields start after the last ')'
+        fields = stat[stat.rfind(')') + 2:].split()
+        table[int(entry)] = (int(fields[1]), int(fields[11]) + int(fields[12]), int(fields[13]) + int(fields[14]),
+                             int(fields[21]) * page_size)
+    return table
+
+
+def _tree(table, root):
+    children = {}
+    for pid, (ppid, *_rest) in table.items():
+        children.setdefault(ppid, []).append(pid)
+    pids, stack = [], [root]
+    while stack:
+        pid = stack.pop()
+        if pid in table:
+            pids.append(pid)
+            stack.extend(children.get(pid, []))
+    return pids
+
+
+def _host_cpu():
+    """(busy, total) jiffies across all CPUs from /proc/stat"""
+    values = [int(value) for value in _read_proc('/proc/stat').splitlines()[0].split()[1:]]
+    idle = values[3] + (values[4] if len(values) > 4 else 0)
+    return sum(values) - idle, sum(values)
+
+
+class ResourceSampler(threading.Thread):
+    """Samples host CPU and the monitored process tree's CPU and RSS every `interval` seconds
+
+    Without /proc only the sample times are recorded (they still frame the report's timeline) and the
+    resource fields are None.
+    """
+
+    def __init__(self, root_pid, interval=1.0):
+        super().__init__(daemon=True, name='load-test-sampler')
+        self.root_pid = root_pid
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+        self.enabled = proc_available()
+        if not self.enabled:
+            print("⚠️  /proc is not available on this platform: CPU and RSS sampling is disabled",
+                  file=sys.stderr)
+
+    def _snapshot(self):
+        table = _process_table()
+        pids = _tree(table, self.root_pid)
+        # Live processes' own time plus the root's reaped children (finished spawned services)
+        cpu = sum(table[pid][1] for pid in pids) + (table[self.root_pid][2] if self.root_pid in table else 0)
+        return time.perf_counter(), cpu, sum(table[pid][3] for pid in pids), len(pids), _host_cpu()
+
+    def run(self):
+        if not self.enabled:
+            while not self.stopped.wait(self.interval):
+                self.samples.append({'t': time.perf_counter(), 'host_cpu_pct': None, 'tree_cpu_pct': None,
+                                     'rss_mb': None, 'processes': None})
+            return
+        clock_ticks = os.sysconf('SC_CLK_TCK')
+        previous = self._snapshot()
+        while not self.stopped.wait(self.interval):
+            current = self._snapshot()
+            wall = current[0] - previous[0]
+            busy, total = current[4][0] - previous[4][0], current[4][1] - previous[4][1]
+            self.samples.append({
+                't': current[0],
+                'host_cpu_pct': round(100.0 * busy / total, 1) if total else 0.0,
+                # 100% = one core busy for the whole interval
+                'tree_cpu_pct': round(100.0 * max(0, current[1] - previous[1]) / clock_ticks / wall, 1),
+                'rss_mb': round(current[2] / 2 ** 20, 1),
+                'processes': current[3]
+            })
+            previous = current
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run_open_loop(target, mix, recorder, rate, duration, arrivals='poisson', max_in_flight=256, seed=0):
+    """Send at `rate`/s for `duration` s whatever the response times; over max_in_flight, shed"""
+    rng = random.Random(seed)
+    in_flight = threading.Semaphore(max_in_flight)
+
+    def send(request, scheduled):
+        try:
+            recorder.call(target, request, scheduled)
+        finally:
+            in_flight.release()
+
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='load-test') as pool:
+        start = time.perf_counter()
+        scheduled = start
+        while scheduled < start + duration:
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if in_flight.acquire(blocking=False):
+                pool.submit(send, mix.next(), scheduled)
+            else:
+                recorder.drop(scheduled)
+            scheduled += rng.expovariate(rate) if arrivals == 'poisson' else 1.0 / rate
+    return start
+
+
+def run_closed_loop(target, mix, recorder, concurrency, duration, think_ms=0.0):
+    """`concurrency` users, each sending its next request when the previous one returns"""
+    start = time.perf_counter()
+
+    def user():
+        while time.perf_counter() < start + duration:
+            recorder.call(target, mix.next(), time.perf_counter())
+            if think_ms:
+                time.sleep(think_ms / 1000)
+
+    threads = [threading.Thread(target=user, name=f'load-test-user-{i}') for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return start
+
+
+def _percentiles(latencies):
+    if not len(latencies):
+        return {'p50': None, 'p95': None, 'p99': None, 'max': None, 'mean': None}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {'p50': round(float(p50), 2), 'p95': round(float(p95), 2), 'p99': round(float(p99), 2),
+            'max': round(float(latencies.max()), 2), 'mean': round(float(latencies.mean()), 2)}
+
+
+def build_report(recorder, samples, start, duration, warmup, interval, config):
+    """Summary over the measured window (after warmup) plus a per-interval timeline of the whole run"""
+    measured_from = start + warmup
+    records = [record for record in recorder.records if record[0] >= measured_from]
+    shed = [t for t in recorder.shed if t >= measured_from]
+    latencies = np.array([(finished - scheduled) * 1000 for scheduled, finished, ok, _, _ in records if ok])
+    errors = [record for record in records if not record[2]]
+    attempted = len(records) + len(shed)
+    window = max(1e-9, duration - warmup)
+
+    error_kinds = {}
+    for record in errors:
+        error_kinds[record[4]] = error_kinds.get(record[4], 0) + 1
+    tiers = {}
+    for record in records:
+        if record[2]:
+            tiers[record[3]] = tiers.get(record[3], 0) + 1
+
+    timeline = []
+    for sample in samples:
+        t = sample['t']
+        window_records = [r for r in recorder.records if t - interval <= r[1] < t]
+        window_latencies = np.array([(r[1] - r[0]) * 1000 for r in window_records if r[2]])
+        timeline.append({
+            'second': round(t - start, 1),
+            'completed': len(window_records),
+            'errors': sum(1 for r in window_records if not r[2]),
+            'p50_ms': _percentiles(window_latencies)['p50'],
+            'p95_ms': _percentiles(window_latencies)['p95'],
+            **{key: sample[key] for key in ('host_cpu_pct', 'tree_cpu_pct', 'rss_mb', 'processes')}
+        })
+    measured = [s for s in samples if s['t'] >= measured_from and s['rss_mb'] is not None] or \
+        [s for s in samples if s['rss_mb'] is not None]
+
+    return {
+        'config': config,
+        'requests': attempted,
+        'completed': len(records),
+        'succeeded': int(len(latencies)),
+        'errors': len(errors),
+        'shed': len(shed),
+        'error_rate': round((len(errors) + len(shed)) / attempted, 4) if attempted else 0.0,
+        'throughput_rps': round(len(latencies) / window, 2),
+        'offered_rps': round(attempted / window, 2),
+        'latency_ms': _percentiles(latencies),
+        'served_by': tiers,
+        'error_kinds': dict(sorted(error_kinds.items(), key=lambda item: -item[1])[:10]),
+        'resources': {
+            'host_cpu_pct_mean': round(float(np.mean([s['host_cpu_pct'] for s in measured])), 1) if measured else None,
+            'tree_cpu_pct_mean': round(float(np.mean([s['tree_cpu_pct'] for s in measured])), 1) if measured else None,
+            'rss_mb_peak': max((s['rss_mb'] for s in measured), default=None),
+        },
+        'timeline': timeline
+    }
+
+
+def check_slo(report, objectives):
+    """[(objective, limit, observed, ok)] for objectives like {'p95': 500, 'errors': 0.01}"""
+    results = []
+    for name, limit in objectives.items():
+        observed = report['error_rate'] if name == 'errors' else report['latency_ms'].get(name)
+        ok = observed is not None and observed <= limit
+        results.append((name, limit, observed, ok))
+    return results
+
+
+def parse_slo(items):
+    objectives = {}
+    for item in items or []:
+        name, _, value = item.partition('=')
+        if name not in ('p50', 'p95', 'p99', 'max', 'mean', 'errors') or not value:
+            raise ValueError(f"Bad SLO '{item}': expected p50|p95|p99|max|mean=<ms> or errors=<fraction>")
+        objectives[name] = float(value)
+    return objectives
+
+
+def print_report(report, slo_results):
+    latency = report['latency_ms']
+    print(f"\n📊 {report['config']['target']} / {report['config']['mode']}: {report['requests']} requests, "
+          f"{report['succeeded']} ok, {report['errors']} errors, {report['shed']} shed "
+          f"(error rate {report['error_rate'] * 100:.2f}%)")
+    print(f"   Throughput {report['throughput_rps']} req/s (offered {report['offered_rps']} req/s)")
+    if latency['p50'] is not None:
+        print(f"   Latency ms: p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  "
+              f"max {latency['max']}  mean {latency['mean']}")
+    resources = report['resources']
+    if resources['rss_mb_peak'] is None:
+        print("   CPU/RSS: not sampled")
+    else:
+        print(f"   CPU: host {resources['host_cpu_pct_mean']}%, process tree {resources['tree_cpu_pct_mean']}% "
+              f"(100% = one core); peak RSS {resources['rss_mb_peak']} MB")
+    if report['served_by']:
+        print(f"   Served by: {report['served_by']}")
+    for error, count in report['error_kinds'].items():
+        print(f"   ❌ {count}x {error}")
+    if report['timeline']:
+        print(f"\n   {'t(s)':>6} {'done':>5} {'err':>4} {'p50':>8} {'p95':>8} {'host%':>6} {'tree%':>6} {'RSS MB':>8}")
+        for row in report['timeline']:
+            p50 = '-' if row['p50_ms'] is None else f"{row['p50_ms']:.0f}"
+            p95 = '-' if row['p95_ms'] is None else f"{row['p95_ms']:.0f}"
+            host, tree, rss = ('-' if row[key] is None else row[key] for key in ('host_cpu_pct', 'tree_cpu_pct', 'rss_mb'))
+            print(f"   {row['second']:>6} {row['completed']:>5} {row['errors']:>4} {p50:>8} {p95:>8} "
+                  f"{host:>6} {tree:>6} {rss:>8}")
+    for name, limit, observed, ok in slo_results:
+        print(f"   {'✅' if ok else '❌'} SLO {name} <= {limit:g}: observed {observed}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the prediction services')
+    parser.add_argument('--target', choices=['spawn', 'http', 'inprocess'], default='spawn')
+    parser.add_argument('--service', choices=list(SERVICES), default='inference_router', help='spawn target')
+    parser.add_argument('--url', default=DEFAULT_URL, help='http target')
+    parser.add_argument('--budget-ms', type=float, default=None, help='inprocess router budget')
+    load = parser.add_mutually_exclusive_group(required=True)
+    load.add_argument('--rate', type=float, help='open loop: arrivals per second')
+    load.add_argument('--concurrency', type=int, help='closed loop: requests kept outstanding')
+    parser.add_argument('--arrivals', choices=['poisson', 'uniform'], default='poisson')
+    parser.add_argument('--max-in-flight', type=int, default=256, help='open loop: shed arrivals beyond this')
+    parser.add_argument('--think-ms', type=float, default=0.0, help='closed loop: pause between a user\'s requests')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of load')
+    parser.add_argument('--warmup', type=float, default=0.0, help='leading seconds left out of the summary')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--interval', type=float, default=1.0, help='resource/timeline sampling period (s)')
+    parser.add_argument('--pid', type=int, default=None, help='process to monitor (default: this one and its children)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-environment', action='store_true', help='omit NDVI/soil/weather inputs')
+    parser.add_argument('--slo', nargs='+', default=None, metavar='NAME=LIMIT', help='e.g. p95=500 p99=1000 errors=0.01')
+    parser.add_argument('--output', default=None, help='write the full report as JSON')
+    args = parser.parse_args()
+
+    objectives = parse_slo(args.slo)
+    if args.target == 'spawn':
+        target = SpawnTarget(args.service, args.timeout)
+    elif args.target == 'http':
+        target = HttpTarget(args.url, args.timeout)
+    else:
+        target = InProcessTarget(args.budget_ms)
+    mix = RequestMix(args.seed, environment=not args.no_environment)
+    recorder = Recorder()
+    mode = f'open loop {args.rate}/s {args.arrivals}' if args.rate else f'closed loop x{args.concurrency}'
+    print(f"🚀 {args.target} ({args.service if args.target == 'spawn' else args.url if args.target == 'http' else 'router'}), "
+          f"{mode}, {args.duration:g}s", file=sys.stderr)
+
+    sampler = ResourceSampler(args.pid or os.getpid(), args.interval)
+    sampler.start()
+    # In-process tiers print diagnostics to stdout; keep it for the report
+    with contextlib.redirect_stdout(sys.stderr) if args.target == 'inprocess' else contextlib.nullcontext():
+        if args.rate:
+            start = run_open_loop(target, mix, recorder, args.rate, args.duration, args.arrivals,
+                                  args.max_in_flight, args.seed)
+        else:
+            start = run_closed_loop(target, mix, recorder, args.concurrency, args.duration, args.think_ms)
+    sampler.stop()
+
+    config = {key: value for key, value in vars(args).items() if key not in ('slo', 'output')}
+    config['mode'] = mode
+    report = build_report(recorder, sampler.samples, start, args.duration, args.warmup, args.interval, config)
+    slo_results = check_slo(report, objectives)
+    report['slo'] = [{'objective': name, 'limit': limit, 'observed': observed, 'ok': ok}
+                     for name, limit, observed, ok in slo_results]
+    print_report(report, slo_results)
+
+    if args.output:
+        tmp_path = f'{args.output}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp_path, args.output)
+        print(f"💾 Report written to {args.output}")
+    sys.exit(0 if all(ok for *_, ok in slo_results) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+Model registry - discovers, validates and loads trained model artifacts by name and version
+
+Artifacts are looked up in MODEL_DIR (if set), backend/ml, backend/notebooks and the
+current directory. A versioned artifact is stored next to the plain one with a `.v<N>`
+suffix (e.g. `trained_crop_model.v3.pkl`); the highest version wins unless a version is
+pinned. Loaded models are held in memory once per process and swapped atomically when
+the file on disk changes, so in-flight requests keep the handle they started with.
+"""
+import os
+import re
+import sys
+import json
+import time
+import pickle
+import threading
+from pathlib import Path
+
+ML_DIR = Path(__file__).parent
+NOTEBOOKS_DIR = ML_DIR.parent / 'notebooks'
+
+NOTEBOOK_ENCODERS = ['State', 'District', 'Crop', 'Season']
+
+
+class ModelNotFoundError(FileNotFoundError):
+    """No artifact file exists for the requested model name/version"""
+
+
+class ModelValidationError(ValueError):
+    """Artifact file exists but does not contain a usable model"""
+
+
+def search_dirs():
+    """Directories searched for artifacts, in priority order"""
+    dirs = []
+    if os.environ.get('MODEL_DIR'):
+        dirs.append(Path(os.environ['MODEL_DIR']))
+    dirs.extend([ML_DIR, NOTEBOOKS_DIR, Path.cwd()])
+    return dirs
+
+
+def save_artifact(obj, path):
+    """Pickle an artifact atomically so a watching registry never reads a partial file"""
+    path = Path(path)
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(obj, f)
+    os.replace(tmp_path, path)
+    return path
+
+
+def metrics_path(artifact_path):
+    """Sidecar JSON holding evaluation metrics for artifacts that are a bare estimator"""
+    artifact_path = Path(artifact_path)
+    return artifact_path.with_name(f'{artifact_path.stem}.metrics.json')
+
+
+def _load_pickle(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def _load_random_forest(path, companions):
+    import joblib
+    return joblib.load(path)
+
+
+def _validate_random_forest(payload):
+    if not hasattr(payload, 'predict'):
+        raise ModelValidationError('trained_model.pkl does not contain an estimator')
+
+
+def _load_production(path, companions):
+    return _load_pickle(path)
+
+
+def _validate_production(payload):
+    if not isinstance(payload, dict):
+        raise ModelValidationError('expected a dict with model, encoders and feature_cols')
+    missing = [key for key in ('model', 'encoders', 'feature_cols') if key not in payload]
+    if missing:
+        raise ModelValidationError(f'artifact is missing keys: {missing}')
+    if not hasattr(payload['model'], 'predict'):
+        raise ModelValidationError("artifact 'model' is not an estimator")
+
+
+def _load_notebook(path, companions):
+    encoders = {}
+    for name, encoder_path in companions.items():
+        if encoder_path is None:
+            print(f"Warning: {name}_encoder.pkl not found", file=sys.stderr)
+            continue
+        encoders[name] = _load_pickle(encoder_path)
+    return {'model': _load_pickle(path), 'encoders': encoders}
+
+
+def _validate_notebook(payload):
+    if not hasattr(payload['model'], 'predict'):
+        raise ModelValidationError('crop_yield_model.pkl does not contain an estimator')
+
+
+def _validate_ensemble(payload):
+    if not isinstance(payload, dict) or not isinstance(payload.get('weights'), dict):
+        raise ModelValidationError('expected a dict with blend weights per member')
+
+
+def _load_multimodal(path, companions):
+    import torch
+    from multimodal_service import MultimodalTransformer, fold_for_inference
+    from thread_tuning import apply_thread_config
+
+    apply_thread_config()
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    try:
+        checkpoint = torch.load(path, map_location=device, weights_only=False)
+    except TypeError:
+        # torch < 1.13 has no weights_only argument
+        checkpoint = torch.load(path, map_location=device)
+
+    model = MultimodalTransformer(**checkpoint['model_config'])
+    model.load_state_dict(checkpoint['model_state_dict'])
+    model.to(device)
+    model.eval()
+
+    payload = dict(checkpoint)
+    # The full module stays available for training-style use; serving gets the folded fast path
+    payload['full_model'] = model
+    payload['model'] = fold_for_inference(model) if os.environ.get('MULTIMODAL_FAST_PATH', '1') != '0' else model
+    payload['device'] = device
+    return payload
+
+
+def _validate_multimodal(payload):
+    missing = [key for key in ('model_state_dict', 'model_config', 'scaler', 'encoders', 'feature_cols')
+               if key not in payload]
+    if missing:
+        raise ModelValidationError(f'checkpoint is missing keys: {missing}')
+
+
+# name -> artifact file, companion files, loader and validator
+ARTIFACTS = {
+    'random_forest': {
+        'filename': 'trained_model.pkl',
+        'companions': [],
+        'loader': _load_random_forest,
+        'validator': _validate_random_forest,
+    },
+    'production': {
+        'filename': 'trained_crop_model.pkl',
+        'companions': [],
+        'loader': _load_production,
+        'validator': _validate_production,
+    },
+    'notebook': {
+        'filename': 'crop_yield_model.pkl',
+        'companions': [f'{name}_encoder.pkl' for name in NOTEBOOK_ENCODERS],
+        'loader': _load_notebook,
+        'validator': _validate_notebook,
+    },
+    'student': {
+        'filename': 'distilled_student.pkl',
+        'companions': [],
+        'loader': _load_production,
+        'validator': _validate_production,
+    },
+    'ensemble': {
+        'filename': 'ensemble_blend.pkl',
+        'companions': [],
+        'loader': _load_production,
+        'validator': _validate_ensemble,
+    },
+    'multimodal': {
+        'filename': 'multimodal_vit_production.pth',
+        'companions': [],
+        'loader': _load_multimodal,
+        'validator': _validate_multimodal,
+    },
+}
+
+
+def _versioned_name(filename, version):
+    stem, suffix = os.path.splitext(filename)
+    return filename if version == 0 else f'{stem}.v{version}{suffix}'
+
+
+def discover(name):
+    """Return [(version, path)] for every artifact file of a model, highest version first"""
+    filename = ARTIFACTS[name]['filename']
+    stem, suffix = os.path.splitext(filename)
+    pattern = re.compile(rf'^{re.escape(stem)}(?:\.v(\d+))?{re.escape(suffix)}$')
+
+    found = {}
+    for directory in search_dirs():
+        if not directory.is_dir():
+            continue
+        for entry in directory.iterdir():
+            match = pattern.match(entry.name)
+            if match:
+                version = int(match.group(1) or 0)
+                # Earlier search directories take priority for the same version
+                found.setdefault(version, entry)
+    return sorted(found.items(), reverse=True)
+
+
+def publish(name, obj, directory=None):
+    """Write `obj` as the next version of a pickled artifact and return its path"""
+    filename = ARTIFACTS[name]['filename']
+    versions = discover(name)
+    next_version = versions[0][0] + 1 if versions else 1
+    directory = Path(directory) if directory else ML_DIR
+    return save_artifact(obj, directory / _versioned_name(filename, next_version))
+
+
+class ModelHandle:
+    """An immutable, fully loaded model version. Holders may keep using it after a swap."""
+
+    def __init__(self, name, version, path, payload, signature, evaluation=None):
+        self.name = name
+        self.version = version
+        self.path = path
+        self.payload = payload
+        self.signature = signature
+        self.evaluation = evaluation
+        self.loaded_at = time.time()
+
+    @property
+    def metrics(self):
+        """Cross-validated metrics when the artifact has been evaluated, else its training holdout metrics"""
+        # An evaluation saved before undefined R² was rejected can carry r2_score None
+        if self.evaluation and self.evaluation['overall'].get('r2_score') is not None:
+            return self.evaluation['overall']
+        if isinstance(self.payload, dict):
+            return self.payload.get('performance', {})
+        return {}
+
+    def metrics_for(self, crop=None, state=None):
+        """Most specific evaluated metrics for a request: per-crop, then per-state, then overall"""
+        if self.evaluation:
+            if crop in self.evaluation.get('by_crop', {}):
+                return self.evaluation['by_crop'][crop]
+            if state in self.evaluation.get('by_state', {}):
+                return self.evaluation['by_state'][state]
+        return self.metrics
+
+    def describe(self):
+        return {
+            'name': self.name,
+            'version': self.version,
+            'path': str(self.path),
+            'loaded_at': self.loaded_at,
+        }
+
+
+class ModelRegistry:
+    def __init__(self, poll_interval=2.0):
+        self.poll_interval = poll_interval
+        self._handles = {}
+        self._last_checked = {}
+        self._locks = {}
+        self._registry_lock = threading.Lock()
+        self._watcher = None
+
+    def _lock_for(self, key):
+        with self._registry_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _resolve(self, name, version):
+        """Pick the artifact file and companions for a name/version and fingerprint them"""
+        spec = ARTIFACTS[name]
+        versions = discover(name)
+        if version is not None:
+            versions = [(v, p) for v, p in versions if v == int(version)]
+        if not versions:
+            pinned = f' version {version}' if version is not None else ''
+            raise ModelNotFoundError(f"No artifact '{spec['filename']}'{pinned} found in "
+                                     f"{[str(d) for d in search_dirs()]}")
+        resolved_version, path = versions[0]
+
+        companions = {}
+        for companion in spec['companions']:
+            companion_path = path.parent / _versioned_name(companion, resolved_version)
+            if not companion_path.exists():
+                companion_path = path.parent / companion
+            key = companion.replace('_encoder.pkl', '')
+            companions[key] = companion_path if companion_path.exists() else None
+
+        files = [path] + [p for p in companions.values() if p is not None]
+        if metrics_path(path).exists():
+            files.append(metrics_path(path))
+        signature = []
+        for file_path in files:
+            stat = file_path.stat()
+            signature.append((str(file_path), stat.st_mtime_ns, stat.st_size))
+        return resolved_version, path, companions, tuple(signature)
+
+    def _load(self, name, version, path, companions, signature):
+        spec = ARTIFACTS[name]
+        payload = spec['loader'](path, companions)
+        spec['validator'](payload)
+        if name not in ('multimodal', 'ensemble'):
+            # Replace the n_jobs pickled at training time with the value tuned for this host
+            from thread_tuning import configure_estimator
+            configure_estimator(payload['model'] if isinstance(payload, dict) else payload)
+
+        evaluation = payload.get('evaluation') if isinstance(payload, dict) else None
+        sidecar = metrics_path(path)
+        if sidecar.exists():
+            with open(sidecar) as f:
+                evaluation = json.load(f)
+        return ModelHandle(name, version, path, payload, signature, evaluation)
+
+    def get(self, name, version=None):
+        """Return the current handle for a model, reloading it if its files changed"""
+        if name not in ARTIFACTS:
+            raise KeyError(f"Unknown model '{name}'. Known models: {sorted(ARTIFACTS)}")
+
+        key = (name, version)
+        handle = self._handles.get(key)
+        now = time.monotonic()
+        if handle is not None and now - self._last_checked.get(key, 0) < self.poll_interval:
+            return handle
+
+        with self._lock_for(key):
+            handle = self._handles.get(key)
+            try:
+                resolved = self._resolve(name, version)
+            except ModelNotFoundError:
+                if handle is not None:
+                    # File vanished mid-deploy: keep serving what is loaded
+                    return handle
+                raise
+            resolved_version, path, companions, signature = resolved
+
+            if handle is None or handle.signature != signature:
+                try:
+                    new_handle = self._load(name, resolved_version, path, companions, signature)
+                except Exception as e:
+                    if handle is None:
+                        raise
+                    print(f"❌ Reload of {name} v{resolved_version} failed, keeping "
+                          f"v{handle.version}: {e}", file=sys.stderr)
+                else:
+                    if handle is not None:
+                        print(f"🔄 Hot-swapped {name} v{handle.version} -> v{resolved_version}",
+                              file=sys.stderr)
+                    self._handles[key] = new_handle
+                    handle = new_handle
+
+            self._last_checked[key] = time.monotonic()
+            return handle
+
+    def loaded(self):
+        return [handle.describe() for handle in self._handles.values()]
+
+    def refresh(self):
+        """Re-check every loaded model now, swapping in any changed artifacts"""
+        for name, version in list(self._handles):
+            self._last_checked[(name, version)] = 0
+            self.get(name, version)
+
+    def watch(self, interval=None):
+        """Start a daemon thread that keeps loaded models in sync with the files on disk"""
+        if self._watcher is not None:
+            return self._watcher
+        interval = interval or self.poll_interval
+
+        def _loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"❌ Model watcher error: {e}", file=sys.stderr)
+
+        self._watcher = threading.Thread(target=_loop, name='model-registry-watcher', daemon=True)
+        self._watcher.start()
+        return self._watcher
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Process-wide registry so every service shares one in-memory copy of each model"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ModelRegistry(float(os.environ.get('MODEL_POLL_INTERVAL', 2.0)))
+    return _registry
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] not in ARTIFACTS:
+        print(f"Usage: python model_registry.py [{'|'.join(ARTIFACTS)}]")
+        sys.exit(1)
+
+    names = sys.argv[1:] or list(ARTIFACTS)
+    report = {}
+    for name in names:
+        entry = {'versions': [{'version': v, 'path': str(p)} for v, p in discover(name)]}
+        try:
+            entry['loaded'] = get_registry().get(name).describe()
+        except Exception as e:
+            entry['error'] = str(e)
+        report[name] = entry
+    print(json.dumps(report, indent=2))
@@ -1,25 +1,25 @@
 #!/usr/bin/env python3
 import sys
-import json
-import joblib
 import pandas as pd
 import numpy as np
-from pathlib import Path
+
+from model_registry import get_registry, ModelNotFoundError
+from wire_protocol import wire_format, read_message, write_message, is_batch, batch_records
 
 class YieldPredictor:
     def __init__(self):
         self.model = None
+        self.handle = None
         self.load_model()
     
     def load_model(self):
         try:
-            model_path = Path(__file__).parent / 'trained_model.pkl'
-            if model_path.exists():
-                self.model = joblib.load(model_path)
-                print(f"✅ Model loaded from {model_path}", file=sys.stderr)
-            else:
-                print(f"❌ Model file not found at {model_path}", file=sys.stderr)
-                self.model = None
+            self.handle = get_registry().get('random_forest')
+            self.model = self.handle.payload
+            print(f"✅ Model loaded from {self.handle.path} (v{self.handle.version})", file=sys.stderr)
+        except ModelNotFoundError as e:
+            print(f"❌ {e}", file=sys.stderr)
+            self.model = None
         except Exception as e:
             print(f"❌ Error loading model: {e}", file=sys.stderr)
             self.model = None
@@ -29,6 +29,10 @@ class YieldPredictor:
             return self.fallback_prediction(features)
         
         try:
+            # Pick up a retrained artifact if one was published since the last request
+            self.handle = get_registry().get('random_forest')
+            self.model = self.handle.payload
+            
             # Convert features to DataFrame with expected column names
             df = pd.DataFrame([features])
             prediction = self.model.predict(df)[0]
@@ -66,23 +70,40 @@ class YieldPredictor:
         return corrected_yield
 
 def main():
+    # JSON by default; --wire msgpack|arrow for binary batches (see wire_protocol.py)
+    fmt = wire_format(sys.argv[1:])
     try:
         # Read input from stdin
-        input_data = json.loads(sys.stdin.read())
+        input_data = read_message(fmt)
         
         predictor = YieldPredictor()
+        if is_batch(input_data) and predictor.model is not None:
+            # One DataFrame and one model call for the whole batch
+            frame = pd.DataFrame(batch_records(input_data))
+            write_message({
+                'predicted_yield': np.round(predictor.model.predict(frame).astype(np.float64), 2),
+                'model_used': 'Random Forest'
+            }, fmt)
+            return
         prediction = predictor.predict(input_data)
         
+        # Cross-validated metrics when the artifact has a metrics sidecar, else the notebook's hold-out numbers
+        metrics = {'r2_score': 0.915, 'mae': 14.83, 'accuracy': 91.5}
+        if predictor.model is not None and predictor.handle.evaluation:
+            evaluated = predictor.handle.metrics_for(input_data.get('crop'), input_data.get('state'))
+            if evaluated.get('r2_score') is not None:
+                metrics = evaluated
+        
         # Output result as JSON
         result = {
             'predicted_yield': round(prediction, 2),
             'model_used': 'Random Forest' if predictor.model else 'Fallback Logic',
-            'confidence': 91.5,
-            'mae': 14.83,
-            'r2_score': 0.915
+            'confidence': round(metrics['accuracy'], 1),
+            'mae': round(metrics['mae'], 2),
+            'r2_score': round(metrics['r2_score'], 3)
         }
         
-        print(json.dumps(result))
+        write_message(result, fmt)
         
     except Exception as e:
         error_result = {
@@ -91,7 +112,7 @@ def main():
             'model_used': 'Error Fallback',
             'confidence': 0
         }
-        print(json.dumps(error_result))
+        write_message(error_result, fmt)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Per-crop / per-(crop, state) Random Forest shards with a lazy, memory-bounded loader
+
+One global forest has to separate sugarcane (~650+) from cotton (~12) yields and is loaded whole even
+for a single-crop request. Shards are forests trained on one segment only, in the production artifact
+layout (model, encoders, feature_cols) minus the columns that are constant within the segment, so
+production_model.build_feature_vector encodes requests for them unchanged. The global model stays as
+the fallback for segments without a shard.
+
+`real_model_trainer.py --shard-by crop|crop_state` trains the shards in parallel processes on the
+global model's training rows minus a validation slice. A shard is published only when its validation
+MAE beats, by SHARD_MARGIN, a copy of the global estimator fitted without those validation rows; the
+test rows play no part in the choice and only give the reported metrics. With crop_state, crop
+shards are trained as well and serve states that are too small for (or not improved by) their own shard.
+
+ShardRouter looks up (crop, state), then crop, and loads a shard file only on its first request,
+keeping the most recently used shards resident within MODEL_SHARD_CACHE_MB (LRU eviction).
+
+    python real_model_trainer.py --shard-by crop [--shard-workers 4] [--min-shard-rows 200] [--shard-margin 0.02]
+                                 [--keep-all-shards]
+    python model_shards.py list
+    python model_shards.py predict <state> <district> <crop> <season> <year> [area]
+"""
+import os
+import sys
+import json
+import time
+import pickle
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from model_registry import save_artifact
+
+SHARD_DIR = Path(os.environ.get('MODEL_SHARD_DIR', Path(__file__).parent / 'model_shards'))
+CACHE_MB = float(os.environ.get('MODEL_SHARD_CACHE_MB', 512))
+SHARD_KEYS = {'crop': ['Crop'], 'crop_state': ['Crop', 'State']}
+MIN_SHARD_ROWS = 200
+# Share of the training rows held out to choose shards, and the relative validation MAE gain required
+VALIDATION_SHARE = 0.15
+SHARD_MARGIN = 0.02
+
+
+def shard_id(segment):
+    """File-safe id for {'Crop': 'Rice', 'State': 'Punjab'} -> 'crop=Rice__state=Punjab'"""
+    return '__'.join(f"{column.lower()}={''.join(c if c.isalnum() else '_' for c in str(segment[column]).strip())}"
+                     for column in ('Crop', 'State') if column in segment)
+
+
+def _fit_shard(estimator, X_train, y_train, X_eval):
+    # Shards already run one per process; keep each forest single-threaded inside it
+    if 'n_jobs' in estimator.get_params():
+        estimator.set_params(n_jobs=1)
+    started = time.perf_counter()
+    estimator.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - started
+    return estimator, estimator.predict(X_eval) if len(X_eval) else np.empty(0), fit_seconds
+
+
+def _segments(df, train_idx, shard_by, min_rows):
+    """[(segment dict, row mask)] for every segment with at least `min_rows` training rows"""
+    levels = [['Crop']] + ([['Crop', 'State']] if shard_by == 'crop_state' else [])
+    in_train = np.zeros(len(df), dtype=bool)
+    in_train[train_idx] = True
+    segments = []
+    for columns in levels:
+        for values, rows in df.groupby(columns, observed=True).indices.items():
+            values = values if isinstance(values, tuple) else (values,)
+            if in_train[rows].sum() >= min_rows:
+                segments.append((dict(zip(columns, (str(v) for v in values))), rows))
+    return segments
+
+
+def _node_count(model):
+    return int(sum(tree.tree_.node_count for tree in model.estimators_)) if hasattr(model, 'estimators_') else None
+
+
+def _metrics(y, predictions, prefix=''):
+    from sklearn.metrics import r2_score, mean_absolute_error
+    if len(y) < 2:
+        return {}
+    return {f'{prefix}r2_score': float(r2_score(y, predictions)),
+            f'{prefix}mae': float(mean_absolute_error(y, predictions))}
+
+
+def train_shards(df, X, y, train_idx, test_idx, encoders, feature_cols, estimator, global_predictions,
+                 shard_by='crop', min_rows=MIN_SHARD_ROWS, workers=None, directory=SHARD_DIR, keep_all=False,
+                 margin=SHARD_MARGIN, validation_share=VALIDATION_SHARE):
+    """Fit one forest per segment in parallel processes and write shard artifacts plus manifest.json
+
+    X/y/train_idx/test_idx are the global model's feature matrix and split, and global_predictions its
+    predictions for the test_idx rows. Shards are fitted on train_idx minus a validation slice and chosen
+    there: unless keep_all, a shard is published only when its validation MAE is below (1 - margin) times
+    that of the global estimator refitted without the slice, with a positive validation R². The others are
+    listed under 'rejected' and their requests fall back to the wider shard or global model. Reported
+    metrics ('r2_score', 'mae', 'global_*') come from the untouched test rows.
+    """
+    from sklearn.base import clone
+    from sklearn.model_selection import train_test_split
+
+    if shard_by not in SHARD_KEYS:
+        raise ValueError(f"Unknown shard key '{shard_by}', expected one of {list(SHARD_KEYS)}")
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    X = np.asarray(X)
+    y = np.asarray(y, dtype=np.float64)
+    train_idx = np.asarray(train_idx)
+    fit_idx, validation_idx = train_test_split(train_idx, test_size=validation_share, random_state=42,
+                                               stratify=df['Crop'].to_numpy()[train_idx])
+    in_test = np.zeros(len(df), dtype=bool)
+    in_test[test_idx] = True
+    in_validation = np.zeros(len(df), dtype=bool)
+    in_validation[validation_idx] = True
+    global_by_row = np.full(len(df), np.nan)
+    global_by_row[test_idx] = global_predictions
+
+    # The global model has seen the validation rows; compare shards with a copy that has not
+    print(f"Fitting the global estimator without the {len(validation_idx)} validation rows...")
+    global_validation = np.full(len(df), np.nan)
+    global_validation[validation_idx] = clone(estimator).fit(X[fit_idx], y[fit_idx]).predict(X[validation_idx])
+
+    jobs = []
+    for segment, rows in _segments(df, train_idx, shard_by, min_rows):
+        # Columns fixed within the segment carry no information there
+        columns = [j for j, col in enumerate(feature_cols) if col.replace('_encoded', '') not in segment]
+        fit_rows = rows[~in_test[rows] & ~in_validation[rows]]
+        validation_rows, test_rows = rows[in_validation[rows]], rows[in_test[rows]]
+        jobs.append((segment, columns, fit_rows, validation_rows, test_rows))
+
+    workers = workers or min(len(jobs), os.cpu_count() or 1)
+    print(f"Training {len(jobs)} shards ({shard_by}) on {workers} worker processes...")
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_fit_shard, clone(estimator), X[np.ix_(fit_rows, columns)], y[fit_rows],
+                               X[np.ix_(np.concatenate([validation_rows, test_rows]), columns)])
+                   for _, columns, fit_rows, validation_rows, test_rows in jobs]
+        results = [future.result() for future in futures]
+    wall_seconds = time.perf_counter() - started
+
+    manifest = {'shard_by': shard_by, 'feature_cols': list(feature_cols), 'min_rows': min_rows,
+                'margin': margin, 'validation_share': validation_share, 'shards': {}, 'rejected': {}}
+    for (segment, columns, fit_rows, validation_rows, test_rows), (model, predictions, fit_seconds) in zip(jobs, results):
+        validation_predictions, test_predictions = predictions[:len(validation_rows)], predictions[len(validation_rows):]
+        performance = {'training_samples': len(fit_rows), 'validation_samples': len(validation_rows),
+                       'test_samples': len(test_rows), 'fit_seconds': fit_seconds,
+                       **_metrics(y[validation_rows], validation_predictions, 'validation_'),
+                       **_metrics(y[validation_rows], global_validation[validation_rows], 'validation_global_'),
+                       **_metrics(y[test_rows], test_predictions),
+                       **_metrics(y[test_rows], global_by_row[test_rows], 'global_')}
+        if 'r2_score' in performance:
+            performance['accuracy'] = performance['r2_score'] * 100
+        name = shard_id(segment)
+        better = ('validation_mae' in performance and performance['validation_r2_score'] > 0
+                  and performance['validation_mae'] <= (1 - margin) * performance['validation_global_mae'])
+        if not keep_all and not better:
+            manifest['rejected'][name] = {'segment': segment, **performance}
+            stale = directory / f'{name}.pkl'
+            if stale.exists():
+                stale.unlink()
+            continue
+        shard = {
+            'model': model,
+            'encoders': encoders,
+            'feature_cols': [feature_cols[j] for j in columns],
+            'segment': segment,
+            'performance': performance
+        }
+        path = save_artifact(shard, directory / f'{name}.pkl')
+        manifest['shards'][name] = {'segment': segment, 'file': path.name, 'size_bytes': path.stat().st_size,
+                                    'nodes': _node_count(model),
+                                    **{key: value for key, value in performance.items() if key != 'fit_seconds'}}
+
+    manifest['trained_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    manifest['wall_seconds'] = round(wall_seconds, 2)
+    # Manifest last and atomically: routers only see a shard set once all its files are in place
+    tmp_path = directory / '.manifest.json.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, directory / 'manifest.json')
+
+    print(f"Shards trained in {wall_seconds:.1f}s: {len(manifest['shards'])} published, "
+          f"{len(manifest['rejected'])} not {margin:.0%} better than the global model on validation -> {directory}")
+    for status, entries in (('✅', manifest['shards']), ('➖', manifest['rejected'])):
+        for name, entry in entries.items():
+            if 'validation_mae' in entry and 'r2_score' in entry:
+                size = f"{entry['size_bytes'] / 2 ** 20:.1f} MB, " if 'size_bytes' in entry else ''
+                print(f"  {status} {name:<38} validation MAE {entry['validation_mae']:.2f} "
+                      f"(global {entry['validation_global_mae']:.2f})  test R² {entry['r2_score']:.4f} "
+                      f"(global {entry['global_r2_score']:.4f}) MAE {entry['mae']:.2f} (global {entry['global_mae']:.2f})  "
+                      f"{size}{entry['training_samples']} rows")
+    return manifest
+
+
+class ShardRouter:
+    """Lazily loaded shards, the most recently used kept resident within `cache_mb`"""
+
+    def __init__(self, directory=SHARD_DIR, cache_mb=CACHE_MB):
+        self.directory = Path(directory)
+        self.budget_bytes = cache_mb * 2 ** 20
+        self.manifest = None
+        self.manifest_mtime = None
+        self.resident = OrderedDict()
+        self.resident_bytes = 0
+        self.loads = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.load_locks = {}
+
+    def available(self):
+        return (self.directory / 'manifest.json').exists()
+
+    def _current_manifest(self):
+        """manifest.json, re-read (and the resident shards dropped) when a retrain replaces it"""
+        mtime = (self.directory / 'manifest.json').stat().st_mtime_ns
+        if mtime != self.manifest_mtime:
+            with open(self.directory / 'manifest.json') as f:
+                manifest = json.load(f)
+            with self.lock:
+                self.manifest, self.manifest_mtime = manifest, mtime
+                self.resident.clear()
+                self.resident_bytes = 0
+        return self.manifest
+
+    def shard_for(self, crop, state=None):
+        """Most specific shard id for a request: (crop, state), then crop; None if neither exists"""
+        shards = self._current_manifest()['shards']
+        for segment in ({'Crop': crop, 'State': state}, {'Crop': crop}):
+            if all(value not in (None, '') for value in segment.values()):
+                name = shard_id(segment)
+                if name in shards:
+                    return name
+        return None
+
+    def get(self, name):
+        """Shard payload, loading it on first use and evicting least recently used shards over budget"""
+        with self.lock:
+            if name in self.resident:
+                self.resident.move_to_end(name)
+                return self.resident[name][0]
+            load_lock = self.load_locks.setdefault(name, threading.Lock())
+
+        with load_lock:
+            with self.lock:
+                if name in self.resident:
+                    return self.resident[name][0]
+            entry = self.manifest['shards'][name]
+            with open(self.directory / entry['file'], 'rb') as f:
+                payload = pickle.load(f)
+            from thread_tuning import configure_estimator
+            configure_estimator(payload['model'])
+
+            with self.lock:
+                self.resident[name] = (payload, entry['size_bytes'])
+                self.resident_bytes += entry['size_bytes']
+                self.loads += 1
+                # The shard just loaded always stays, even if it alone exceeds the budget
+                while self.resident_bytes > self.budget_bytes and len(self.resident) > 1:
+                    _, (_, size) = self.resident.popitem(last=False)
+                    self.resident_bytes -= size
+                    self.evictions += 1
+            return payload
+
+    def predict(self, request):
+        """Prediction from the request's shard; LookupError when its segment has none"""
+        from production_model import build_feature_vector
+        name = self.shard_for(request.get('crop'), request.get('state'))
+        if name is None:
+            raise LookupError(f"No shard for crop '{request.get('crop')}' / state '{request.get('state')}'")
+        payload = self.get(name)
+        features = build_feature_vector(payload, request['district'], request['crop'], request['season'],
+                                        request['year'], request.get('state'), request.get('area', 100.0),
+                                        environment=request)
+        return name, payload, payload['model'].predict(features)[0]
+
+    def describe(self):
+        with self.lock:
+            return {'resident': list(self.resident), 'resident_mb': round(self.resident_bytes / 2 ** 20, 2),
+                    'budget_mb': round(self.budget_bytes / 2 ** 20, 2), 'loads': self.loads,
+                    'evictions': self.evictions}
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_shard_router():
+    """Process-wide shard router, so every service shares the resident shards"""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = ShardRouter()
+    return _router
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-crop / per-state model shards')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='shards in the manifest with their accuracy against the global model')
+    predict = commands.add_parser('predict')
+    predict.add_argument('fields', nargs='+', help='state district crop season year [area]')
+    args = parser.parse_args()
+
+    router = get_shard_router()
+    if not router.available():
+        print(f"❌ No shard manifest in {router.directory}; train with real_model_trainer.py --shard-by crop")
+        sys.exit(1)
+
+    if args.command == 'list':
+        print(json.dumps(router._current_manifest(), indent=2))
+        return
+
+    if len(args.fields) < 5:
+        parser.error('predict needs <state> <district> <crop> <season> <year> [area]')
+    request = dict(zip(['state', 'district', 'crop', 'season', 'year', 'area'], args.fields))
+    request['year'] = int(request['year'])
+    request['area'] = float(request.get('area', 100.0))
+    started = time.perf_counter()
+    name, payload, prediction = router.predict(request)
+    print(json.dumps({
+        'predicted_yield': round(max(0.0, float(prediction)), 2),
+        'model_used': 'RandomForest_Shard',
+        'shard': name,
+        'r2_score': payload['performance'].get('r2_score'),
+        'mae': payload['performance'].get('mae'),
+        'latency_ms': round((time.perf_counter() - started) * 1000, 2),
+        'cache': router.describe()
+    }))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,29 @@
 #!/usr/bin/env python3
 import sys
-import json
 import torch
 import torch.nn as nn
 import numpy as np
-import pandas as pd
-from pathlib import Path
-import joblib
 from PIL import Image
 import torchvision.transforms as transforms
 
+from model_registry import get_registry, ModelNotFoundError
+from image_ingest import load_fields, to_tensor, NORMALIZE_MEAN, NORMALIZE_STD
+from thread_tuning import apply_thread_config
+from profiling import request, section
+from wire_protocol import wire_format, read_message, write_message, quiet_stdout, is_batch, batch_records
+
+# Geometry of checkpoints saved before image_size / encoder_width were part of model_config
+DEFAULT_IMAGE_SIZE = 224
+DEFAULT_ENCODER_WIDTH = 64
+
 class MultimodalTransformer(nn.Module):
-    def __init__(self, tabular_dim=10, hidden_dim=256, num_heads=8, num_layers=4):
+    def __init__(self, tabular_dim=10, hidden_dim=256, num_heads=8, num_layers=4,
+                 image_size=DEFAULT_IMAGE_SIZE, encoder_width=DEFAULT_ENCODER_WIDTH):
         super().__init__()
+        # Resolution the model was trained at; the encoder ends in adaptive pooling, so this is a
+        # serving contract (synthetic images and resized tiles) rather than a shape constraint
+        self.image_size = image_size
+        width = encoder_width
         
         # Tabular data encoder
         self.tabular_encoder = nn.Sequential(
@@ -24,17 +35,17 @@ class MultimodalTransformer(nn.Module):
         
         # Simple CNN for image features
         self.image_encoder = nn.Sequential(
-            nn.Conv2d(3, 64, 7, stride=2, padding=3),
+            nn.Conv2d(3, width, 7, stride=2, padding=3),
             nn.ReLU(),
             nn.MaxPool2d(2),
-            nn.Conv2d(64, 128, 3, padding=1),
+            nn.Conv2d(width, width * 2, 3, padding=1),
             nn.ReLU(),
             nn.MaxPool2d(2),
-            nn.Conv2d(128, 256, 3, padding=1),
+            nn.Conv2d(width * 2, width * 4, 3, padding=1),
             nn.ReLU(),
             nn.AdaptiveAvgPool2d((1, 1)),
             nn.Flatten(),
-            nn.Linear(256, hidden_dim)
+            nn.Linear(width * 4, hidden_dim)
         )
         
         # Cross-modal attention
@@ -73,43 +84,192 @@ class MultimodalTransformer(nn.Module):
         output = self.fusion(fused)
         return output.squeeze(-1)
 
+class FoldedMultimodalTransformer(nn.Module):
+    """Inference-only MultimodalTransformer with the length-1 cross-attention folded away
+
+    With a single key, softmax is identically 1 and each attention call is out_proj(v_proj(x)), so the
+    Q/K projections and softmax never affect the output. Everything between the encoders' last ReLU/pool
+    and the first fusion ReLU is then linear (encoder output Linear -> W_o·W_v -> fusion[0]), and is
+    precomputed in float64 into one Linear over [image trunk features, tabular trunk features].
+    Valid in eval mode only (dropout off).
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.image_size = model.image_size
+        self.tabular_trunk = model.tabular_encoder[:-1]
+        self.image_trunk = model.image_encoder[:-1]
+        self.head = model.fusion[1:]
+
+        attention = model.cross_attention
+        hidden = attention.embed_dim
+        tabular_out, image_out, fusion_in = model.tabular_encoder[-1], model.image_encoder[-1], model.fusion[0]
+
+        def weights(linear_weight, bias, rows=None):
+            weight = linear_weight.detach().double()
+            bias = torch.zeros(weight.shape[0], dtype=torch.float64, device=weight.device) if bias is None \
+                else bias.detach().double()
+            return (weight, bias) if rows is None else (weight[rows], bias[rows])
+
+        with torch.no_grad():
+            value_rows = slice(2 * hidden, 3 * hidden)
+            if attention._qkv_same_embed_dim:
+                w_v, b_v = weights(attention.in_proj_weight, attention.in_proj_bias, value_rows)
+            else:
+                w_v, _ = weights(attention.v_proj_weight, None)
+                b_v = (torch.zeros_like(w_v[:, 0]) if attention.in_proj_bias is None
+                       else attention.in_proj_bias.detach().double()[value_rows])
+            w_o, b_o = weights(attention.out_proj.weight, attention.out_proj.bias)
+            w_ov, b_ov = w_o @ w_v, w_o @ b_v + b_o
+
+            w_f, b_f = weights(fusion_in.weight, fusion_in.bias)
+            # fused = [attended_tab, attended_img]: attended_tab attends to the image, attended_img to the tabular side
+            w_from_image, w_from_tabular = w_f[:, :hidden] @ w_ov, w_f[:, hidden:] @ w_ov
+            w_i, b_i = weights(image_out.weight, image_out.bias)
+            w_t, b_t = weights(tabular_out.weight, tabular_out.bias)
+            weight = torch.cat([w_from_image @ w_i, w_from_tabular @ w_t], dim=1)
+            bias = b_f + w_from_image @ b_i + w_from_tabular @ b_t + (w_f[:, :hidden] + w_f[:, hidden:]) @ b_ov
+
+        self.fused = nn.Linear(weight.shape[1], weight.shape[0]).to(fusion_in.weight.device)
+        with torch.no_grad():
+            self.fused.weight.copy_(weight.to(fusion_in.weight.dtype))
+            self.fused.bias.copy_(bias.to(fusion_in.weight.dtype))
+        self.eval()
+
+    def forward(self, tabular, image):
+        trunk = torch.cat([self.image_trunk(image), self.tabular_trunk(tabular)], dim=1)
+        return self.head(self.fused(trunk)).squeeze(-1)
+
+def verify_folded(model, folded, batch_size=64, image_size=32, seed=0):
+    """Largest absolute and relative difference between the two forwards on random inputs
+
+    The image encoder ends in adaptive pooling, so small probe images exercise the same arithmetic.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    device = next(model.parameters()).device
+    tabular_dim = model.tabular_encoder[0].in_features
+    tabular = torch.randn(batch_size, tabular_dim, generator=generator).to(device)
+    image = torch.randn(batch_size, 3, image_size, image_size, generator=generator).to(device)
+    with torch.no_grad():
+        expected, actual = model(tabular, image), folded(tabular, image)
+    max_abs = float((expected - actual).abs().max())
+    return max_abs, max_abs / max(float(expected.abs().max()), 1e-12)
+
+def fold_for_inference(model, tolerance=1e-4):
+    """The folded model when it matches `model` within `tolerance` (relative), else `model` itself"""
+    try:
+        folded = FoldedMultimodalTransformer(model)
+        max_abs, max_rel = verify_folded(model, folded)
+    except Exception as e:
+        print(f"⚠️ Attention fast path unavailable: {e}", file=sys.stderr)
+        return model
+    if max_rel > tolerance:
+        print(f"⚠️ Attention fast path differs by {max_rel:.2e} (relative); using the full forward", file=sys.stderr)
+        return model
+    return folded
+
+# Feature column -> (request key, default value, encoder name)
+FEATURE_SOURCES = {
+    'crop_encoded': ('crop', 'Rice', 'crop'),
+    'season_encoded': ('season', 'Kharif', 'season'),
+    'state_encoded': ('state', 'Uttar Pradesh', 'state'),
+    'district_encoded': ('district', 'Lucknow', 'district'),
+    'Crop_Year': ('year', 2024, None),
+    'Area': ('area', 1.0, None),
+    'NDVI_mean': ('ndvi_mean', 0.65, None),
+    'rainfall_mm': ('rainfall_mm', 150, None),
+    'temp_avg': ('temp_avg', 25, None),
+    'soil_pH': ('soil_ph', 7.0, None),
+}
+
+class FeaturePlan:
+    """Feature assembly compiled once per checkpoint: one getter per column, scaler folded into float32 arrays"""
+    
+    def __init__(self, feature_cols, encoders, scaler):
+        self.feature_cols = list(feature_cols)
+        self.getters = [self._compile_getter(col, encoders) for col in self.feature_cols]
+        
+        n_features = len(self.feature_cols)
+        mean = scaler.mean_ if getattr(scaler, 'with_mean', True) else None
+        scale = scaler.scale_ if getattr(scaler, 'with_std', True) else None
+        self.mean = np.zeros(n_features, dtype=np.float32) if mean is None else np.asarray(mean, dtype=np.float32)
+        self.inv_scale = (np.ones(n_features, dtype=np.float32) if scale is None
+                          else (1.0 / np.asarray(scale, dtype=np.float64)).astype(np.float32))
+    
+    @staticmethod
+    def _compile_getter(col, encoders):
+        if col not in FEATURE_SOURCES:
+            return lambda records: [0.0] * len(records)
+        
+        key, default, encoder_name = FEATURE_SOURCES[col]
+        if encoder_name is None:
+            return lambda records: [record.get(key, default) for record in records]
+        
+        table = {label: code for code, label in enumerate(encoders[encoder_name].classes_)}
+        
+        def encode(records):
+            try:
+                return [table[record.get(key, default)] for record in records]
+            except KeyError as e:
+                raise ValueError(f"y contains previously unseen labels for {col}: {e}")
+        return encode
+    
+    def assemble(self, records):
+        """Scaled float32 matrix (n_records, n_features) for a batch of request dicts"""
+        X = np.empty((len(records), len(self.getters)), dtype=np.float32)
+        for j, getter in enumerate(self.getters):
+            X[:, j] = getter(records)
+        X -= self.mean
+        X *= self.inv_scale
+        return X
+
 class MultimodalYieldPredictor:
     def __init__(self):
         self.model = None
         self.scaler = None
         self.encoders = None
         self.feature_cols = None
+        self.plan = None
+        self.handle = None
+        self.image_size = DEFAULT_IMAGE_SIZE
+        apply_thread_config()
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        self.transform = transforms.Compose([
-            transforms.Resize((224, 224)),
+        self.transform = self.image_transform(self.image_size)
+        self.load_model()
+    
+    @staticmethod
+    def image_transform(size):
+        return transforms.Compose([
+            transforms.Resize((size, size)),
             transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+            transforms.Normalize(mean=NORMALIZE_MEAN, std=NORMALIZE_STD)
         ])
-        self.load_model()
     
     def load_model(self):
         try:
-            model_path = Path(__file__).parent / 'multimodal_vit_production.pth'
-            if model_path.exists():
-                checkpoint = torch.load(model_path, map_location=self.device)
-                
-                # Initialize model with saved config
-                config = checkpoint['model_config']
-                self.model = MultimodalTransformer(**config)
-                self.model.load_state_dict(checkpoint['model_state_dict'])
-                self.model.to(self.device)
-                self.model.eval()
-                
-                # Load preprocessing components
-                self.scaler = checkpoint['scaler']
-                self.encoders = checkpoint['encoders']
-                self.feature_cols = checkpoint['feature_cols']
-                
-                print(f"✅ Multimodal ViT model loaded successfully", file=sys.stderr)
-                print(f"📊 Model performance: R²={checkpoint['performance']['r2_score']:.3f}", file=sys.stderr)
-            else:
-                print(f"❌ Multimodal model file not found at {model_path}", file=sys.stderr)
-                self.model = None
+            self.handle = get_registry().get('multimodal')
+            checkpoint = self.handle.payload
+            
+            # Model is built, moved to device and put in eval mode once by the registry
+            self.model = checkpoint['model']
+            self.device = checkpoint['device']
+            
+            # Load preprocessing components
+            self.scaler = checkpoint['scaler']
+            self.encoders = checkpoint['encoders']
+            self.feature_cols = checkpoint['feature_cols']
+            self.plan = FeaturePlan(self.feature_cols, self.encoders, self.scaler)
+            
+            # Images are built / resized at the resolution the checkpoint was trained at
+            self.image_size = checkpoint['model_config'].get('image_size', DEFAULT_IMAGE_SIZE)
+            self.transform = self.image_transform(self.image_size)
+            
+            print(f"✅ Multimodal ViT model loaded successfully (v{self.handle.version}, "
+                  f"{self.image_size}x{self.image_size} images)", file=sys.stderr)
+            print(f"📊 Model performance: R²={checkpoint['performance']['r2_score']:.3f}", file=sys.stderr)
+        except ModelNotFoundError as e:
+            print(f"❌ Multimodal model file not found: {e}", file=sys.stderr)
+            self.model = None
         except Exception as e:
             print(f"❌ Error loading multimodal model: {e}", file=sys.stderr)
             self.model = None
@@ -117,7 +277,7 @@ class MultimodalYieldPredictor:
     def create_synthetic_image(self, ndvi_val, temp_val, rainfall_val):
         """Create synthetic satellite-like image from environmental data"""
         # Create 3-channel image based on environmental factors
-        image = torch.zeros(3, 224, 224)
+        image = torch.zeros(3, self.image_size, self.image_size)
         
         # Green channel: NDVI (vegetation health)
         image[1] = ndvi_val
@@ -137,55 +297,61 @@ class MultimodalYieldPredictor:
             return self.fallback_prediction(features)
         
         try:
-            # Prepare tabular data
-            feature_values = []
-            for col in self.feature_cols:
-                if col == 'crop_encoded':
-                    val = self.encoders['crop'].transform([features.get('crop', 'Rice')])[0]
-                elif col == 'season_encoded':
-                    val = self.encoders['season'].transform([features.get('season', 'Kharif')])[0]
-                elif col == 'state_encoded':
-                    val = self.encoders['state'].transform([features.get('state', 'Uttar Pradesh')])[0]
-                elif col == 'district_encoded':
-                    val = self.encoders['district'].transform([features.get('district', 'Lucknow')])[0]
-                elif col == 'Crop_Year':
-                    val = features.get('year', 2024)
-                elif col == 'Area':
-                    val = features.get('area', 1.0)
-                elif col == 'NDVI_mean':
-                    val = features.get('ndvi_mean', 0.65)
-                elif col == 'rainfall_mm':
-                    val = features.get('rainfall_mm', 150)
-                elif col == 'temp_avg':
-                    val = features.get('temp_avg', 25)
-                elif col == 'soil_pH':
-                    val = features.get('soil_ph', 7.0)
-                else:
-                    val = 0
-                feature_values.append(val)
-            
-            # Scale features
-            tabular_data = self.scaler.transform([feature_values])
-            tabular_tensor = torch.FloatTensor(tabular_data).to(self.device)
-            
-            # Create synthetic image
-            synthetic_image = self.create_synthetic_image(
-                features.get('ndvi_mean', 0.65),
-                features.get('temp_avg', 25),
-                features.get('rainfall_mm', 150)
-            ).to(self.device)
-            
-            # Make prediction
-            with torch.no_grad():
-                prediction = self.model(tabular_tensor, synthetic_image)
-                yield_value = prediction.cpu().item()
-            
-            return max(0, yield_value)  # Ensure non-negative yield
-            
+            return self.predict_model(features)
         except Exception as e:
             print(f"❌ Multimodal prediction error: {e}", file=sys.stderr)
             return self.fallback_prediction(features)
     
+    def create_synthetic_images(self, ndvi_vals, temp_vals, rainfall_vals):
+        """Batch version of create_synthetic_image: one constant-plane image per record"""
+        temp_normalized = (np.asarray(temp_vals, dtype=np.float32) - 18) / (35 - 18)
+        rainfall_normalized = (np.asarray(rainfall_vals, dtype=np.float32) - 50) / (300 - 50)
+        channels = np.stack([1 - temp_normalized, np.asarray(ndvi_vals, dtype=np.float32), rainfall_normalized], axis=1)
+        return torch.from_numpy(channels)[:, :, None, None].expand(-1, -1, self.image_size, self.image_size).contiguous()
+    
+    def predict_model(self, features):
+        """Predict with the multimodal model only; errors propagate instead of falling back"""
+        return float(self.predict_batch([features])[0])
+    
+    def predict_batch(self, records):
+        """Predict yields for a list of request dicts in one forward pass
+        
+        A record with 'image_path' (an image file or a directory of tiles) uses that imagery;
+        the others get a synthetic image built from their environmental values.
+        """
+        if self.model is None:
+            raise RuntimeError('Multimodal model is not loaded')
+        
+        # Pick up a retrained checkpoint if one was published since the last request
+        with section('model_load'):
+            if get_registry().get('multimodal') is not self.handle:
+                self.load_model()
+        
+        # Prepare tabular data
+        with section('encoding'):
+            tabular_tensor = torch.from_numpy(self.plan.assemble(records)).to(self.device)
+        
+        with section('image_synthesis'):
+            # Create synthetic images
+            synthetic_images = self.create_synthetic_images(
+                [record.get('ndvi_mean', 0.65) for record in records],
+                [record.get('temp_avg', 25) for record in records],
+                [record.get('rainfall_mm', 150) for record in records]
+            )
+            
+            # Real photos / satellite tiles replace the synthetic image where a record provides one
+            image_rows = [i for i, record in enumerate(records) if record.get('image_path')]
+            if image_rows:
+                fields = load_fields([records[i]['image_path'] for i in image_rows], size=self.image_size)
+                synthetic_images[image_rows] = to_tensor(fields)
+            synthetic_images = synthetic_images.to(self.device)
+        
+        # Make prediction
+        with section('predict'), torch.no_grad():
+            predictions = self.model(tabular_tensor, synthetic_images).reshape(-1)
+        
+        return np.maximum(predictions.cpu().numpy(), 0)  # Ensure non-negative yield
+    
     def fallback_prediction(self, features):
         """Fallback to traditional method if multimodal model fails"""
         base_yields = {
@@ -215,24 +381,46 @@ class MultimodalYieldPredictor:
         return corrected_yield
 
 def main():
+    # JSON by default; --wire msgpack|arrow for binary batches (see wire_protocol.py)
+    fmt = wire_format(sys.argv[1:])
     try:
         # Read input from stdin
-        input_data = json.loads(sys.stdin.read())
-        
-        predictor = MultimodalYieldPredictor()
-        prediction = predictor.predict(input_data)
-        
-        # Output result as JSON
-        result = {
-            'predicted_yield': round(prediction, 2),
-            'model_used': 'Multimodal ViT' if predictor.model else 'Fallback Logic',
-            'confidence': 94.2 if predictor.model else 91.5,
-            'mae': 12.1 if predictor.model else 14.83,
-            'r2_score': 0.942 if predictor.model else 0.915,
-            'multimodal': True if predictor.model else False
-        }
+        input_data = read_message(fmt)
         
-        print(json.dumps(result))
+        with request('multimodal_service'):
+            with section('model_load'), quiet_stdout(fmt):
+                predictor = MultimodalYieldPredictor()
+            if is_batch(input_data):
+                if predictor.model is None:
+                    raise RuntimeError('Multimodal model is not loaded')
+                with quiet_stdout(fmt):
+                    predictions = predictor.predict_batch(batch_records(input_data))
+                with section('serialisation'):
+                    write_message({
+                        'predicted_yield': np.round(predictions.astype(np.float64), 2),
+                        'model_used': 'Multimodal ViT',
+                        'multimodal': True
+                    }, fmt)
+                return
+            prediction = predictor.predict(input_data)
+            
+            # Metrics stored in the checkpoint (cross-validated if evaluated) instead of fixed numbers
+            metrics = {'r2_score': 0.915, 'mae': 14.83, 'accuracy': 91.5}
+            if predictor.model is not None:
+                metrics = predictor.handle.metrics_for(input_data.get('crop'), input_data.get('state'))
+            
+            # Output result as JSON
+            result = {
+                'predicted_yield': round(prediction, 2),
+                'model_used': 'Multimodal ViT' if predictor.model else 'Fallback Logic',
+                'confidence': round(metrics['accuracy'], 1),
+                'mae': round(metrics['mae'], 2),
+                'r2_score': round(metrics['r2_score'], 3),
+                'multimodal': True if predictor.model else False
+            }
+            
+            with section('serialisation'):
+                write_message(result, fmt)
         
     except Exception as e:
         error_result = {
@@ -242,7 +430,45 @@ def main():
             'confidence': 0,
             'multimodal': False
         }
-        print(json.dumps(error_result))
+        write_message(error_result, fmt)
+
+def verify_fast_path(batch_size=16, repeats=5):
+    """Compare the folded and full forwards of every saved multimodal checkpoint at serving resolution"""
+    import time
+    from model_registry import discover, _load_multimodal
+    
+    checkpoints = discover('multimodal')
+    if not checkpoints:
+        print("❌ No multimodal checkpoints found")
+        return False
+    
+    all_match = True
+    for version, path in checkpoints:
+        payload = _load_multimodal(path, [])
+        model, folded = payload['full_model'], payload['model']
+        if folded is model:
+            print(f"❌ v{version} ({path}): fast path rejected at load")
+            all_match = False
+            continue
+        
+        size = model.image_size
+        max_abs, max_rel = verify_folded(model, folded, batch_size=batch_size, image_size=size)
+        # Constant-plane images, as built by create_synthetic_images for requests without imagery
+        tabular = torch.randn(batch_size, model.tabular_encoder[0].in_features).to(payload['device'])
+        images = torch.rand(batch_size, 3, 1, 1).expand(-1, -1, size, size).contiguous().to(payload['device'])
+        timings = {}
+        with torch.no_grad():
+            synthetic_abs = float((model(tabular, images) - folded(tabular, images)).abs().max())
+            for name, module in (('full', model), ('folded', folded)):
+                started = time.perf_counter()
+                for _ in range(repeats):
+                    module(tabular[:1], images[:1])
+                timings[name] = (time.perf_counter() - started) / repeats * 1000
+        print(f"✅ v{version} ({path}, {size}x{size}): max |Δ| {max(max_abs, synthetic_abs):.2e} (relative {max_rel:.2e}); "
+              f"single-row {timings['full']:.2f} ms full vs {timings['folded']:.2f} ms folded")
+    return all_match
 
 if __name__ == '__main__':
+    if sys.argv[1:] == ['--verify-fast-path']:
+        sys.exit(0 if verify_fast_path() else 1)
     main()
\ No newline at end of file
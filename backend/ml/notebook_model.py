@@ -2,35 +2,29 @@
 """
 Use trained models from notebooks folder - Random Forest with 91.5% accuracy
 """
-import pickle
 import sys
 import json
 import os
 import numpy as np
-from pathlib import Path
+
+from model_registry import get_registry
+from forest_uncertainty import predict_with_uncertainty, summarize
+from tree_shap import explain_or_unavailable as explain_prediction
+from profiling import request, section
+from wire_protocol import wire_format, read_message, write_message, quiet_stdout, batch_columns
+
+# Hold-out metrics reported by the notebook, used until the model has been cross-validated
+NOTEBOOK_METRICS = {'r2_score': 0.915, 'mae': 14.83, 'accuracy': 91.5}
+
+# Training feature layout of the notebook model
+FEATURE_COLS = ['State', 'District', 'Crop', 'Crop_Year', 'Season', 'Area']
 
 def load_notebook_models():
     """Load trained models from notebooks folder"""
-    notebooks_path = Path(__file__).parent.parent / 'notebooks'
-    
     try:
-        # Load main Random Forest model (91.5% R² Score)
-        with open(notebooks_path / 'crop_yield_model.pkl', 'rb') as f:
-            model = pickle.load(f)
-        
-        # Load label encoders
-        encoders = {}
-        encoder_files = ['State_encoder.pkl', 'District_encoder.pkl', 'Crop_encoder.pkl', 'Season_encoder.pkl']
-        
-        for encoder_file in encoder_files:
-            try:
-                with open(notebooks_path / encoder_file, 'rb') as f:
-                    encoder_name = encoder_file.replace('_encoder.pkl', '')
-                    encoders[encoder_name] = pickle.load(f)
-            except FileNotFoundError:
-                print(f"Warning: {encoder_file} not found")
-        
-        return model, encoders
+        # Main Random Forest model (91.5% R² Score) plus label encoders, via the shared registry
+        payload = get_registry().get('notebook').payload
+        return payload['model'], payload['encoders']
     except Exception as e:
         print(f"Error loading models: {e}")
         return None, None
@@ -47,50 +41,150 @@ def safe_transform(encoder, value, default_value=0):
         print(f"Transform error: {e}. Using default {default_value}")
         return default_value
 
-def predict_yield(state, district, crop, season, year, area=100.0):
-    """Make prediction using trained Random Forest model"""
-    try:
+def encode_features(encoders, state, district, crop, season, year, area=100.0):
+    """Encode one request into the training feature layout"""
+    # Encode categorical features using trained encoders
+    encoded_state = safe_transform(encoders.get('State'), state, 0)
+    encoded_district = safe_transform(encoders.get('District'), district, 0)
+    encoded_crop = safe_transform(encoders.get('Crop'), crop, 0)
+    encoded_season = safe_transform(encoders.get('Season'), season, 0)
+    
+    print(f"Encoded features: State={encoded_state}, District={encoded_district}, Crop={encoded_crop}, Season={encoded_season}")
+    
+    # Create feature vector matching training format: [State, District, Crop, Crop_Year, Season, Area]
+    return np.array([
+        encoded_state,
+        encoded_district, 
+        encoded_crop,
+        int(year),
+        encoded_season,
+        float(area)
+    ]).reshape(1, -1)
+
+def encode_feature_matrix(encoders, records):
+    """Batch version of encode_features for a list of request dicts; unknown labels map to 0 like safe_transform"""
+    columns = []
+    for name, key in [('State', 'state'), ('District', 'district'), ('Crop', 'crop'),
+                      ('Crop_Year', 'year'), ('Season', 'season'), ('Area', 'area')]:
+        if name in ('Crop_Year', 'Area'):
+            default = 100.0 if name == 'Area' else 0
+            columns.append(np.array([float(record.get(key, default)) for record in records]))
+            continue
+        encoder = encoders.get(name)
+        table = {} if encoder is None else {label: code for code, label in enumerate(encoder.classes_)}
+        columns.append(np.array([table.get(record.get(key), 0) for record in records], dtype=np.float64))
+    return np.column_stack(columns)
+
+def encode_feature_columns(encoders, columns):
+    """Columnar encode_feature_matrix: {state, district, crop, season, year, area} arrays, one lookup per column"""
+    import pandas as pd
+    n_rows = len(next(iter(columns.values())))
+    matrix = np.empty((n_rows, 6), dtype=np.float64)
+    for j, (name, key) in enumerate([('State', 'state'), ('District', 'district'), ('Crop', 'crop'),
+                                     ('Crop_Year', 'year'), ('Season', 'season'), ('Area', 'area')]):
+        if name in ('Crop_Year', 'Area'):
+            matrix[:, j] = columns[key] if key in columns else (100.0 if name == 'Area' else 0)
+            continue
+        encoder = encoders.get(name)
+        if encoder is None or key not in columns:
+            matrix[:, j] = 0
+            continue
+        codes = pd.Index(encoder.classes_).get_indexer(np.asarray(columns[key], dtype=object))
+        matrix[:, j] = np.where(codes >= 0, codes, 0)
+    return matrix
+
+def predict_yield_columns(columns):
+    """Batch prediction over columnar inputs; returns predicted_yield / total_production arrays"""
+    with section('model_load'):
         model, encoders = load_notebook_models()
+    if model is None:
+        raise Exception("Could not load trained model")
+    with section('encoding'):
+        features = encode_feature_columns(encoders, columns)
+    with section('predict'):
+        predictions = model.predict(features)
+    return {
+        'predicted_yield': np.maximum(np.round(predictions, 2), 0),
+        'total_production': np.maximum(np.round(predictions * features[:, 5] * 1000), 0)
+    }
+
+def predict_yield_batch(records, uncertainty=False, explain=False):
+    """Predict a batch of {state, district, crop, season, year, area} dicts in one model call"""
+    with section('model_load'):
+        model, encoders = load_notebook_models()
+    if model is None:
+        raise Exception("Could not load trained model")
+    
+    with section('encoding'):
+        features = encode_feature_matrix(encoders, records)
+    with section('predict'):
+        if uncertainty:
+            spread = predict_with_uncertainty(model, features)
+            predictions = spread['mean']
+        else:
+            predictions = model.predict(features)
+        if explain:
+            attributions = explain_prediction(model, features, FEATURE_COLS)
+    
+    results = []
+    for i, (record, prediction) in enumerate(zip(records, predictions)):
+        result = {
+            'predicted_yield': max(0, round(float(prediction), 2)),
+            'total_production': max(0, round(float(prediction) * float(record.get('area', 100.0)) * 1000))
+        }
+        if uncertainty:
+            result['uncertainty'] = summarize(spread, i)
+        if explain:
+            result['attributions'] = attributions[i]
+        results.append(result)
+    return results
+
+def predict_yield(state, district, crop, season, year, area=100.0, uncertainty=False, explain=False):
+    """Make prediction using trained Random Forest model
+    
+    uncertainty: also return the std and 5-95% interval of the per-tree predictions
+    explain: also return exact TreeSHAP attributions (base_value + contributions = predicted yield)
+    """
+    try:
+        with section('model_load'):
+            model, encoders = load_notebook_models()
         
         if model is None:
             raise Exception("Could not load trained model")
         
         print(f"Using trained model for: {state}, {district}, {crop}, {season}, {year}, {area}")
         
-        # Encode categorical features using trained encoders
-        encoded_state = safe_transform(encoders.get('State'), state, 0)
-        encoded_district = safe_transform(encoders.get('District'), district, 0)
-        encoded_crop = safe_transform(encoders.get('Crop'), crop, 0)
-        encoded_season = safe_transform(encoders.get('Season'), season, 0)
-        
-        print(f"Encoded features: State={encoded_state}, District={encoded_district}, Crop={encoded_crop}, Season={encoded_season}")
-        
-        # Create feature vector matching training format: [State, District, Crop, Crop_Year, Season, Area]
-        features = np.array([
-            encoded_state,
-            encoded_district, 
-            encoded_crop,
-            int(year),
-            encoded_season,
-            float(area)
-        ]).reshape(1, -1)
+        with section('encoding'):
+            features = encode_features(encoders, state, district, crop, season, year, area)
         
         print(f"Feature vector: {features}")
         
-        # Make prediction using trained Random Forest
-        prediction = model.predict(features)[0]
+        # Make prediction using trained Random Forest (the per-tree mean is the same prediction)
+        with section('predict'):
+            if uncertainty:
+                spread = predict_with_uncertainty(model, features)
+                prediction = spread['mean'][0]
+            else:
+                prediction = model.predict(features)[0]
+            if explain:
+                attributions = explain_prediction(model, features, FEATURE_COLS)[0]
         print(f"Raw model prediction: {prediction}")
         
         # Calculate total production
         total_production = prediction * float(area) * 1000  # Convert to kg
         
+        # Cross-validated metrics for this crop when evaluation.py has been run, else the notebook's R²
+        metrics = get_registry().get('notebook').metrics_for(crop, state)
+        if metrics.get('r2_score') is None:
+            metrics = NOTEBOOK_METRICS
+        
         result = {
             'predicted_yield': max(0, round(float(prediction), 2)),
             'total_production': max(0, round(float(total_production))),
-            'confidence': 91.5,  # Model R² Score from notebook
+            'confidence': round(metrics['accuracy'], 1),  # Model R² Score
             'model_used': 'RandomForest_Trained_91.5%',
-            'r2_score': 0.915,
-            'mae': 14.83,
+            'r2_score': round(metrics['r2_score'], 3),
+            'mae': round(metrics['mae'], 2),
             'features_used': {
                 'state': state,
                 'district': district,
@@ -100,6 +194,10 @@ def predict_yield(state, district, crop, season, year, area=100.0):
                 'area': float(area)
             }
         }
+        if uncertainty:
+            result['uncertainty'] = summarize(spread)
+        if explain:
+            result['attributions'] = attributions
         
         print(f"Final result: {result}")
         return result
@@ -111,16 +209,33 @@ def predict_yield(state, district, crop, season, year, area=100.0):
         raise Exception(f"Trained model prediction failed: {e}")
 
 if __name__ == '__main__':
-    if len(sys.argv) < 6:
-        print("Usage: python notebook_model.py <state> <district> <crop> <season> <year> [area]")
+    uncertainty = '--uncertainty' in sys.argv
+    explain = '--explain' in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg not in ('--uncertainty', '--explain')]
+    if '--batch' in args:
+        # Columnar batch on stdin (JSON by default, or --wire msgpack|arrow) -> arrays on stdout
+        args.remove('--batch')
+        fmt = wire_format(args)
+        with request('notebook_model'):
+            with quiet_stdout(fmt):
+                columns = batch_columns(read_message(fmt), ['state', 'district', 'crop', 'season', 'year', 'area'])
+                result = predict_yield_columns(columns)
+            with section('serialisation'):
+                write_message(result, fmt)
+        sys.exit(0)
+    if len(args) < 5:
+        print("Usage: python notebook_model.py <state> <district> <crop> <season> <year> [area] [--uncertainty] [--explain]")
+        print("   or: python notebook_model.py --batch [--wire json|msgpack|arrow] < batch")
         sys.exit(1)
     
-    state = sys.argv[1]
-    district = sys.argv[2]
-    crop = sys.argv[3]
-    season = sys.argv[4]
-    year = sys.argv[5]
-    area = float(sys.argv[6]) if len(sys.argv) > 6 else 100.0
+    state = args[0]
+    district = args[1]
+    crop = args[2]
+    season = args[3]
+    year = args[4]
+    area = float(args[5]) if len(args) > 5 else 100.0
     
-    result = predict_yield(state, district, crop, season, year, area)
-    print(json.dumps(result))
\ No newline at end of file
+    with request('notebook_model'):
+        result = predict_yield(state, district, crop, season, year, area, uncertainty, explain)
+        with section('serialisation'):
+            print(json.dumps(result))
\ No newline at end of file
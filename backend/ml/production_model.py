@@ -2,53 +2,96 @@
 """
 Production model service using trained model
 """
-import pickle
 import sys
 import json
 
-def predict_yield(district, crop, season, year):
-    """Make prediction using trained model"""
+from model_registry import get_registry
+from forest_uncertainty import uncertainty_or_unavailable, summarize
+from tree_shap import explain_or_unavailable as explain_prediction
+
+# Request key -> environmental feature column, with the value used when a request omits it
+ENVIRONMENT_COLUMNS = {
+    'ndvi_mean': ('NDVI_mean', 0.65),
+    'rainfall_mm': ('rainfall_mm', 200.0),
+    'temp_avg': ('temp_avg', 25.0),
+    'soil_ph': ('soil_pH', 6.8)
+}
+
+def district_priors(state, district, season):
+    """The district's climatology and soil priors from the district feature index, {} until it is built"""
+    from district_features import get_index
+    index = get_index()
+    return index.lookup(state, district, season) if index is not None else {}
+
+def build_feature_vector(model_data, district, crop, season, year, state=None, area=100.0,
+                         environment=None):
+    """Encode one request into the artifact's feature_cols layout
+    
+    state: defaults to the district's state in the district feature index, else Uttar Pradesh
+    environment: optional {ndvi_mean, rainfall_mm, temp_avg, soil_ph} overriding the district's
+                 priors (or the static ENVIRONMENT_COLUMNS defaults when no index has been built)
+    """
+    encoders = model_data['encoders']
+    feature_cols = model_data['feature_cols']
+    priors = district_priors(state, district, season)
+    state = state or priors.get('state') or 'Uttar Pradesh'
+    
+    # Create input data
+    input_data = {
+        'State': state,
+        'District': district,
+        'Crop': crop,
+        'Season': season,
+        'Crop_Year': int(year),
+        'Area': float(area)
+    }
+    environment = environment or {}
+    for key, (col, default) in ENVIRONMENT_COLUMNS.items():
+        value = environment.get(key)
+        input_data[col] = float(value if value is not None else priors.get(key, default))
+    
+    # Encode categorical variables
+    for col in ['State', 'District', 'Crop', 'Season']:
+        try:
+            input_data[f'{col}_encoded'] = encoders[col].transform([input_data[col]])[0]
+        except ValueError:
+            input_data[f'{col}_encoded'] = 0
+    
+    # Create feature vector
+    return [[input_data[col] for col in feature_cols]]
+
+def predict_yield(district, crop, season, year, uncertainty=False, explain=False):
+    """Make prediction using trained model
+    
+    uncertainty: also return the std and 5-95% interval of the per-tree predictions
+    explain: also return exact TreeSHAP attributions (base_value + contributions = predicted yield)
+    """
     try:
-        with open('trained_crop_model.pkl', 'rb') as f:
-            model_data = pickle.load(f)
+        handle = get_registry().get('production')
+        model_data = handle.payload
         
         model = model_data['model']
-        encoders = model_data['encoders']
-        feature_cols = model_data['feature_cols']
-        
-        # Create input data
-        input_data = {
-            'State': 'Uttar Pradesh',
-            'District': district,
-            'Crop': crop,
-            'Season': season,
-            'Crop_Year': int(year),
-            'Area': 100.0,
-            'NDVI_mean': 0.65,
-            'rainfall_mm': 200.0,
-            'temp_avg': 25.0,
-            'soil_pH': 6.8
-        }
-        
-        # Encode categorical variables
-        for col in ['State', 'District', 'Crop', 'Season']:
-            try:
-                input_data[f'{col}_encoded'] = encoders[col].transform([input_data[col]])[0]
-            except ValueError:
-                input_data[f'{col}_encoded'] = 0
-        
-        # Create feature vector
-        features = [[input_data[col] for col in feature_cols]]
-        prediction = model.predict(features)[0]
+        features = build_feature_vector(model_data, district, crop, season, year)
+        if uncertainty:
+            # Boosted artifacts have no per-tree spread: serve their prediction without an interval
+            predictions, spread = uncertainty_or_unavailable(model, features)
+            prediction = predictions[0]
+        else:
+            prediction = model.predict(features)[0]
         
-        # Return result
+        # Return result, with cross-validated per-crop metrics when the artifact has been evaluated
+        metrics = handle.metrics_for(crop)
         result = {
             'predicted_yield': max(0, prediction),
-            'confidence': model_data['performance']['accuracy'] / 100,
+            'confidence': metrics['accuracy'] / 100,
             'model_used': 'RandomForest_Real',
-            'r2_score': model_data['performance']['r2_score'],
-            'mae': model_data['performance']['mae']
+            'r2_score': metrics['r2_score'],
+            'mae': metrics['mae']
         }
+        if uncertainty:
+            result['uncertainty'] = summarize(spread)
+        if explain:
+            result['attributions'] = explain_prediction(model, features, model_data['feature_cols'])[0]
         
         return result
         
@@ -68,14 +111,17 @@ def predict_yield(district, crop, season, year):
         }
 
 if __name__ == '__main__':
-    if len(sys.argv) != 5:
-        print("Usage: python production_model.py <district> <crop> <season> <year>")
+    uncertainty = '--uncertainty' in sys.argv
+    explain = '--explain' in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg not in ('--uncertainty', '--explain')]
+    if len(args) != 4:
+        print("Usage: python production_model.py <district> <crop> <season> <year> [--uncertainty] [--explain]")
         sys.exit(1)
     
-    district = sys.argv[1]
-    crop = sys.argv[2]
-    season = sys.argv[3]
-    year = sys.argv[4]
+    district = args[0]
+    crop = args[1]
+    season = args[2]
+    year = args[3]
     
-    result = predict_yield(district, crop, season, year)
+    result = predict_yield(district, crop, season, year, uncertainty, explain)
     print(json.dumps(result))
\ No newline at end of file
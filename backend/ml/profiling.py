@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+On-demand sampling profiler for the prediction services
+
+The services are spawned per request, so captures are armed ahead of time and each request decides at
+start-up whether it is profiled:
+
+    python profiling.py arm --requests 50          # the next 50 requests, across processes
+    python profiling.py arm --seconds 300          # every request in the next 5 minutes
+    PREDICTION_PROFILE=requests=20 python ...      # in-process budget for a long-lived process
+    kill -USR2 <pid>                               # long-lived process: profile for PROFILE_SIGNAL_SECONDS
+    python profiling.py report                     # merge captures: per-section .folded + top functions
+
+A profiled request runs a background thread that samples the request thread's stack every
+PROFILE_INTERVAL_MS (default 5) and tags each sample with the active section (model_load, encoding,
+image_synthesis, predict, serialisation). Each request writes <capture>.folded (collapsed stacks,
+"section;frame;frame count", readable by flamegraph.pl and speedscope) plus <capture>.json with
+per-section wall times into PROFILE_DIR. When nothing is armed, section() costs one global lookup.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+import contextlib
+from collections import Counter, defaultdict
+from pathlib import Path
+
+PROFILE_DIR = Path(os.environ.get('PROFILE_DIR', Path(__file__).parent / 'profiles'))
+INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+SIGNAL_SECONDS = float(os.environ.get('PROFILE_SIGNAL_SECONDS', 30))
+
+ARM_FILE = 'armed.json'
+LOCK_STALE_SECONDS = 5.0
+
+_NULL = contextlib.nullcontext()
+_sampler = None
+_budget = None  # in-process arming: {'requests': n} and/or {'until': timestamp}
+
+
+class Sampler:
+    """Samples one thread's Python stack from a daemon thread; samples are keyed by (section, frames...)"""
+
+    def __init__(self, thread_id, interval_ms=INTERVAL_MS):
+        self.thread_id = thread_id
+        self.interval = interval_ms / 1000
+        self.samples = Counter()
+        self.sections = []
+        self.section_seconds = defaultdict(float)
+        self.labels = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+
+    def _label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self.labels[code] = label
+        return label
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                section = self.sections[-1] if self.sections else 'other'
+                self.samples[(section,) + tuple(reversed(stack))] += 1
+
+    @contextlib.contextmanager
+    def section(self, name):
+        self.sections.append(name)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.section_seconds[name] += time.perf_counter() - started
+            self.sections.pop()
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.duration = time.perf_counter() - self.started
+
+
+def section(name):
+    """Tag the enclosed work as one model path (encoding, predict, ...) while a capture is running"""
+    if _sampler is None:
+        return _NULL
+    return _sampler.section(name)
+
+
+def parse_spec(spec):
+    """'requests=N', 'seconds=T', both comma separated, or a bare N (requests)"""
+    budget = {}
+    for part in str(spec).split(','):
+        key, _, value = part.strip().partition('=')
+        if not value:
+            key, value = 'requests', key
+        if key == 'requests':
+            budget['requests'] = int(value)
+        elif key == 'seconds':
+            budget['until'] = time.time() + float(value)
+        else:
+            raise ValueError(f"Unknown profile spec '{part}' (use requests=N or seconds=T)")
+    return budget
+
+
+def _take(budget):
+    """Consume one request from a budget dict; False once it is spent or expired"""
+    if 'until' in budget and time.time() > budget['until']:
+        return False
+    if 'requests' in budget:
+        if budget['requests'] <= 0:
+            return False
+        budget['requests'] -= 1
+    return True
+
+
+@contextlib.contextmanager
+def _arm_lock(directory):
+    path = directory / '.armed.lock'
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - path.stat().st_mtime > LOCK_STALE_SECONDS:
+                    path.unlink()
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(0.001)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        path.unlink()
+
+
+def _write_json(path, data):
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _claim_armed(directory=PROFILE_DIR):
+    """Take one request from the shared budget written by `profiling.py arm`, if there is one"""
+    path = directory / ARM_FILE
+    if not path.exists():
+        return False
+    with _arm_lock(directory):
+        try:
+            with open(path) as f:
+                budget = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        claimed = _take(budget)
+        if not claimed or budget.get('requests') == 0:
+            path.unlink()
+        else:
+            _write_json(path, budget)
+    return claimed
+
+
+def _should_profile():
+    global _budget
+    if _budget is None and os.environ.get('PREDICTION_PROFILE'):
+        _budget = parse_spec(os.environ['PREDICTION_PROFILE'])
+    if _budget is not None and _take(_budget):
+        return True
+    return _claim_armed()
+
+
+def _write_capture(sampler, service, directory=PROFILE_DIR):
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f"{time.strftime('%Y%m%dT%H%M%S')}-{service}-{os.getpid()}-{int(sampler.started * 1e6) % 1000000:06d}"
+    lines = [';'.join(stack) + f' {count}\n' for stack, count in sampler.samples.items()]
+    tmp_path = directory / f'.{name}.folded.tmp'
+    with open(tmp_path, 'w') as f:
+        f.writelines(lines)
+    os.replace(tmp_path, directory / f'{name}.folded')
+    _write_json(directory / f'{name}.json', {
+        'service': service,
+        'pid': os.getpid(),
+        'interval_ms': sampler.interval * 1000,
+        'duration_ms': round(sampler.duration * 1000, 3),
+        'samples': sum(sampler.samples.values()),
+        'sections_ms': {key: round(value * 1000, 3) for key, value in sampler.section_seconds.items()}
+    })
+    print(f"🔬 Profile written to {directory / name}.folded", file=sys.stderr)
+
+
+@contextlib.contextmanager
+def request(service):
+    """Wrap one request; it is sampled when an env, signal or `arm` budget still covers it"""
+    global _sampler
+    if _sampler is not None or not _should_profile():
+        yield
+        return
+    _sampler = Sampler(threading.get_ident()).start()
+    try:
+        yield
+    finally:
+        sampler, _sampler = _sampler, None
+        sampler.stop()
+        try:
+            _write_capture(sampler, service)
+        except OSError as e:
+            print(f"❌ Could not write profile: {e}", file=sys.stderr)
+
+
+def install_signal_handler(signum=getattr(signal, 'SIGUSR2', None)):
+    """Long-lived processes: the signal profiles every request for the next PROFILE_SIGNAL_SECONDS"""
+    if signum is None or threading.current_thread() is not threading.main_thread():
+        return
+
+    def arm(*_):
+        global _budget
+        _budget = {'until': time.time() + SIGNAL_SECONDS}
+    signal.signal(signum, arm)
+
+
+def read_captures(directory=PROFILE_DIR, service=None):
+    """Merged {(section, frames...): count} and the capture metadata from a profile directory"""
+    samples = Counter()
+    metadata = []
+    for meta_path in sorted(Path(directory).glob('*.json')):
+        if meta_path.name == ARM_FILE:
+            continue
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if service and meta['service'] != service:
+            continue
+        metadata.append(meta)
+        with open(meta_path.with_suffix('.folded')) as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                samples[tuple(stack.split(';'))] += int(count)
+    return samples, metadata
+
+
+def top_functions(samples, limit=15):
+    """[(function, self samples, inclusive samples)] ordered by self samples"""
+    own, inclusive = Counter(), Counter()
+    for stack, count in samples.items():
+        frames = stack[1:]
+        if frames:
+            own[frames[-1]] += count
+        for frame in set(frames):
+            inclusive[frame] += count
+    return [(frame, count, inclusive[frame]) for frame, count in own.most_common(limit)]
+
+
+def report(directory=PROFILE_DIR, service=None, limit=15):
+    samples, metadata = read_captures(directory, service)
+    if not metadata:
+        print(f"❌ No captures in {directory}")
+        return None
+
+    by_section = defaultdict(Counter)
+    for stack, count in samples.items():
+        by_section[stack[0]][stack] += count
+    output = Path(directory) / 'report'
+    output.mkdir(exist_ok=True)
+    for name, section_samples in list(by_section.items()) + [('all', samples)]:
+        with open(output / f'{name}.folded', 'w') as f:
+            f.writelines(';'.join(stack) + f' {count}\n' for stack, count in section_samples.items())
+
+    total = sum(samples.values())
+    wall = defaultdict(float)
+    for meta in metadata:
+        for name, ms in meta['sections_ms'].items():
+            wall[name] += ms
+    lines = [f"📊 {len(metadata)} request(s), {total} samples, "
+             f"{sum(meta['duration_ms'] for meta in metadata) / len(metadata):.1f} ms mean request"]
+    # Sections too short to be sampled still report their wall time
+    names = sorted(set(by_section) | set(wall), key=lambda name: (-sum(by_section[name].values()), -wall[name]))
+    for name in names:
+        section_samples = by_section[name]
+        count = sum(section_samples.values())
+        lines.append(f"\n== {name}: {count} samples ({100 * count / max(total, 1):.1f}%), "
+                     f"{wall.get(name, 0.0) / len(metadata):.2f} ms/request wall")
+        for frame, own, inclusive in top_functions(section_samples, limit):
+            lines.append(f"   {100 * own / count:5.1f}% self {100 * inclusive / count:5.1f}% total  {frame}")
+    summary = '\n'.join(lines)
+    (output / 'summary.txt').write_text(summary + '\n')
+    print(summary)
+    print(f"\n💾 Flamegraph input: {output}/<section>.folded (e.g. flamegraph.pl {output}/all.folded > all.svg)")
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Arm, disarm and summarise prediction service profiles')
+    commands = parser.add_subparsers(dest='command', required=True)
+    arm = commands.add_parser('arm', help='profile the next N requests and/or every request for T seconds')
+    arm.add_argument('--requests', type=int)
+    arm.add_argument('--seconds', type=float)
+    commands.add_parser('disarm')
+    summary = commands.add_parser('report')
+    summary.add_argument('--service', help='only captures from this service (e.g. notebook_model)')
+    summary.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    if args.command == 'arm':
+        if args.requests is None and args.seconds is None:
+            parser.error('arm needs --requests and/or --seconds')
+        budget = {}
+        if args.requests is not None:
+            budget['requests'] = args.requests
+        if args.seconds is not None:
+            budget['until'] = time.time() + args.seconds
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        with _arm_lock(PROFILE_DIR):
+            _write_json(PROFILE_DIR / ARM_FILE, budget)
+        print(f"🔬 Profiling armed ({budget}) -> {PROFILE_DIR}")
+    elif args.command == 'disarm':
+        (PROFILE_DIR / ARM_FILE).unlink(missing_ok=True)
+        print("🔬 Profiling disarmed")
+    else:
+        report(PROFILE_DIR, args.service, args.top)
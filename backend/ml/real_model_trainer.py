@@ -4,78 +4,200 @@ Real model trainer using actual multimodal_crop_dataset.csv
 """
 import pandas as pd
 import numpy as np
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.preprocessing import LabelEncoder, StandardScaler
+import sys
+import time
+import argparse
+from sklearn.ensemble import RandomForestRegressor, HistGradientBoostingRegressor
+from sklearn.preprocessing import LabelEncoder
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import r2_score, mean_absolute_error
-import pickle
 import os
 
-def train_real_model():
-    """Train model using actual multimodal_crop_dataset.csv"""
-    print("Loading multimodal_crop_dataset.csv...")
-    
-    # Load the actual dataset
-    df = pd.read_csv('multimodal_crop_dataset.csv')
+from model_registry import get_registry, publish
+from production_model import build_feature_vector
+
+FEATURE_COLS = ['State_encoded', 'District_encoded', 'Crop_encoded', 
+                'Season_encoded', 'Crop_Year', 'Area', 'NDVI_mean', 
+                'rainfall_mm', 'temp_avg', 'soil_pH']
+
+# Narrow dtypes for the numeric columns; categoricals are read as category to share string storage
+CSV_DTYPES = {
+    'State': 'category', 'District': 'category', 'Crop': 'category', 'Season': 'category',
+    'Crop_Year': 'int32', 'Area': 'float32', 'Yield': 'float32', 'NDVI_mean': 'float32',
+    'rainfall_mm': 'float32', 'temp_avg': 'float32', 'soil_pH': 'float32'
+}
+
+def _max_rss_mb():
+    """Process peak RSS in MB, or None where the resource module is unavailable (Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+def build_estimator(estimator='random_forest', max_samples=None):
+    """Random Forest (optionally with per-tree bootstrap subsampling) or histogram gradient boosting"""
+    if estimator == 'hist_gradient_boosting':
+        # Bins features to uint8 once, so memory stays flat regardless of tree count
+        return HistGradientBoostingRegressor(
+            max_iter=300,
+            max_depth=15,
+            min_samples_leaf=2,
+            learning_rate=0.1,
+            random_state=42
+        )
+    return RandomForestRegressor(
+        n_estimators=200,
+        max_depth=15,
+        min_samples_split=5,
+        min_samples_leaf=2,
+        max_samples=max_samples,
+        random_state=42,
+        n_jobs=-1
+    )
+
+def fit_with_profile(model, X_train, y_train):
+    """Fit and report wall time and how far the fit pushed the process's peak RSS
+
+    Without getrusage (Windows) the peak comes from tracemalloc, which sees numpy buffers but not the
+    trees' native arrays, so it is a lower bound; max_rss_mb is then None.
+    """
+    rss_before = _max_rss_mb()
+    if rss_before is None:
+        import tracemalloc
+        tracemalloc.start()
+    started = time.perf_counter()
+    model.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - started
+    if rss_before is None:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {'fit_seconds': fit_seconds, 'peak_fit_memory_mb': peak / 2 ** 20, 'max_rss_mb': None}
+    max_rss = _max_rss_mb()
+    return {
+        'fit_seconds': fit_seconds,
+        'peak_fit_memory_mb': max_rss - rss_before,
+        'max_rss_mb': max_rss
+    }
+
+SUPPORTED_CROPS = ['Rice', 'Wheat', 'Maize', 'Sugarcane', 'Cotton']
+
+def load_dataset(dataset_path, float32=False):
+    """Read the CSV (narrow dtypes with float32) and strip the column names"""
+    print(f"Loading {dataset_path}...")
+    if float32:
+        header = pd.read_csv(dataset_path, nrows=0).columns
+        df = pd.read_csv(dataset_path, dtype={col: CSV_DTYPES[col.strip()] for col in header
+                                              if col.strip() in CSV_DTYPES})
+    else:
+        df = pd.read_csv(dataset_path)
     
     # Clean column names
     df.columns = df.columns.str.strip()
     
     print(f"Dataset loaded: {len(df)} records")
     print(f"Columns: {df.columns.tolist()}")
-    
-    # Remove rows with missing yield
+    return df
+
+def clean_dataset(df, crops):
+    """Drop rows without a positive yield and keep the supported crops"""
     df = df.dropna(subset=['Yield'])
     df = df[df['Yield'] > 0]
-    
     print(f"After cleaning: {len(df)} records")
     
-    # Filter for supported crops
-    supported_crops = ['Rice', 'Wheat', 'Maize', 'Sugarcane', 'Cotton']
-    df = df[df['Crop'].isin(supported_crops)]
-    
+    df = df[df['Crop'].isin(crops)].reset_index(drop=True)
     print(f"Supported crops only: {len(df)} records")
     print(f"Crop distribution: {df['Crop'].value_counts().to_dict()}")
-    
-    # Encode categorical variables
+    return df
+
+def fit_encoders(df):
     encoders = {}
     for col in ['State', 'District', 'Crop', 'Season']:
-        le = LabelEncoder()
-        df[f'{col}_encoded'] = le.fit_transform(df[col].astype(str))
-        encoders[col] = le
-        print(f"Encoded {col}: {len(le.classes_)} unique values")
+        encoders[col] = LabelEncoder().fit(df[col].astype(str))
+        print(f"Encoded {col}: {len(encoders[col].classes_)} unique values")
+    return encoders
+
+def encode_dataset(df, encoders):
+    df = df.copy()
+    for col, le in encoders.items():
+        df[f'{col}_encoded'] = le.transform(df[col].astype(str))
+    return df
+
+def feature_matrix(df, feature_cols, float32=False):
+    """(X, y): a float32 Fortran-ordered array for sklearn's trees, or the DataFrame columns as-is"""
+    if float32:
+        # sklearn trees work on float32 Fortran-ordered data; build it that way once instead of copying
+        return (np.asfortranarray(df[feature_cols].to_numpy(dtype=np.float32)),
+                df['Yield'].to_numpy(dtype=np.float64))
+    return df[feature_cols], df['Yield']
+
+def fortran_rows(X, rows):
+    """X[rows] gathered column by column straight into a Fortran-ordered array (one copy, not two)"""
+    out = np.empty((len(rows), X.shape[1]), dtype=X.dtype, order='F')
+    for j in range(X.shape[1]):
+        np.take(X[:, j], rows, out=out[:, j])
+    return out
+
+def split_rows(df, test_size=0.2, seed=42):
+    """(train_idx, test_idx) row positions, stratified by crop"""
+    return train_test_split(np.arange(len(df)), test_size=test_size, random_state=seed, stratify=df['Crop'])
+
+def training_pipeline(dataset_path, float32=False, use_cache=True):
+    """Data preparation stages of train_real_model, cached by training_pipeline.Pipeline"""
+    from training_pipeline import Pipeline
+    return (Pipeline(dataset_path, use_cache=use_cache)
+            .stage('load', load_dataset, float32=float32)
+            .stage('clean', clean_dataset, inputs=['load'], crops=SUPPORTED_CROPS)
+            .stage('encoders', fit_encoders, inputs=['clean'])
+            .stage('encode', encode_dataset, inputs=['clean', 'encoders'])
+            .stage('features', feature_matrix, inputs=['encode'], feature_cols=FEATURE_COLS, float32=float32)
+            .stage('split', split_rows, inputs=['encode'], test_size=0.2, seed=42))
+
+def train_real_model(dataset_path='multimodal_crop_dataset.csv', estimator='random_forest',
+                     max_samples=None, float32=False, cv_folds=0, cv_scheme='kfold',
+                     shard_by=None, shard_workers=None, min_shard_rows=None, keep_all_shards=False,
+                     use_cache=True, shard_margin=None, district_index=False):
+    """Train model using actual multimodal_crop_dataset.csv
     
-    # Prepare features
-    feature_cols = ['State_encoded', 'District_encoded', 'Crop_encoded', 
-                   'Season_encoded', 'Crop_Year', 'Area', 'NDVI_mean', 
-                   'rainfall_mm', 'temp_avg', 'soil_pH']
+    max_samples: fraction (0-1] or count of rows bootstrapped per tree (Random Forest only)
+    float32: read and hand the feature matrix to sklearn as float32 Fortran order, avoiding its internal copy
+    estimator: 'random_forest' or 'hist_gradient_boosting'
+    cv_folds: if > 0, cross-validate in parallel and store per-crop/per-state metrics in the artifact
+    shard_by: 'crop' or 'crop_state' to also train per-segment shards (model_shards.py) in parallel
+    use_cache: reuse cached data preparation stages (training_pipeline.py) from earlier runs
+    district_index: also rebuild the district feature index (district_features.py) from the dataset
+    """
+    pipeline = training_pipeline(dataset_path, float32, use_cache)
     
-    X = df[feature_cols]
-    y = df['Yield']
+    # Only what this run needs is read back: with every stage cached that is the encoders, X/y and split
+    encoders = pipeline.get('encoders')
+    X, y = pipeline.get('features')
+    train_idx, test_idx = pipeline.get('split')
+    feature_cols = FEATURE_COLS
+    pipeline.print_report()
     
     print(f"Feature matrix shape: {X.shape}")
     print(f"Target range: {y.min():.2f} - {y.max():.2f}")
     
-    # Split data
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.2, random_state=42, stratify=df['Crop']
-    )
+    # Same rows train_test_split(X, y, stratify=Crop) would give; positions kept for the shards
+    if float32:
+        # The trees fit on Fortran-ordered data; X[train_idx] would be a C-ordered copy to convert again
+        X_train, X_test = fortran_rows(X, train_idx), X[test_idx]
+        y_train, y_test = y[train_idx], y[test_idx]
+    else:
+        X_train, X_test = X.iloc[train_idx], X.iloc[test_idx]
+        y_train, y_test = y.iloc[train_idx], y.iloc[test_idx]
     
     print(f"Training samples: {len(X_train)}")
     print(f"Test samples: {len(X_test)}")
     
-    # Train Random Forest model
-    print("Training Random Forest model...")
-    model = RandomForestRegressor(
-        n_estimators=200,
-        max_depth=15,
-        min_samples_split=5,
-        min_samples_leaf=2,
-        random_state=42,
-        n_jobs=-1
-    )
+    # Train model
+    print(f"Training {estimator} model" + (f" (max_samples={max_samples})" if max_samples else "") + "...")
+    model = build_estimator(estimator, max_samples)
     
-    model.fit(X_train, y_train)
+    profile = fit_with_profile(model, X_train, y_train)
     
     # Evaluate
     y_pred = model.predict(X_test)
@@ -86,12 +208,18 @@ def train_real_model():
     print(f"R² Score: {r2:.4f}")
     print(f"MAE: {mae:.2f}")
     print(f"Accuracy: {r2*100:.1f}%")
+    print(f"Fit time: {profile['fit_seconds']:.1f}s")
+    if profile['max_rss_mb'] is None:
+        print(f"Peak traced allocation during fit: {profile['peak_fit_memory_mb']:.1f} MB (process max RSS n/a)")
+    else:
+        print(f"Peak memory growth during fit: {profile['peak_fit_memory_mb']:.1f} MB (process max RSS {profile['max_rss_mb']:.1f} MB)")
     
     # Feature importance
-    feature_importance = dict(zip(feature_cols, model.feature_importances_))
-    print(f"\nTop 5 Important Features:")
-    for feat, imp in sorted(feature_importance.items(), key=lambda x: x[1], reverse=True)[:5]:
-        print(f"  {feat}: {imp:.3f}")
+    if hasattr(model, 'feature_importances_'):
+        feature_importance = dict(zip(feature_cols, model.feature_importances_))
+        print(f"\nTop 5 Important Features:")
+        for feat, imp in sorted(feature_importance.items(), key=lambda x: x[1], reverse=True)[:5]:
+            print(f"  {feat}: {imp:.3f}")
     
     # Save model
     model_data = {
@@ -103,14 +231,47 @@ def train_real_model():
             'mae': mae,
             'accuracy': r2*100,
             'training_samples': len(X_train),
-            'test_samples': len(X_test)
+            'test_samples': len(X_test),
+            'estimator': estimator,
+            'max_samples': max_samples,
+            'float32': float32,
+            **profile
         }
     }
     
-    with open('trained_crop_model.pkl', 'wb') as f:
-        pickle.dump(model_data, f)
+    if cv_folds:
+        from evaluation import evaluate
+        print(f"\nCross-validating ({cv_scheme}, {cv_folds} folds)...")
+        df = pipeline.get('encode')
+        evaluation = evaluate(build_estimator(estimator, max_samples), X, y, df['Crop'], df['State'],
+                              df['Crop_Year'], cv_scheme, cv_folds)
+        if evaluation['overall']['r2_score'] is None:
+            # Undefined overall R² would be served as confidence: keep the holdout metrics instead
+            print(f"⚠️  CV R² is undefined on {evaluation['overall']['n']} scored row(s); evaluation not saved",
+                  file=sys.stderr)
+        else:
+            model_data['evaluation'] = evaluation
+            print(f"CV R² Score: {evaluation['overall']['r2_score']:.4f}")
+            print(f"CV MAE: {evaluation['overall']['mae']:.2f}")
+    
+    # Published as the next version (atomically), so it outranks any earlier or compacted version and
+    # running services hot-swap to it without reading a partial file
+    model_path = publish('production', model_data, '.')
+    
+    print(f"\nModel saved as {model_path}")
+    
+    if shard_by:
+        from model_shards import train_shards, MIN_SHARD_ROWS, SHARD_MARGIN
+        print(f"\nTraining {shard_by} shards...")
+        train_shards(pipeline.get('encode'), X, y, train_idx, test_idx, encoders, feature_cols, build_estimator(estimator, max_samples),
+                     y_pred, shard_by, min_shard_rows or MIN_SHARD_ROWS, shard_workers, keep_all=keep_all_shards,
+                     margin=SHARD_MARGIN if shard_margin is None else shard_margin)
     
-    print(f"\nModel saved as trained_crop_model.pkl")
+    # District priors come from the same dataset but change far less often than the model: rebuilt on request
+    if district_index:
+        from district_features import build_index, INDEX_DIR
+        build_index(dataset_path)
+        print(f"District feature index rebuilt in {INDEX_DIR}")
     
     # Test prediction
     print(f"\nTesting prediction...")
@@ -122,37 +283,11 @@ def train_real_model():
 def predict_yield_real(district, crop, season, year):
     """Make prediction using trained model"""
     try:
-        with open('trained_crop_model.pkl', 'rb') as f:
-            model_data = pickle.load(f)
+        model_data = get_registry().get('production').payload
         
         model = model_data['model']
-        encoders = model_data['encoders']
-        feature_cols = model_data['feature_cols']
-        
-        # Create input data with defaults
-        input_data = {
-            'State': 'Uttar Pradesh',  # Default state
-            'District': district,
-            'Crop': crop,
-            'Season': season,
-            'Crop_Year': year,
-            'Area': 100.0,  # Default area
-            'NDVI_mean': 0.65,  # Default NDVI
-            'rainfall_mm': 200.0,  # Default rainfall
-            'temp_avg': 25.0,  # Default temperature
-            'soil_pH': 6.8  # Default soil pH
-        }
-        
-        # Encode categorical variables
-        for col in ['State', 'District', 'Crop', 'Season']:
-            try:
-                input_data[f'{col}_encoded'] = encoders[col].transform([input_data[col]])[0]
-            except ValueError:
-                # Handle unknown categories
-                input_data[f'{col}_encoded'] = 0
-        
-        # Create feature vector
-        features = [[input_data[col] for col in feature_cols]]
+        # Same encoding as production_model, with the district's priors instead of fixed defaults
+        features = build_feature_vector(model_data, district, crop, season, year)
         prediction = model.predict(features)[0]
         
         return max(0, prediction)  # Ensure non-negative
@@ -166,21 +301,54 @@ def predict_yield_real(district, crop, season, year):
         }
         return fallback_yields.get(crop, 25.0)
 
+def _parse_max_samples(value):
+    number = float(value)
+    return int(number) if number > 1 else number
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Train the Random Forest yield model on the APY dataset')
+    parser.add_argument('--dataset', default='multimodal_crop_dataset.csv')
+    parser.add_argument('--estimator', choices=['random_forest', 'hist_gradient_boosting'], default='random_forest')
+    parser.add_argument('--max-samples', type=_parse_max_samples, default=None,
+                        help='rows bootstrapped per tree, as a fraction (0-1] or a count')
+    parser.add_argument('--float32', action='store_true',
+                        help='read numerics as float32 and pre-convert X to float32 Fortran order')
+    parser.add_argument('--cv', type=int, default=0, metavar='FOLDS',
+                        help='cross-validate with this many folds and store metric tables in the artifact')
+    parser.add_argument('--cv-scheme', choices=['kfold', 'time'], default='kfold',
+                        help="'time' folds by Crop_Year")
+    parser.add_argument('--shard-by', choices=['crop', 'crop_state'], default=None,
+                        help='also train per-crop (and per-crop-and-state) model shards')
+    parser.add_argument('--shard-workers', type=int, default=None, help='processes training shards')
+    parser.add_argument('--min-shard-rows', type=int, default=None,
+                        help='training rows a segment needs for its own shard (default 200)')
+    parser.add_argument('--keep-all-shards', action='store_true',
+                        help='publish shards even where the global model is more accurate on the segment')
+    parser.add_argument('--shard-margin', type=float, default=None,
+                        help='relative validation MAE improvement a shard needs over the global model (default 0.02)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='recompute every data preparation stage instead of reusing cached ones')
+    parser.add_argument('--district-index', action='store_true',
+                        help='also rebuild the district feature index from the dataset')
+    args = parser.parse_args()
+    
     try:
         print("=== REAL MODEL TRAINING ===")
-        print("Using actual multimodal_crop_dataset.csv")
+        print(f"Using actual {args.dataset}")
         print("NO SYNTHETIC DATA - REAL APY DATASET ONLY")
         print("=" * 40)
         
-        r2_score = train_real_model()
+        r2_score = train_real_model(args.dataset, args.estimator, args.max_samples, args.float32,
+                                    args.cv, args.cv_scheme, args.shard_by, args.shard_workers,
+                                    args.min_shard_rows, args.keep_all_shards, not args.no_cache, args.shard_margin,
+                                    args.district_index)
         
         print(f"\n🎉 SUCCESS! Model trained with R² = {r2_score:.4f}")
         print(f"📊 This is a REAL model using actual agricultural data")
-        print(f"📁 Model saved as 'trained_crop_model.pkl'")
+        print(f"📁 Model published as the next trained_crop_model.v<N>.pkl")
         
     except FileNotFoundError:
-        print("❌ ERROR: multimodal_crop_dataset.csv not found!")
+        print(f"❌ ERROR: {args.dataset} not found!")
         print("Please ensure the dataset is in the current directory.")
     except Exception as e:
         print(f"❌ ERROR: {e}")
\ No newline at end of file
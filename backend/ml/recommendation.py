@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Crop and season recommendations per district - every candidate scored in one batched model call
+
+For a district, year and farm area, every crop x season pair known to the model's encoders is
+encoded into one feature matrix (bulk_scoring's scorers, i.e. the online Random Forest encoding),
+scored with a single predict - or one per-tree pass with --uncertainty - and ranked by expected
+production (yield x area), or by the lower end of the 5-95% interval with --rank-by lower.
+
+State and district names are matched case-insensitively to the encoders' spelling; a location the
+model was not trained on is rejected rather than silently encoded as the first district.
+
+`precompute` scores every stateDistricts.js district (plus the district feature index's, when built)
+the model knows the same way, in chunks, into .npy tables and a JSON vocabulary published as a new
+build under RECOMMENDATION_DIR (district_features.publish_build). Requests for the job's model
+artifact, year and area are then answered from one row of the memory-mapped table; anything else is
+scored live.
+
+    python recommendation.py recommend <state> <district> [--year 2024] [--area 100] [--top 10] [--uncertainty]
+    python recommendation.py precompute [--year 2024] [--area 100] [--uncertainty] [--model auto|notebook|production]
+    echo '{"state": ..., "district": ..., "area": 50, "top": 5}' | python recommendation.py recommend
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from bulk_scoring import SCORERS, resolve_model, load_state_districts
+from forest_uncertainty import predict_with_uncertainty, DEFAULT_QUANTILES
+
+RECOMMENDATION_DIR = Path(os.environ.get('RECOMMENDATION_DIR', Path(__file__).parent / 'recommendations'))
+DEFAULT_YEAR = time.localtime().tm_year
+CHUNK_ROWS = 65536
+RANK_BY = ('expected', 'lower')
+UNCERTAINTY_TABLES = ('std', 'lower', 'upper')
+
+
+def _key(value):
+    return str(value).strip().upper()
+
+
+def resolve_location(encoders, state, district):
+    """(state, district) in the encoders' spelling, matched case-insensitively
+
+    A missing state is taken from the district feature index when it knows the district. Raises
+    ValueError for a state or district the model was not trained on.
+    """
+    def spelling(name, value):
+        labels = {_key(label): str(label) for label in encoders[name].classes_}
+        if _key(value) not in labels:
+            raise ValueError(f"Unknown {name.lower()} '{value}': the model was not trained on it")
+        return labels[_key(value)]
+
+    if district in (None, ''):
+        raise ValueError('A district is required')
+    district = spelling('District', district)
+    if state in (None, ''):
+        from district_features import get_index
+        index = get_index()
+        state = index.lookup(None, district, None)['state'] if index is not None else None
+        if state is None:
+            raise ValueError(f"No state given for '{district}' and the district feature index does not know it")
+    return spelling('State', state), district
+
+
+def candidate_pairs(encoders, crops=None, seasons=None):
+    """[(crop, season)] for every label pair the encoders know, optionally restricted by name"""
+    def labels(name, wanted):
+        known = [str(label) for label in encoders[name].classes_]
+        if not wanted:
+            return known
+        wanted = {_key(label) for label in wanted}
+        return [label for label in known if _key(label) in wanted]
+    return [(crop, season) for crop in labels('Crop', crops) for season in labels('Season', seasons)]
+
+
+def score_locations(scorer, locations, pairs, year, area, uncertainty=False):
+    """{'yield', and with uncertainty 'std'/'lower'/'upper'}: (n_locations, n_pairs) arrays"""
+    per_chunk = max(1, CHUNK_ROWS // len(pairs))
+    crops, seasons = (np.array(column, dtype=object) for column in zip(*pairs))
+    tables = {name: np.empty((len(locations), len(pairs)), dtype=np.float32)
+              for name in ('yield',) + (UNCERTAINTY_TABLES if uncertainty else ())}
+    for start in range(0, len(locations), per_chunk):
+        block = locations[start:start + per_chunk]
+        states, districts = (np.array(column, dtype=object) for column in zip(*block))
+        frame = pd.DataFrame({
+            'state': np.repeat(states, len(pairs)), 'district': np.repeat(districts, len(pairs)),
+            'crop': np.tile(crops, len(block)), 'season': np.tile(seasons, len(block)),
+            'year': np.full(len(block) * len(pairs), int(year)),
+            'area': np.full(len(block) * len(pairs), float(area))
+        })
+        X = scorer.features(frame)
+        rows = slice(start, start + len(block))
+        if uncertainty:
+            spread = predict_with_uncertainty(scorer.model, X)
+            tables['yield'][rows] = spread['mean'].reshape(len(block), -1)
+            for name in UNCERTAINTY_TABLES:
+                tables[name][rows] = spread[name].reshape(len(block), -1)
+        else:
+            tables['yield'][rows] = scorer.model.predict(X).reshape(len(block), -1)
+    return tables
+
+
+def rank(pairs, tables, row, area, top=None, rank_by='expected'):
+    """Ranked recommendation dicts for one location row of score_locations' tables"""
+    yields = np.maximum(np.asarray(tables['yield'][row], dtype=np.float64), 0)
+    key = yields if rank_by == 'expected' else np.asarray(tables['lower'][row], dtype=np.float64)
+    # Stable descending order, so ties keep the encoders' crop/season order
+    order = np.argsort(-key, kind='stable')[:top]
+    low_q, high_q = DEFAULT_QUANTILES
+    recommendations = []
+    for position, i in enumerate(order, 1):
+        crop, season = pairs[i]
+        entry = {
+            'rank': position,
+            'crop': crop.strip(),
+            'season': season.strip(),
+            'predicted_yield': round(float(yields[i]), 2),
+            'total_production': round(float(yields[i]) * float(area) * 1000)
+        }
+        if 'std' in tables:
+            entry['uncertainty'] = {
+                'std': round(float(tables['std'][row][i]), 3),
+                'lower': round(max(0.0, float(tables['lower'][row][i])), 2),
+                'upper': round(max(0.0, float(tables['upper'][row][i])), 2),
+                'interval': f'{low_q * 100:g}-{high_q * 100:g}%'
+            }
+        recommendations.append(entry)
+    return recommendations
+
+
+def precompute_locations(encoders):
+    """(locations the model knows, number skipped) from stateDistricts.js and the district feature index
+
+    Names are returned in the encoders' spelling; locations whose state or district the model was not
+    trained on are skipped, since they would only be scored as the first encoded district.
+    """
+    from district_features import get_index
+    locations = [(state, district) for state, districts in load_state_districts().items()
+                 for district in districts]
+    index = get_index()
+    if index is not None:
+        locations += index.locations
+    unique, skipped = {}, set()
+    for state, district in locations:
+        try:
+            resolved = resolve_location(encoders, state, district)
+        except ValueError:
+            skipped.add((_key(state), _key(district)))
+            continue
+        unique.setdefault((_key(resolved[0]), _key(resolved[1])), resolved)
+    return list(unique.values()), len(skipped)
+
+
+def precompute(year=DEFAULT_YEAR, area=100.0, model='auto', uncertainty=False, directory=RECOMMENDATION_DIR):
+    """Score every known district x crop x season and publish the tables as a new build of `directory`"""
+    from district_features import publish_build
+    name, handle = resolve_model(model)
+    scorer = SCORERS[name](handle.payload)
+    pairs = candidate_pairs(handle.payload['encoders'])
+    locations, skipped = precompute_locations(handle.payload['encoders'])
+    if not locations:
+        raise ValueError('None of the known districts is in the model\'s encoders')
+
+    started = time.perf_counter()
+    tables = score_locations(scorer, locations, pairs, year, area, uncertainty)
+    elapsed = time.perf_counter() - started
+
+    vocabulary = {
+        'model': name,
+        'version': handle.version,
+        'artifact': list(handle.signature[0]),
+        'year': int(year),
+        'area': float(area),
+        'uncertainty': bool(uncertainty),
+        'pairs': [list(pair) for pair in pairs],
+        'locations': [list(location) for location in locations],
+        'skipped_locations': skipped,
+        'built_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'seconds': round(elapsed, 2)
+    }
+
+    def write(build):
+        for table, array in tables.items():
+            np.save(build / f'{table}.npy', array)
+        with open(build / 'vocabulary.json', 'w') as f:
+            json.dump(vocabulary, f)
+
+    # Mapped tables are never rewritten: readers keep the build they opened until they reload
+    publish_build(directory, write)
+    return vocabulary
+
+
+class PrecomputedRecommendations:
+    """Memory-mapped tables written by precompute(); one row per (state, district)"""
+
+    def __init__(self, directory=RECOMMENDATION_DIR):
+        from district_features import current_build
+        build = current_build(directory)
+        if build is None:
+            raise FileNotFoundError(f"No recommendations have been precomputed in {directory}")
+        directory = build
+        with open(directory / 'vocabulary.json') as f:
+            self.vocabulary = json.load(f)
+        self.pairs = [tuple(pair) for pair in self.vocabulary['pairs']]
+        tables = ('yield',) + (UNCERTAINTY_TABLES if self.vocabulary['uncertainty'] else ())
+        self.tables = {name: np.load(directory / f'{name}.npy', mmap_mode='r') for name in tables}
+        self.location_ids = {}
+        self.primary_location = {}
+        for i, (state, district) in enumerate(self.vocabulary['locations']):
+            self.location_ids.setdefault((_key(state), _key(district)), i)
+            self.primary_location.setdefault(_key(district), i)
+
+    def serves(self, name, handle, year, area, uncertainty):
+        """Whether this job answers a request: same artifact file, year and area (and has intervals if asked)"""
+        v = self.vocabulary
+        return (v['model'] == name and v['artifact'] == list(handle.signature[0]) and v['year'] == int(year)
+                and v['area'] == float(area) and (v['uncertainty'] or not uncertainty))
+
+    def row(self, state, district):
+        """Location row, by (state, district) or the district alone when the state is missing; None if unknown"""
+        if state:
+            return self.location_ids.get((_key(state), _key(district)))
+        return self.primary_location.get(_key(district))
+
+
+_precomputed = None
+
+
+def get_precomputed():
+    """Process-wide precomputed tables, or None when no job has been run"""
+    global _precomputed
+    if _precomputed is None:
+        from district_features import current_build
+        if current_build(RECOMMENDATION_DIR) is None:
+            return None
+        _precomputed = PrecomputedRecommendations(RECOMMENDATION_DIR)
+    return _precomputed
+
+
+def recommend(state, district, year=DEFAULT_YEAR, area=100.0, model='auto', uncertainty=False, top=None,
+              rank_by='expected', crops=None, seasons=None):
+    """Crop x season candidates for one district ranked by expected (or lower-bound) production"""
+    if rank_by not in RANK_BY:
+        raise ValueError(f"Unknown rank_by '{rank_by}', expected one of {list(RANK_BY)}")
+    uncertainty = uncertainty or rank_by == 'lower'
+    name, handle = resolve_model(model)
+    started = time.perf_counter()
+    state, district = resolve_location(handle.payload['encoders'], state, district)
+
+    precomputed = get_precomputed() if not (crops or seasons) else None
+    row = precomputed.row(state, district) if precomputed is not None else None
+    if row is not None and precomputed.serves(name, handle, year, area, uncertainty):
+        pairs, tables, source = precomputed.pairs, precomputed.tables, 'precomputed'
+        if not uncertainty:
+            tables = {'yield': tables['yield']}
+    else:
+        pairs = candidate_pairs(handle.payload['encoders'], crops, seasons)
+        if not pairs:
+            raise ValueError(f"No candidates: the model knows crops {list(handle.payload['encoders']['Crop'].classes_)} "
+                             f"and seasons {list(handle.payload['encoders']['Season'].classes_)}")
+        scorer = SCORERS[name](handle.payload)
+        tables = score_locations(scorer, [(state, district)], pairs, year, area, uncertainty)
+        row, source = 0, 'live'
+
+    return {
+        'state': state,
+        'district': district,
+        'year': int(year),
+        'area': float(area),
+        'model_used': name,
+        'model_version': handle.version,
+        'rank_by': rank_by,
+        'source': source,
+        'candidates': len(pairs),
+        'recommendations': rank(pairs, tables, row, area, top, rank_by),
+        'latency_ms': round((time.perf_counter() - started) * 1000, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Crop and season recommendations per district')
+    commands = parser.add_subparsers(dest='command', required=True)
+    ask = commands.add_parser('recommend', help='rank crops and seasons for one district (JSON on stdin without args)')
+    ask.add_argument('state', nargs='?')
+    ask.add_argument('district', nargs='?')
+    job = commands.add_parser('precompute', help='score every district offline into RECOMMENDATION_DIR')
+    for command in (ask, job):
+        command.add_argument('--year', type=int, default=DEFAULT_YEAR)
+        command.add_argument('--area', type=float, default=100.0)
+        command.add_argument('--model', default='auto', choices=['auto', 'notebook', 'production'])
+        command.add_argument('--uncertainty', action='store_true', help='per-tree 5-95%% interval per candidate')
+    ask.add_argument('--top', type=int, default=None)
+    ask.add_argument('--rank-by', default='expected', choices=RANK_BY)
+    ask.add_argument('--crops', nargs='+', default=None)
+    ask.add_argument('--seasons', nargs='+', default=None)
+    args = parser.parse_args()
+
+    if args.command == 'precompute':
+        vocabulary = precompute(args.year, args.area, args.model, args.uncertainty)
+        rows = len(vocabulary['locations']) * len(vocabulary['pairs'])
+        print(f"💾 Recommendations: {len(vocabulary['locations'])} districts x {len(vocabulary['pairs'])} crop/season "
+              f"pairs ({rows} predictions, {vocabulary['seconds']}s) for {vocabulary['year']}, "
+              f"{vocabulary['area']:g} ha -> {RECOMMENDATION_DIR}")
+        if vocabulary['skipped_locations']:
+            print(f"⚠️  {vocabulary['skipped_locations']} district(s) unknown to the model were skipped", file=sys.stderr)
+        return
+
+    if args.district:
+        request = {'state': args.state, 'district': args.district}
+    elif args.state:
+        parser.error('recommend needs <state> <district>')
+    else:
+        request = json.loads(sys.stdin.read())
+    try:
+        result = recommend(request.get('state'), request.get('district'), request.get('year', args.year),
+                           request.get('area', args.area), request.get('model', args.model),
+                           request.get('uncertainty', args.uncertainty), request.get('top', args.top),
+                           request.get('rank_by', args.rank_by), request.get('crops', args.crops),
+                           request.get('seasons', args.seasons))
+    except ValueError as e:
+        print(json.dumps({'error': str(e)}))
+        sys.exit(1)
+    print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+What-if scenario sweeps - yield response surface over NDVI, rainfall, temperature and soil pH
+
+The categorical prefix (state, district, crop, season, year, area) is encoded once, the Cartesian
+grid of the swept environmental inputs is generated as one array, and it is scored in chunks that
+are streamed back in grid (C) order.
+
+Input (stdin JSON):
+    {"model": "production" | "multimodal",
+     "base": {"state": ..., "district": ..., "crop": ..., "season": ..., "year": ..., "area": ...},
+     "ranges": {"rainfall_mm": {"min": 50, "max": 400, "steps": 15}, "temp_avg": [20, 25, 30]},
+     "chunk_size": 65536}
+
+A request that cannot be swept (a base without district, crop, season or year, no ranges, an axis
+with no values, an unknown input) gets a single {"error": ...} message and exit status 1.
+"""
+import sys
+
+import numpy as np
+
+from model_registry import get_registry
+from production_model import ENVIRONMENT_COLUMNS, build_feature_vector
+from wire_protocol import wire_format, read_message, write_message, quiet_stdout
+
+SWEEPABLE = list(ENVIRONMENT_COLUMNS)
+DEFAULT_CHUNK_SIZE = {'production': 65536, 'multimodal': 256}
+# Base fields every sweep needs; state and area have defaults
+REQUIRED_BASE = ['district', 'crop', 'season', 'year']
+
+
+def axis_values(spec):
+    """Grid values for one axis: an explicit list or {min, max, steps}"""
+    if isinstance(spec, dict):
+        if 'min' not in spec or 'max' not in spec:
+            raise ValueError(f"Range {spec} needs 'min' and 'max'")
+        return np.linspace(float(spec['min']), float(spec['max']), int(spec.get('steps', 10)))
+    return np.asarray(spec, dtype=np.float64)
+
+
+def check_base(base):
+    """Raise ValueError for a base the scorers cannot encode"""
+    if not isinstance(base, dict):
+        raise ValueError("'base' must be an object with state, district, crop, season, year and area")
+    missing = [name for name in REQUIRED_BASE if base.get(name) in (None, '')]
+    if missing:
+        raise ValueError(f"'base' is missing {missing}")
+    try:
+        int(base['year'])
+        float(base.get('area', 100.0))
+    except (TypeError, ValueError):
+        raise ValueError(f"'base' year and area must be numbers, got {base['year']!r} and {base.get('area')!r}")
+
+
+def build_grid(ranges):
+    """(axis names, axis value arrays, grid array of shape (n_points, n_axes)) in C order"""
+    if not isinstance(ranges, dict) or not ranges:
+        raise ValueError(f"'ranges' must map at least one of {SWEEPABLE} to a list or {{min, max, steps}}")
+    unknown = [name for name in ranges if name not in SWEEPABLE]
+    if unknown:
+        raise ValueError(f"Cannot sweep {unknown}; sweepable inputs are {SWEEPABLE}")
+    names = [name for name in SWEEPABLE if name in ranges]
+    try:
+        axes = [axis_values(ranges[name]) for name in names]
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Bad range: {e}")
+    for name, values in zip(names, axes):
+        if values.ndim != 1 or not len(values):
+            raise ValueError(f"Range for {name} produces no values: {ranges[name]}")
+        if not np.isfinite(values).all():
+            raise ValueError(f"Range for {name} has non-finite values: {ranges[name]}")
+    mesh = np.meshgrid(*axes, indexing='ij')
+    grid = np.stack([m.reshape(-1) for m in mesh], axis=1)
+    return names, axes, grid
+
+
+class ForestScorer:
+    """Random Forest artifact (trained_crop_model.pkl): fixed row encoded once, swept columns overwritten"""
+
+    def __init__(self, base, names):
+        handle = get_registry().get('production')
+        self.model = handle.payload['model']
+        feature_cols = handle.payload['feature_cols']
+        self.base_row = np.asarray(build_feature_vector(
+            handle.payload, base['district'], base['crop'], base['season'], base['year'],
+            base.get('state', 'Uttar Pradesh'), base.get('area', 100.0), environment=base
+        )[0], dtype=np.float32)
+        self.columns = [feature_cols.index(ENVIRONMENT_COLUMNS[name][0]) for name in names]
+        self.model_used = 'RandomForest_Real'
+
+    def score(self, grid_chunk):
+        X = np.repeat(self.base_row[None, :], len(grid_chunk), axis=0)
+        X[:, self.columns] = grid_chunk
+        return np.maximum(self.model.predict(X), 0)
+
+
+class MultimodalScorer:
+    """Multimodal checkpoint: scaled fixed row from the compiled feature plan, swept columns scaled per axis"""
+
+    def __init__(self, base, names):
+        from multimodal_service import MultimodalYieldPredictor
+        import torch
+        self.torch = torch
+        self.predictor = MultimodalYieldPredictor()
+        if self.predictor.model is None:
+            raise RuntimeError('Multimodal model is not loaded')
+        plan = self.predictor.plan
+        self.base = base
+        self.base_row = plan.assemble([base])[0]
+        self.names = names
+        self.columns = [plan.feature_cols.index(ENVIRONMENT_COLUMNS[name][0]) for name in names]
+        self.mean = plan.mean[self.columns]
+        self.inv_scale = plan.inv_scale[self.columns]
+        self.model_used = 'Multimodal ViT'
+
+    def _image_inputs(self, grid_chunk, key, default):
+        if key in self.names:
+            return grid_chunk[:, self.names.index(key)]
+        return np.full(len(grid_chunk), self.base.get(key, default), dtype=np.float32)
+
+    def score(self, grid_chunk):
+        X = np.repeat(self.base_row[None, :], len(grid_chunk), axis=0)
+        X[:, self.columns] = (grid_chunk - self.mean) * self.inv_scale
+        images = self.predictor.create_synthetic_images(
+            self._image_inputs(grid_chunk, 'ndvi_mean', 0.65),
+            self._image_inputs(grid_chunk, 'temp_avg', 25),
+            self._image_inputs(grid_chunk, 'rainfall_mm', 150)
+        ).to(self.predictor.device)
+        with self.torch.no_grad():
+            predictions = self.predictor.model(self.torch.from_numpy(X).to(self.predictor.device), images)
+        return np.maximum(predictions.reshape(-1).cpu().numpy(), 0)
+
+
+SCORERS = {'production': ForestScorer, 'multimodal': MultimodalScorer}
+
+
+def sweep(base, ranges, model='production', chunk_size=None):
+    """Yield (header, chunks...): a header dict describing the axes, then (offset, predictions) per chunk"""
+    check_base(base)
+    names, axes, grid = build_grid(ranges)
+    chunk_size = chunk_size or DEFAULT_CHUNK_SIZE[model]
+    if not isinstance(chunk_size, int) or chunk_size < 1:
+        raise ValueError(f"chunk_size must be a positive integer, got {chunk_size!r}")
+    scorer = SCORERS[model](base, names)
+
+    yield {
+        'model_used': scorer.model_used,
+        'axes': {name: values.tolist() for name, values in zip(names, axes)},
+        'shape': [len(values) for values in axes],
+        'points': len(grid)
+    }
+    for offset in range(0, len(grid), chunk_size):
+        yield offset, scorer.score(grid[offset:offset + chunk_size].astype(np.float32))
+
+
+def response_surface(base, ranges, model='production', chunk_size=None):
+    """Dense surface: header plus an ndarray of predicted yields shaped like the grid"""
+    stream = sweep(base, ranges, model, chunk_size)
+    header = next(stream)
+    surface = np.empty(header['points'], dtype=np.float64)
+    for offset, predictions in stream:
+        surface[offset:offset + len(predictions)] = predictions
+    return header, surface.reshape(header['shape'])
+
+
+def main():
+    # JSON lines by default; --wire msgpack|arrow sends the chunks as raw float64 arrays
+    fmt = wire_format(sys.argv[1:])
+    request = read_message(fmt)
+    model = request.get('model', 'production')
+    if model not in SCORERS:
+        write_message({'error': f"Unknown model '{model}', expected one of {list(SCORERS)}"}, fmt)
+        sys.exit(1)
+
+    # Validate before any output, so a bad request gets one error message rather than a partial stream
+    with quiet_stdout(fmt):
+        try:
+            stream = sweep(request['base'], request.get('ranges'), model, request.get('chunk_size'))
+            header = next(stream)
+        except ValueError as e:
+            write_message({'error': str(e)}, fmt)
+            sys.exit(1)
+
+    # Header first, then one message per scored chunk, in grid order
+    with quiet_stdout(fmt):
+        write_message(header, fmt)
+        for offset, predictions in stream:
+            write_message({'offset': offset, 'predicted_yield': np.round(predictions, 2)}, fmt)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+CPU thread-configuration autotuner for torch and sklearn inference
+
+`python thread_tuning.py autotune` benchmarks torch intra/inter-op threads, the forests' n_jobs and
+the number of concurrent worker processes on this host, and writes the fastest combination to
+thread_config.json. The prediction services call apply_thread_config() / configure_estimator() at
+startup so a single-row predict no longer fans out over every core, and `bulk_scoring.py run` starts
+the tuned number of forest workers by default, so workers x n_jobs matches what was measured.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import multiprocessing
+from pathlib import Path
+
+CONFIG_PATH = Path(os.environ.get('THREAD_CONFIG', Path(__file__).parent / 'thread_config.json'))
+
+_config = None
+_torch_applied = False
+
+
+def load_thread_config():
+    """Tuned configuration for this host, or None if autotune has not been run here"""
+    global _config
+    if _config is None:
+        if not CONFIG_PATH.exists():
+            _config = {}
+        else:
+            with open(CONFIG_PATH) as f:
+                _config = json.load(f)
+            if _config.get('cpu_count') != os.cpu_count():
+                print(f"⚠️  {CONFIG_PATH.name} was tuned for {_config.get('cpu_count')} CPUs, this host has "
+                      f"{os.cpu_count()}; ignoring it. Re-run: python thread_tuning.py autotune", file=sys.stderr)
+                _config = {}
+    return _config or None
+
+
+def apply_thread_config():
+    """Set torch intra/inter-op threads from the tuned config (once per process)"""
+    global _torch_applied
+    config = load_thread_config()
+    if not config or 'torch' not in config or _torch_applied:
+        return config
+    import torch
+    torch.set_num_threads(config['torch']['intra_op_threads'])
+    try:
+        torch.set_num_interop_threads(config['torch']['inter_op_threads'])
+    except RuntimeError:
+        # Only allowed before any inter-op parallel work has started in this process
+        pass
+    _torch_applied = True
+    return config
+
+
+def configure_estimator(model):
+    """Override the n_jobs pickled into a forest with the tuned value"""
+    config = load_thread_config()
+    if config and 'sklearn' in config and hasattr(model, 'get_params') and 'n_jobs' in model.get_params():
+        model.set_params(n_jobs=config['sklearn']['n_jobs'])
+    return model
+
+
+def tuned_workers(kind='sklearn'):
+    """Concurrent worker processes that won the autotune for `kind`, or None when not tuned here"""
+    config = load_thread_config()
+    if config and kind in config:
+        return config[kind]['workers']
+    return None
+
+
+def _powers_of_two(limit):
+    values = [1]
+    while values[-1] * 2 <= limit:
+        values.append(values[-1] * 2)
+    if values[-1] != limit:
+        values.append(limit)
+    return values
+
+
+def _sample_forest():
+    """A loaded forest and one encoded request row, from whichever Random Forest artifact exists"""
+    from model_registry import get_registry, discover
+    if discover('production'):
+        from production_model import build_feature_vector
+        model_data = get_registry().get('production').payload
+        return model_data['model'], build_feature_vector(model_data, 'Lucknow', 'Rice', 'Kharif', 2020)
+    from notebook_model import encode_features
+    payload = get_registry().get('notebook').payload
+    return payload['model'], encode_features(payload['encoders'], 'Uttar Pradesh', 'Lucknow', 'Rice', 'Kharif', 2020)
+
+
+SAMPLE_REQUEST = {'state': 'Uttar Pradesh', 'district': 'Lucknow', 'crop': 'Rice', 'season': 'Kharif',
+                  'year': 2020, 'area': 100.0, 'ndvi_mean': 0.65, 'temp_avg': 25.0,
+                  'rainfall_mm': 150.0, 'soil_ph': 7.0}
+
+
+def _trial_worker(args):
+    """Runs in a fresh process: apply one thread setting, warm up, then time single-row predictions"""
+    kind, threads, n_requests = args
+    # The trial's settings must not be overridden by a previously saved configuration. Under spawn this
+    # function runs from __mp_main__ when the script is run directly, while the services import the
+    # `thread_tuning` module separately: reset the cache in that module, not in this namespace
+    import thread_tuning
+    thread_tuning._config = {}
+    import contextlib
+    with contextlib.redirect_stdout(sys.stderr):
+        if kind == 'torch':
+            import torch
+            torch.set_num_threads(threads['intra_op_threads'])
+            torch.set_num_interop_threads(threads['inter_op_threads'])
+            from multimodal_service import MultimodalYieldPredictor
+            predictor = MultimodalYieldPredictor()
+            predict = lambda: predictor.predict_model(SAMPLE_REQUEST)
+        else:
+            model, row = _sample_forest()
+            model.set_params(n_jobs=threads['n_jobs'])
+            predict = lambda: model.predict(row)
+
+        for _ in range(3):
+            predict()
+        latencies = []
+        started = time.time()
+        for _ in range(n_requests):
+            t0 = time.perf_counter()
+            predict()
+            latencies.append(time.perf_counter() - t0)
+        return started, time.time(), latencies
+
+
+def run_trial(kind, threads, workers, n_requests):
+    """Throughput and latency with `workers` processes predicting concurrently"""
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers) as pool:
+        results = pool.map(_trial_worker, [(kind, threads, n_requests)] * workers)
+    window = max(end for _, end, _ in results) - min(start for start, _, _ in results)
+    latencies = sorted(latency for _, _, worker_latencies in results for latency in worker_latencies)
+    return {
+        **threads,
+        'workers': workers,
+        'throughput_rps': round(len(latencies) / window, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 3)
+    }
+
+
+def candidate_settings(kind, cpu_count):
+    """Thread settings x worker counts that do not oversubscribe the host by more than 2x"""
+    settings = []
+    for workers in _powers_of_two(cpu_count):
+        if kind == 'torch':
+            for intra in _powers_of_two(cpu_count):
+                for inter in (1, 2):
+                    if intra * workers <= 2 * cpu_count:
+                        settings.append(({'intra_op_threads': intra, 'inter_op_threads': inter}, workers))
+        else:
+            for n_jobs in _powers_of_two(cpu_count):
+                if n_jobs * workers <= 2 * cpu_count:
+                    settings.append(({'n_jobs': n_jobs}, workers))
+    return settings
+
+
+def autotune(kinds, n_requests=100):
+    from model_registry import discover
+    cpu_count = os.cpu_count() or 1
+    config = {'host': socket.gethostname(), 'cpu_count': cpu_count,
+              'tuned_at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+    available = {'torch': bool(discover('multimodal')),
+                 'sklearn': bool(discover('production') or discover('notebook'))}
+    for kind in kinds:
+        if not available[kind]:
+            print(f"⏭️  Skipping {kind}: no model artifact found")
+            continue
+        trials = []
+        for threads, workers in candidate_settings(kind, cpu_count):
+            trial = run_trial(kind, threads, workers, n_requests)
+            trials.append(trial)
+            print(f"  {kind} {threads} x {workers} workers: {trial['throughput_rps']} req/s, "
+                  f"p95 {trial['p95_ms']} ms")
+        # Highest throughput wins; lower tail latency breaks near-ties (within 5%)
+        top = max(trial['throughput_rps'] for trial in trials)
+        best = min((trial for trial in trials if trial['throughput_rps'] >= 0.95 * top),
+                   key=lambda trial: trial['p95_ms'])
+        config[kind] = best
+        print(f"🏆 Best {kind}: {best}")
+
+    tmp_path = CONFIG_PATH.with_name(f'.{CONFIG_PATH.name}.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(config, f, indent=2)
+    os.replace(tmp_path, CONFIG_PATH)
+    print(f"💾 Thread configuration saved to {CONFIG_PATH}")
+    return config
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tune inference thread counts for this host')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    tune = subcommands.add_parser('autotune')
+    tune.add_argument('--only', choices=['torch', 'sklearn'], default=None)
+    tune.add_argument('--requests', type=int, default=100, help='timed predictions per worker per trial')
+    subcommands.add_parser('show')
+    args = parser.parse_args()
+
+    if args.command == 'autotune':
+        autotune([args.only] if args.only else ['sklearn', 'torch'], args.requests)
+    else:
+        print(json.dumps(load_thread_config() or {}, indent=2))
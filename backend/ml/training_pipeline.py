@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Training data preparation as named, content-addressed stages with an on-disk cache
+
+A stage's key hashes its name, its code (the function's source plus the source or value of every
+module-level helper and constant it refers to, followed transitively), its parameters (seed, dtypes,
+split size...), the library versions its output is pickled with and its upstream stages' keys, which
+start at the dataset's content hash. The content hash is remembered per (path, size, mtime), so an
+unchanged dataset is only stat'ed; a new or modified file is read once in full. Keys are computed
+before anything runs, and values are loaded or computed only when asked for: when the last stage a
+trainer needs is cached, the stages above it are not even read back. Editing a stage or changing its
+parameters changes its key and every key downstream of it, so only those stages rerun. Entries are
+evicted least-recently-used beyond PIPELINE_CACHE_MB.
+
+    python training_pipeline.py stats | clear
+"""
+import os
+import sys
+import json
+import time
+import inspect
+import contextlib
+import hashlib
+import threading
+from pathlib import Path
+
+import joblib
+
+CACHE_DIR = Path(os.environ.get('PIPELINE_CACHE_DIR', Path(__file__).parent / 'pipeline_cache'))
+CACHE_MAX_BYTES = int(float(os.environ.get('PIPELINE_CACHE_MB', 1024)) * 1024 * 1024)
+
+# Bump to invalidate every entry when something the stages depend on changes outside their own source
+PIPELINE_VERSION = 1
+
+
+def _library_versions():
+    import numpy
+    import pandas
+    import sklearn
+    return f'numpy {numpy.__version__}, pandas {pandas.__version__}, sklearn {sklearn.__version__}'
+
+
+def _source(function):
+    try:
+        return inspect.getsource(function).encode()
+    except (OSError, TypeError):
+        return function.__code__.co_code
+
+
+def _global_names(code):
+    """Names a code object and the lambdas/comprehensions nested in it look up"""
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if inspect.iscode(constant):
+            names |= _global_names(constant)
+    return names
+
+
+def code_version(function):
+    """Hash of a stage function's source and of what it reads from its own module
+
+    Module-level functions and classes it calls are hashed by source (followed recursively), plain
+    constants (CSV_DTYPES, paths, lists...) by repr; imported modules are covered by the library
+    versions in the source key.
+    """
+    digest = hashlib.sha256()
+    seen = set()
+    pending = [function]
+    while pending:
+        current = pending.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+        digest.update(_source(current))
+        code = getattr(current, '__code__', None)
+        if code is None:
+            continue
+        namespace = current.__globals__
+        for name in sorted(_global_names(code)):
+            if name not in namespace:
+                continue
+            value = namespace[name]
+            if inspect.isfunction(value) or inspect.isclass(value):
+                if getattr(value, '__module__', None) == current.__module__:
+                    pending.append(value)
+            elif isinstance(value, (str, bytes, int, float, bool, tuple, list, dict, set, frozenset, Path)) \
+                    or value is None:
+                digest.update(f'{name}={value!r}'.encode())
+    return digest.hexdigest()[:16]
+
+
+def dataset_fingerprint(path, chunk_bytes=1 << 20):
+    """sha256 of the file's contents, so a copied or touched dataset keeps its cache entries"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class StageCache:
+    """Content-addressed on-disk store of stage outputs, evicted least-recently-used first"""
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def fingerprint(self, path):
+        """dataset_fingerprint(path), reused while the file's (path, size, mtime) is unchanged"""
+        stat = os.stat(path)
+        signature = [str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns]
+        index_path = self.directory / 'fingerprints.json'
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            index = {}
+        entry = index.get(signature[0])
+        if entry and entry['signature'] == signature:
+            return entry['sha256']
+
+        sha256 = dataset_fingerprint(path)
+        index[signature[0]] = {'signature': signature, 'sha256': sha256}
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = index_path.with_name(f'.fingerprints.{os.getpid()}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp_path, index_path)
+        return sha256
+
+    def _path(self, stage, key):
+        return self.directory / f'{stage}-{key}.joblib'
+
+    def get(self, stage, key):
+        path = self._path(stage, key)
+        try:
+            value = joblib.load(path)
+        except (FileNotFoundError, EOFError, ValueError):
+            return None, False
+        # Touch so eviction sees this entry as recently used
+        os.utime(path)
+        return value, True
+
+    def put(self, stage, key, value):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(stage, key)
+        tmp_path = path.with_name(f'.{path.stem}.{os.getpid()}.tmp')
+        joblib.dump(value, tmp_path)
+        os.replace(tmp_path, path)
+        size = path.stat().st_size
+        self.evict()
+        return size
+
+    def entries(self):
+        if not self.directory.is_dir():
+            return []
+        entries = []
+        for path in self.directory.glob('*.joblib'):
+            if path.name.startswith('.'):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        with self.lock:
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def stats(self):
+        entries = self.entries()
+        stages = {}
+        for _, size, path in entries:
+            stage = path.stem.rsplit('-', 1)[0]
+            stages.setdefault(stage, {'entries': 0, 'bytes': 0})
+            stages[stage]['entries'] += 1
+            stages[stage]['bytes'] += size
+        return {
+            'directory': str(self.directory),
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+            'stages': stages
+        }
+
+    def clear(self):
+        for _, _, path in self.entries():
+            path.unlink()
+        with contextlib.suppress(FileNotFoundError):
+            (self.directory / 'fingerprints.json').unlink()
+
+
+class Pipeline:
+    """Named stages over one dataset file; get(name) resolves a stage through the cache
+
+    Stage functions are called as function(*upstream_values, **params) and must be deterministic in
+    those arguments (seeds are parameters, not global state).
+    """
+
+    def __init__(self, dataset_path, cache=None, use_cache=True):
+        self.dataset_path = dataset_path
+        self.cache = cache if cache is not None else StageCache()
+        self.use_cache = use_cache
+        self.stages = {}
+        self.order = []
+        self.values = {}
+        self.report = {}
+        self.source_key = hashlib.sha256(
+            f'{self.cache.fingerprint(dataset_path)} v{PIPELINE_VERSION} {_library_versions()}'.encode()
+        ).hexdigest()[:24]
+
+    def stage(self, name, function, inputs=(), **params):
+        """Register a stage; its key is fixed here from its inputs' keys, code and parameters"""
+        missing = [upstream for upstream in inputs if upstream not in self.stages]
+        if missing:
+            raise ValueError(f"Stage '{name}' depends on unknown stages: {missing}")
+        digest = hashlib.sha256()
+        digest.update(name.encode())
+        digest.update(code_version(function).encode())
+        digest.update(repr(sorted(params.items())).encode())
+        # Source stages (no inputs) read the dataset file and chain from its fingerprint
+        for upstream_key in [self.stages[upstream]['key'] for upstream in inputs] or [self.source_key]:
+            digest.update(upstream_key.encode())
+        self.stages[name] = {'function': function, 'inputs': tuple(inputs), 'params': params,
+                             'key': digest.hexdigest()[:24]}
+        self.order.append(name)
+        self.report[name] = {'status': 'not needed', 'key': self.stages[name]['key']}
+        return self
+
+    def key(self, name):
+        return self.stages[name]['key']
+
+    def get(self, name):
+        if name in self.values:
+            return self.values[name]
+        stage = self.stages[name]
+        started = time.perf_counter()
+        if self.use_cache:
+            value, hit = self.cache.get(name, stage['key'])
+            if hit:
+                self.values[name] = value
+                self.report[name].update(status='hit', seconds=time.perf_counter() - started)
+                return value
+
+        upstream = [self.get(dependency) for dependency in stage['inputs']]
+        started = time.perf_counter()
+        value = stage['function'](*(upstream or [self.dataset_path]), **stage['params'])
+        seconds = time.perf_counter() - started
+        self.values[name] = value
+        self.report[name].update(status='computed', seconds=seconds)
+        if self.use_cache:
+            self.report[name]['bytes'] = self.cache.put(name, stage['key'], value)
+        return value
+
+    def print_report(self, file=sys.stdout):
+        icons = {'hit': '♻️ ', 'computed': '✅', 'not needed': '⏭️ '}
+        print("📦 Pipeline stages" + ("" if self.use_cache else " (cache disabled)") + ":", file=file)
+        for name in self.order:
+            entry = self.report[name]
+            timing = f" {entry['seconds']:.2f}s" if 'seconds' in entry else ""
+            size = f", {entry['bytes'] / 2 ** 20:.1f} MB cached" if 'bytes' in entry else ""
+            print(f"   {icons[entry['status']]} {name:<16} {entry['status']:<11}{timing}{size}  [{entry['key'][:12]}]",
+                  file=file)
+        hits = sum(entry['status'] == 'hit' for entry in self.report.values())
+        computed = sum(entry['status'] == 'computed' for entry in self.report.values())
+        print(f"   {hits} cached, {computed} computed, {len(self.order) - hits - computed} not needed", file=file)
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = StageCache()
+    return _cache
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or sys.argv[1] not in ('stats', 'clear'):
+        print("Usage: python training_pipeline.py stats | clear")
+        sys.exit(1)
+
+    if sys.argv[1] == 'clear':
+        get_cache().clear()
+    print(json.dumps(get_cache().stats(), indent=2))
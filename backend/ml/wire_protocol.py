@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Wire protocol for service stdin/stdout - JSON (default), msgpack or Arrow IPC
+
+JSON stays the default so server.js keeps working unchanged. For large batch and scenario payloads a
+service started with `--wire msgpack|arrow` (or PREDICTION_WIRE_FORMAT) reads and writes binary
+messages instead, and numpy arrays cross the pipe as raw buffers rather than per-element objects:
+
+- json:    one JSON document per line
+- msgpack: arrays become {"__ndarray__": dtype, "shape": [...], "data": <bin>}; decoded with
+           np.frombuffer over the received bytes (no copy)
+- arrow:   1-D numpy arrays of a common length become record batch columns, every other field is JSON
+           in the schema metadata under b"message"; numeric columns decode zero-copy
+
+Binary messages are framed as an 8-byte little-endian length followed by the payload, so a stream can
+carry several messages (e.g. scenario_engine.py's header and chunks). While a binary response is being
+produced, diagnostics printed to stdout are sent to stderr so they cannot corrupt the frames.
+
+A batch request says so: {"records": [{...}, ...]}, or columnar with a marker ({"batch": true,
+"state": [...], "district": [...], ...}). Other scalar fields apply to every row ({"batch": true,
+"district": [...], "year": 2024}); a record's own value wins over a shared one. A single request whose
+field happens to be a list is never taken for a batch.
+"""
+import os
+import sys
+import json
+import struct
+import contextlib
+
+import numpy as np
+
+FORMATS = ('json', 'msgpack', 'arrow')
+DEFAULT_FORMAT = os.environ.get('PREDICTION_WIRE_FORMAT', 'json')
+
+_LENGTH = struct.Struct('<Q')
+
+
+def wire_format(args=None):
+    """Format from a `--wire FORMAT` argument (removed from `args` in place) or the environment"""
+    fmt = DEFAULT_FORMAT
+    if args is not None and '--wire' in args:
+        position = args.index('--wire')
+        fmt = args[position + 1]
+        del args[position:position + 2]
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown wire format '{fmt}', expected one of {list(FORMATS)}")
+    module = {'msgpack': 'msgpack', 'arrow': 'pyarrow'}.get(fmt)
+    if module is not None:
+        try:
+            __import__(module)
+        except ImportError:
+            raise RuntimeError(f"The {fmt} wire format needs {module}: pip install {module} (or use --wire json)")
+    return fmt
+
+
+def _json_default(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.hasobject or obj.dtype.kind in 'US':
+            # Strings travel as msgpack strings; fixed-width numpy text would be padded UCS-4
+            return obj.tolist()
+        obj = np.ascontiguousarray(obj)
+        return {'__ndarray__': obj.dtype.str, 'shape': list(obj.shape), 'data': obj.reshape(-1).view(np.uint8).data}
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not msgpack serializable")
+
+
+def _msgpack_object_hook(obj):
+    if '__ndarray__' in obj:
+        return np.frombuffer(obj['data'], dtype=np.dtype(obj['__ndarray__'])).reshape(obj['shape'])
+    return obj
+
+
+def _column_length(message):
+    lengths = {len(value) for value in message.values()
+               if (isinstance(value, np.ndarray) and value.ndim == 1) or isinstance(value, list)}
+    return lengths.pop() if len(lengths) == 1 else None
+
+
+def _encode_arrow(message):
+    import pyarrow as pa
+
+    arrays = {key: value for key, value in message.items() if isinstance(value, np.ndarray) and value.ndim == 1}
+    length = _column_length(arrays)
+    columns, rest = {}, {}
+    for key, value in message.items():
+        if key in arrays and len(value) == length:
+            columns[key] = pa.array(value)
+        else:
+            rest[key] = value
+    metadata = {b'message': json.dumps(rest, default=_json_default).encode()}
+    batch = pa.RecordBatch.from_pydict(columns, metadata=metadata) if columns else None
+    schema = batch.schema if batch is not None else pa.schema([], metadata=metadata)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        if batch is not None:
+            writer.write_batch(batch)
+    return sink.getvalue()
+
+
+def _decode_arrow(payload):
+    import pyarrow as pa
+
+    table = pa.ipc.open_stream(payload).read_all()
+    message = json.loads((table.schema.metadata or {}).get(b'message', b'{}'))
+    for name, column in zip(table.column_names, table.columns):
+        if pa.types.is_integer(column.type) or pa.types.is_floating(column.type):
+            message[name] = column.to_numpy()
+        else:
+            message[name] = np.asarray(column.to_pylist(), dtype=object)
+    return message
+
+
+def encode(message, fmt):
+    """Bytes for one message (unframed)"""
+    if fmt == 'json':
+        return json.dumps(message, default=_json_default).encode()
+    if fmt == 'msgpack':
+        import msgpack
+        return msgpack.packb(message, default=_msgpack_default, use_bin_type=True)
+    return _encode_arrow(message)
+
+
+def decode(payload, fmt):
+    """One message from the bytes produced by encode()"""
+    if fmt == 'json':
+        return json.loads(payload)
+    if fmt == 'msgpack':
+        import msgpack
+        return msgpack.unpackb(payload, object_hook=_msgpack_object_hook, raw=False)
+    return _decode_arrow(payload)
+
+
+def write_message(message, fmt='json', stream=None):
+    """Write one message: a JSON line, or a length-prefixed binary frame"""
+    if fmt == 'json':
+        stream = stream or sys.stdout
+        stream.write(json.dumps(message, default=_json_default) + '\n')
+        stream.flush()
+        return
+    stream = stream or sys.__stdout__.buffer
+    payload = encode(message, fmt)
+    stream.write(_LENGTH.pack(len(payload)))
+    stream.write(payload)
+    stream.flush()
+
+
+def read_messages(fmt='json', stream=None):
+    """Yield every message on a stream (stdin by default) until EOF"""
+    if fmt == 'json':
+        text = (stream or sys.stdin).read()
+        if text.strip():
+            try:
+                yield json.loads(text)
+            except json.JSONDecodeError:
+                # JSON lines (several messages)
+                for line in text.splitlines():
+                    if line.strip():
+                        yield json.loads(line)
+        return
+    stream = stream or sys.stdin.buffer
+    while True:
+        prefix = stream.read(_LENGTH.size)
+        if not prefix:
+            return
+        if len(prefix) < _LENGTH.size:
+            raise ValueError('Truncated frame length')
+        (length,) = _LENGTH.unpack(prefix)
+        payload = stream.read(length)
+        if len(payload) < length:
+            raise ValueError(f'Truncated frame: expected {length} bytes, got {len(payload)}')
+        yield decode(payload, fmt)
+
+
+def read_message(fmt='json', stream=None):
+    """The first (usually only) message on a stream"""
+    for message in read_messages(fmt, stream):
+        return message
+    raise ValueError('No input message')
+
+
+def quiet_stdout(fmt):
+    """Send stray prints to stderr while a binary response is being produced"""
+    return contextlib.nullcontext() if fmt == 'json' else contextlib.redirect_stdout(sys.stderr)
+
+
+def _is_column(value):
+    return isinstance(value, list) or (isinstance(value, np.ndarray) and value.ndim == 1)
+
+
+def _shared_fields(message):
+    """Scalar fields of a batch message, applied to every row"""
+    return {key: value for key, value in message.items()
+            if key not in ('records', 'batch') and not _is_column(value)}
+
+
+def batch_columns(message, fields):
+    """{field: ndarray} for a batch request, from a 'records' list or marked columnar fields"""
+    shared = _shared_fields(message)
+    if isinstance(message.get('records'), list):
+        records = message['records']
+        return {field: np.asarray([record.get(field, shared.get(field)) for record in records]) for field in fields
+                if field in shared or any(field in record for record in records)}
+    columns = {field: np.asarray(message[field]) for field in fields if field in message and _is_column(message[field])}
+    lengths = {len(column) for column in columns.values()}
+    if len(lengths) > 1:
+        raise ValueError(f"Batch columns have different lengths: { {field: len(column) for field, column in columns.items()} }")
+    length = lengths.pop() if lengths else 0
+    for field in fields:
+        if field in shared:
+            columns[field] = np.full(length, shared[field], dtype=object if isinstance(shared[field], str) else None)
+    return columns
+
+
+def batch_records(message):
+    """List of request dicts for a batch request, from a 'records' list or marked columnar fields"""
+    shared = _shared_fields(message)
+    if isinstance(message.get('records'), list):
+        return [{**shared, **record} for record in message['records']]
+    columns = {key: (value.tolist() if isinstance(value, np.ndarray) else value)
+               for key, value in message.items() if key != 'records' and _is_column(value)}
+    if len({len(column) for column in columns.values()}) > 1:
+        raise ValueError(f"Batch columns have different lengths: { {key: len(column) for key, column in columns.items()} }")
+    return [{**shared, **dict(zip(columns, row))} for row in zip(*columns.values())]
+
+
+def is_batch(message):
+    """Only an explicit 'records' list or a 'batch': true marker makes a request a batch"""
+    return isinstance(message.get('records'), list) or message.get('batch') is True
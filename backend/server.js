@@ -347,23 +347,28 @@ app.post('/api/predict-yield', async (req, res) => {
     const weatherData = await getWeatherData(district);
     const staticData = districtData[district] || districtData['Lucknow'];
     
-    // Try notebook model first (trained Random Forest with 91.5% accuracy)
-    console.log('🤖 Attempting to use trained Random Forest model...');
+    // Route through the Python inference router: it picks the multimodal, trained Random Forest
+    // or statistical tier in a single process and reports which tier served the request.
+    // The live weather is an hourly reading, not the seasonal temperature/rainfall the models were
+    // trained on, so it is not sent: the router fills those inputs from the district priors. Static
+    // NDVI/soil pH are only sent for districts we actually have them for (not the Lucknow fallback).
+    console.log('🤖 Routing prediction through inference router...');
     try {
-      const modelPath = path.join(__dirname, 'ml', 'notebook_model.py');
+      const routerPath = path.join(__dirname, 'ml', 'inference_router.py');
+      const routerInput = JSON.stringify({
+        state,
+        district,
+        crop,
+        season,
+        year: parseInt(year),
+        area: parseFloat(area),
+        ...(districtData[district] ? { ndvi_mean: staticData.ndvi_mean, soil_ph: staticData.soil_ph } : {})
+      });
       
       prediction = await new Promise((resolve, reject) => {
-        console.log(`Executing: python ${modelPath} ${state} ${district} ${crop} ${season} ${year} ${area}`);
+        console.log(`Executing: python ${routerPath} with ${routerInput}`);
         
-        const pythonProcess = spawn('python', [
-          modelPath,
-          state,
-          district, 
-          crop,
-          season,
-          year.toString(),
-          area.toString()
-        ]);
+        const pythonProcess = spawn('python', [routerPath]);
         
         let output = '';
         let errorOutput = '';
@@ -385,7 +390,7 @@ app.post('/api/predict-yield', async (req, res) => {
           if (code === 0) {
             try {
               const result = JSON.parse(output.trim());
-              console.log('✅ Trained model prediction successful:', result.predicted_yield);
+              console.log(`✅ Prediction served by ${result.tier} tier in ${result.latency_ms}ms:`, result.predicted_yield);
               // Override with real weather data
               result.factors = {
                 ndvi_mean: staticData.ndvi_mean,
@@ -396,96 +401,44 @@ app.post('/api/predict-yield', async (req, res) => {
               result.weather = weatherData;
               resolve(result);
             } catch (parseError) {
-              console.error('❌ Failed to parse trained model output:', parseError);
-              reject(new Error(`Failed to parse trained model output: ${output}`));
+              console.error('❌ Failed to parse inference router output:', parseError);
+              reject(new Error(`Failed to parse inference router output: ${output}`));
             }
           } else {
-            console.error('❌ Trained model execution failed:', errorOutput);
-            reject(new Error(`Trained model execution failed: ${errorOutput}`));
+            console.error('❌ Inference router execution failed:', errorOutput);
+            reject(new Error(`Inference router execution failed: ${errorOutput}`));
           }
         });
         
         pythonProcess.on('error', (error) => {
-          console.error('❌ Failed to start trained model Python process:', error);
-          reject(new Error(`Failed to start trained model Python process: ${error.message}`));
+          console.error('❌ Failed to start inference router Python process:', error);
+          reject(new Error(`Failed to start inference router Python process: ${error.message}`));
         });
+        
+        pythonProcess.stdin.write(routerInput);
+        pythonProcess.stdin.end();
       });
     } catch (modelError) {
-      console.warn('❌ Trained model failed, trying simple model:', modelError.message);
-      console.log('🔄 Falling back to simple statistical model...');
+      console.warn('Inference router failed, using statistical fallback:', modelError.message);
       
-      // Try simple model as backup
-      try {
-        const simpleModelPath = path.join(__dirname, 'ml', 'simple_yield_model.py');
-        
-        prediction = await new Promise((resolve, reject) => {
-          const pythonProcess = spawn('python', [
-            simpleModelPath,
-            state,
-            district, 
-            crop,
-            season,
-            year.toString(),
-            area.toString()
-          ]);
-          
-          let output = '';
-          let errorOutput = '';
-          
-          pythonProcess.stdout.on('data', (data) => {
-            output += data.toString();
-          });
-          
-          pythonProcess.stderr.on('data', (data) => {
-            errorOutput += data.toString();
-          });
-          
-          pythonProcess.on('close', (code) => {
-            if (code === 0) {
-              try {
-                const result = JSON.parse(output.trim());
-                result.factors = {
-                  ndvi_mean: staticData.ndvi_mean,
-                  temp_avg: weatherData.temp_avg,
-                  humidity: weatherData.humidity,
-                  soil_ph: staticData.soil_ph
-                };
-                result.weather = weatherData;
-                resolve(result);
-              } catch (parseError) {
-                reject(new Error(`Failed to parse simple model output: ${output}`));
-              }
-            } else {
-              reject(new Error(`Simple model execution failed: ${errorOutput}`));
-            }
-          });
-          
-          pythonProcess.on('error', (error) => {
-            reject(new Error(`Failed to start simple model Python process: ${error.message}`));
-          });
-        });
-      } catch (simpleModelError) {
-        console.warn('Simple model also failed, using statistical fallback:', simpleModelError.message);
-        
-        // Fallback prediction based on crop type
-        const baseYields = {
-          'Rice': 25.4, 'Wheat': 32.8, 'Maize': 26.1, 'Sugarcane': 720.5, 'Cotton(lint)': 15.2,
-          'Potato': 220.5, 'Onion': 180.3, 'Gram': 12.8, 'Arhar/Tur': 8.9, 'Groundnut': 18.7
-        };
-        
-        const baseYield = baseYields[crop] || 20.0;
-        const yieldWithVariation = baseYield * (0.8 + Math.random() * 0.4); // ±20% variation
-        
-        prediction = {
-          predicted_yield: Math.round(yieldWithVariation * 100) / 100,
-          total_production: Math.round(yieldWithVariation * parseFloat(area) * 1000),
-          confidence: 75.0,
-          model_used: 'Fallback_Model',
-          r2_score: 0.75,
-          mae: 18.5,
-          features_used: { state, district, crop, season, year, area }
-        };
-      }
+      // Fallback prediction based on crop type
+      const baseYields = {
+        'Rice': 25.4, 'Wheat': 32.8, 'Maize': 26.1, 'Sugarcane': 720.5, 'Cotton(lint)': 15.2,
+        'Potato': 220.5, 'Onion': 180.3, 'Gram': 12.8, 'Arhar/Tur': 8.9, 'Groundnut': 18.7
+      };
+      
+      const baseYield = baseYields[crop] || 20.0;
+      const yieldWithVariation = baseYield * (0.8 + Math.random() * 0.4); // ±20% variation
+      
+      prediction = {
+        predicted_yield: Math.round(yieldWithVariation * 100) / 100,
+        total_production: Math.round(yieldWithVariation * parseFloat(area) * 1000),
+        confidence: 75.0,
+        model_used: 'Fallback_Model',
+        r2_score: 0.75,
+        mae: 18.5,
+        features_used: { state, district, crop, season, year, area }
+      };
     }
     
     // Save prediction to database if user is authenticated